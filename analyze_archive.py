@@ -1,17 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
 import os
-import requests
 import sys
 from collections import Counter
 
+from mastotools.config import read_config
+from mastotools.index import open_index
+from mastotools.inventory import human_size
+from mastotools.likes import LikeClassifier
+from mastotools.stats import DIRECT, FOLLOWERS_ONLY, PUBLIC
+
+# the plugin's config next to this script, for additional rules to classify
+# likes and the cache of profile checks
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "config.yaml")
+
+
 if len(sys.argv) != 2:
     print("script expects one parameter; just one; try harder")
+    print("(batch_analyze.py takes as many archives as you like)")
     sys.exit()
 else:
-    archive_path = sys.argv[1]
+    # extracted archive folder or the zip/tar file itself; the archive is
+    # read once and reduced to an index stored next to it, later runs only
+    # load the index
+    index = open_index(sys.argv[1],
+                       classifier=LikeClassifier.from_config(
+                           read_config(CONFIG, ("like_platforms",))),
+                       )
 
 HLINE = """
 ********************************************************
@@ -25,69 +42,13 @@ print("""
 
 # ### TOOTS ###
 
-with open(os.path.join(archive_path,
-                       "outbox.json",
-                       )) as f:
-    data = json.load(f)
-
-tl = data["orderedItems"]
-
-posttype, to, inreplyto, boostedusers, year, tags = [], [], [], [], [], []
-import_list = []
-orph_counter, tagged_posts = 0, 0
-vanished_users, broken_conversations = [], []
-
-for value in tl:
-    try:
-        # Create = toot or Announce = boost
-        posttype.append(value["type"])
-        # user name list of boosts
-        if value["type"] == "Announce":
-            boostedusers.append(value["cc"][0])
-        # public posts, followers only posts, direct messages
-        if value["object"]["to"][0].endswith("#Public"):
-            to.append("public")
-        elif value["object"]["to"][0].endswith("/followers"):
-            to.append("followers only")
-        else:
-            to.append("direct message")
-        # original toots and replies
-        if value["object"]["inReplyTo"] is None:
-            inreplyto.append(None)
-        else:
-            # only add user name
-            inreplyto.append(
-                value["object"]["inReplyTo"].split("/statuses")[0])
-        # publishing year, first 4 characters of publishing date
-        year.append(value["published"][:4])
-        # hashtags
-        for tag in value["object"]["tag"]:
-            if tag["type"] == "Hashtag":
-                tags.append(tag["name"])
-                tagged_posts += 1
-
-        if value["type"] == "Create" and value["object"]["inReplyTo"] is None:
-            # count orphaned replies
-            _firstline = value["object"]["content"].split("</p>")[0][3:]
-            # post starts with addressing user by leading @ 
-            # not hyperlinked
-            if _firstline.startswith("@"):
-                orph_counter += 1
-                vanished_users.append(_firstline.split()[0])
-            # hyperlinked
-            elif _firstline.startswith("<span class=\"h-card\"><a href=") \
-                    and "class=\"u-url mention\">@<span>" in _firstline:
-                orph_counter += 1
-                broken_conversations.append(_firstline.split("\"")[3])
-
-    except (TypeError, IndexError):
-        pass
+stats = index.timeline_stats()
 
 # number of toots
-print("total number of toots:", len(tl))
+print("total number of toots:", stats.total)
 
 # number of boosts
-print("among them boosts:", Counter(posttype)["Announce"])
+print("among them boosts:", stats.posttype["Announce"])
 
 print(HLINE)
 
@@ -95,55 +56,52 @@ print(HLINE)
 print("most boosted users (10)")
 print("~~~~~~~~~~~~~~~~~~~~~~~")
 
-for u, i in Counter(boostedusers).most_common(10):
+for u, i in stats.boosted.most_common(10):
     print("{:>4}: {}".format(i, u))
 
-print("\nboosted users (total):", len(Counter(boostedusers)))
+print("\nboosted users (total):", len(stats.boosted))
 
 print(HLINE)
 
 # public posts, follower only posts, direct messages
-print("public posts:", Counter(to)["public"])
-print("followers only posts:", Counter(to)["followers only"])
-print("direct messages:", Counter(to)["direct message"])
+print("public posts:", stats.visibility[PUBLIC])
+print("followers only posts:", stats.visibility[FOLLOWERS_ONLY])
+print("direct messages:", stats.visibility[DIRECT])
 
 print(HLINE)
 
 # original toots and replies
-print("original toots:", Counter(inreplyto)[None])
-print("among them orphaned replies:", orph_counter)
-print("replies:", len(inreplyto) - Counter(inreplyto)[None])
-print("posts with hashtags:", tagged_posts)
+print("original toots:", stats.originals)
+print("among them orphaned replies:", stats.orphaned)
+print("replies:", stats.replies)
+print("posts with hashtags:", stats.tagged_posts)
 
 print(HLINE)
 
-# remove None values from list
-
-inreplyto = [x for x in inreplyto if x is not None]
 print("most replied profiles (20)")
 print("~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
-for u, i in Counter(inreplyto).most_common(20):
+for u, i in stats.replied.most_common(20):
     print("{:>4}: {}".format(i, u))
 
-print("\nreplied users (total):", len(Counter(inreplyto)))
+print("\nreplied users (total):", len(stats.replied))
 
 
 print("\nmost replied profiles that are no longer available (20)")
 print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
-for u, i in Counter(vanished_users).most_common(20):
+for u, i in stats.vanished.most_common(20):
     print("{:>4}: {}".format(i, u))
 
-print("\nreplied users (total):", len(Counter(vanished_users)))
+print("\nreplied users (total):", len(stats.vanished))
 
 print("\nprofiles with broken conversations (20)")
 print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
-for u, i in Counter(broken_conversations).most_common(20):
+for u, i in stats.broken.most_common(20):
     print("{:>4}: {}".format(i, u))
     
-print("\nreplied users (total):", len(Counter(broken_conversations)))
+print("\nreplied users (total):", len(stats.broken))
 
 print(HLINE)
 
@@ -151,7 +109,7 @@ print(HLINE)
 print("publishing year")
 print("~~~~~~~~~~~~~~~~")
 
-for key, value in sorted(Counter(year).items()):
+for key, value in sorted(stats.years.items()):
     print("{}: {:>5}".format(key, value))
 
 print(HLINE)
@@ -160,146 +118,129 @@ print(HLINE)
 print("popular hashtags (25)")
 print("~~~~~~~~~~~~~~~~~~~~~")
 
-for tag, i in Counter(tags).most_common(25):
-    print("{:>4}: {}".format(i, tag))
+for tag, i in stats.hashtags.most_common(25):
+    print("{:>4}: #{}".format(i, tag))
 
-print("\nhashtags (total):", len(Counter(tags)))
+print("\nhashtags (total):", len(stats.hashtags))
 
 print(HLINE)
 
 # ### LIKES ###
 
-with open(os.path.join(archive_path,
-                       "likes.json",
-                       )) as f:
-    data = json.load(f)
-
-likes = data["orderedItems"]
-
-fedi = []
-masto_users = []
-
-for i in likes:
-    if i.startswith("tag") or i.startswith("urn"):
-        fedi.append("unknown (vanished posts)")
-    elif "/users/" in i:
-        fedi.append("Mastodon")
-        masto_users.append(i.split("/statuses")[0])
-    elif "/p/" in i:
-        fedi.append("Pixelfed")
-    elif "/objects/" in i:
-        fedi.append("Pleroma")
-    elif "/item/" in i:
-        fedi.append("Hubzilla")
-    elif "/videos/" in i:
-        fedi.append("PeerTube")
-    elif "/notes/" in i:
-        fedi.append("Misskey")
-    else:
-        fedi.append("unknown ({})".format(i))
+likes = index.like_stats()
 
 print("likes")
 print("~~~~~")
 
 # number of likes
-print("total:", len(likes))
+print("total:", likes.total)
 
 # count by platform
 print("liked posts by platform:")
 
-for platform, i in Counter(fedi).most_common():
+for platform, i in likes.platforms.most_common():
     print("{:>6}: {}".format(i, platform))
 
 print(HLINE)
 
-# most liked Mastodon profiles
-print("most liked Mastodon profiles (50)")
-print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+# instances of liked posts
+print("most liked instances (20)")
+print("~~~~~~~~~~~~~~~~~~~~~~~~~")
+
+for domain, i in likes.instances.most_common(20):
+    print("{:>6}: {}".format(i, domain))
+
+print("\nliked instances (total):", len(likes.instances))
+
+print(HLINE)
+
+# most liked profiles
+print("most liked profiles (50)")
+print("~~~~~~~~~~~~~~~~~~~~~~~~")
 
-for profile, i in Counter(masto_users).most_common(50):
+for profile, i in likes.profiles.most_common(50):
     print("{:>4}: {}".format(i, profile))
 
-print("\nliked profiles (total):", len(Counter(masto_users)))
+print("\nliked profiles (total):", len(likes.profiles))
 
 print(HLINE)
 
 # ### MEDIA ATTACHMENTS ###
 
-filetypes = []
-for root, dirs, files in os.walk(os.path.join(archive_path,
-                                              "media_attachments",
-                                              "files",
-                                              )):
-    for filename in files:
-        if filename.split(".")[1] in ["jpg", "jpeg", "png", "gif"]:
-            filetypes.append("Image")
-        elif filename.split(".")[1] in ["mp4", "webm", "mov"]:
-            filetypes.append("Video")
-        elif filename.split(".")[1] in ["mp3", "m4a", "wav", "mov"]:
-            filetypes.append("Audio")
-        else:
-            filetypes.append(filename.split(".")[1])
-
-print("number of media attachments:", len(filetypes))
+media = index.media_inventory()
+
+print("media attachments")
+print("~~~~~~~~~~~~~~~~~")
+
+print("number of media attachments:", len(media.files))
+print("total size:", human_size(media.total))
 print("media files by type:")
 
-for t, i in Counter(filetypes).most_common():
-    print("{:>5}: {}".format(i, t))
+for t, i in media.count.most_common():
+    print("{:>5}: {} ({})".format(i, t, human_size(media.size[t])))
+
+print("\nlargest files (10)")
+print("~~~~~~~~~~~~~~~~~~")
+
+for name, size in media.largest(10):
+    print("{:>10}: {}".format(human_size(size), name))
+
+print("\nidentical files (10)")
+print("~~~~~~~~~~~~~~~~~~~~")
+
+for size, names in media.duplicates[:10]:
+    print("{:>3} x {:>10}: {}".format(len(names), human_size(size),
+                                      ", ".join(names)))
+
+print("\ngroups of identical files (total):", len(media.duplicates))
+print("space taken by copies:", human_size(media.wasted))
 
 print(HLINE)
 
 # ######## check which users are still available ######## 
 
-while True:
+
+def check_profiles(what, profiles):
+
+    """
+        ask and check if profiles (most frequent first) are up, profiles
+        are checked concurrently
+    """
+
     q = input(
-        "Do you want to check if your most frequently boosted profiles (50) "
-        "are currently up? This may take a while... (y/N)> ")
-    if q == "y":
-        status = []
-        for url, _ in Counter(boostedusers).most_common(50):
-            try:
-                status.append(requests.head(url).status_code)
-            except requests.exceptions.SSLError:
-                status.append("SSL error")
-            except requests.exceptions.ConnectionError:
-                status.append("connection error")
-            print(url, status[-1])
-        print("number of different profiles boosted:", len(status),
-              "of which are:")
-        print(Counter(status)[200] + Counter(status)[302], "available")
-        print(
-            Counter(status)["SSL error"] + Counter(status)["connection error"],
-            "currently not available")
-        print(Counter(status)[404], "no more existing")
-        break
-    else:
-        print("That's a 'no'.")
-        break
+        "Do you want to check if your {} profiles ({}) are currently up? "
+        "(y/N)> ".format(what, len(profiles)))
+    if q != "y":
+        return False
+    # requests takes a while to import, it's only needed from here on
+    from mastotools.cache import ReachabilityCache
+    from mastotools.checker import ProfileChecker, UNAVAILABLE
+
+    config = read_config(CONFIG, ("check_cache",))
+    checker = ProfileChecker(cache=ReachabilityCache.from_config(config))
+    status = checker.check(url for url, _ in profiles)
+    for url, _ in profiles:
+        print(url, status[url])
+    status = Counter(status.values())
+    print("number of different profiles checked:", len(profiles),
+          "of which are:")
+    print("({} known from earlier checks, {} on unreachable instances not "
+          "requested)".format(checker.cached, checker.skipped))
+    print(status[200] + status[302], "available")
+    print(sum(status[s] for s in UNAVAILABLE), "currently not available")
+    print(status[404], "no more existing")
+    return True
+
+
+if not check_profiles("boosted", stats.boosted.most_common()):
+    print("That's a 'no'.")
 
 print(HLINE)
 
-while True:
-    q = input(
-        "Do you want to check if your most replied Mastodon profiles (50) "
-        "are currently up? This may take a while... (y/N)> ")
-    if q == "y":
-        status = []
-        for url, _ in Counter(inreplyto).most_common(50):
-            try:
-                status.append(requests.head(url).status_code)
-            except requests.exceptions.SSLError:
-                status.append("SSL error")
-            except requests.exceptions.ConnectionError:
-                status.append("connection error")
-            print(url, status[-1])
-        print("number of different profiles checked:", len(status),
-              "of which are:")
-        print(Counter(status)[200] + Counter(status)[302], "available")
-        print(
-            Counter(status)["SSL error"] + Counter(status)["connection error"],
-            "currently not available")
-        print(Counter(status)[404], "no more existing")
-        break
-    else:
-        print("OK, then we are done here. Bye.")
-        break
+if not check_profiles("replied", stats.replied.most_common()):
+    print("That's a 'no'.")
+
+print(HLINE)
+
+if not check_profiles("liked", likes.profiles.most_common()):
+    print("OK, then we are done here. Bye.")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    analyze many Mastodon archives at once without any prompts
+
+    archives (folders, zip or tar files, or folders containing them) are
+    analyzed in parallel by a pool of processes, the numbers of every
+    archive and of all of them together are written as JSON and/or CSV,
+    e.g. from cron:
+
+        batch_analyze.py --json stats.json --csv stats.csv /srv/exports/
+
+    the exit status is 1 if an archive could not be read
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mastotools.batch import (
+    aggregate,
+    analyze,
+    csv_rows,
+    find_archives,
+    without_values,
+)
+from mastotools.config import read_config
+
+# the plugin's config next to this script, for additional rules to classify
+# likes and the number of workers
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "config.yaml")
+
+
+def analyze_all(paths, config, workers):
+
+    """
+        summaries of all archives in the order of paths, progress is
+        printed to stderr
+    """
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze, path, config): path
+                   for path in paths}
+        for nr, future in enumerate(as_completed(futures), 1):
+            summary = future.result()
+            results[futures[future]] = summary
+            print("[{}/{}] {}: {}".format(nr,
+                                          len(paths),
+                                          summary["path"],
+                                          summary.get("error", "ok"),
+                                          ),
+                  file=sys.stderr)
+    return [results[path] for path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("paths", nargs="+",
+                        help="archive folders/zip/tar files or folders "
+                             "containing them")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write numbers as JSON (- for stdout, the "
+                             "default if --csv isn't given either)")
+    parser.add_argument("--csv", metavar="FILE",
+                        help="write one row per archive and the totals as "
+                             "CSV (- for stdout)")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes (default: number of "
+                             "cores)")
+    args = parser.parse_args()
+    if not args.json and not args.csv:
+        args.json = "-"
+
+    paths = find_archives(args.paths)
+    if not paths:
+        print("no archives found", file=sys.stderr)
+        return 1
+
+    config = read_config(CONFIG, ("like_platforms", "workers"))
+    summaries = analyze_all(paths, config, args.workers or config.get("workers"))
+    total = aggregate(summaries)
+    summaries = [without_values(summary) for summary in summaries]
+
+    if args.json:
+        with _output(args.json) as f:
+            json.dump({"archives": summaries, "total": total}, f, indent=2)
+            f.write("\n")
+    if args.csv:
+        with _output(args.csv, newline="") as f:
+            csv.writer(f).writerows(csv_rows(summaries, total))
+
+    return 1 if total["failed"] else 0
+
+
+def _output(name, newline=None):
+    if name == "-":
+        # don't close stdout
+        return open(sys.stdout.fileno(), "w", encoding="utf-8",
+                    newline=newline, closefd=False)
+    return open(name, "w", encoding="utf-8", newline=newline)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
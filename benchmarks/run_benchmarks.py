@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    time the phases of the import plugin and analyze_archive.py
+
+    every phase runs in a process of its own so its peak memory (RSS) can be
+    measured, results are printed as a table and stored as JSON; with a
+    baseline from a previous run phases that got slower than the tolerance
+    are reported and the script exits with status 1
+
+    the startup phases time loading the plugin (which every nikola command
+    does) and the modules of analyze_archive.py; they also fail if heavy
+    dependencies are imported on the way
+
+    $ ./run_benchmarks.py --toots 10000
+    $ ./run_benchmarks.py path/to/archive --output new.json --baseline old.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+PHASES = ("analyze_timeline",
+          "prepare_content",
+          "import_posts",
+          "import_posts_rerun",
+          "watermark_images",
+          "analyze_archive_cold",
+          "analyze_archive_warm",
+          "plugin_startup",
+          "analyzer_startup",
+          )
+
+STARTUP = ("plugin_startup", "analyzer_startup")
+# startup takes milliseconds, the fastest of some runs is taken
+STARTUP_RUNS = 5
+# modules only the code paths needing them may import
+HEAVY_MODULES = ("yaml",
+                 "PIL",
+                 "requests",
+                 "urllib3",
+                 "multiprocessing",
+                 "concurrent.futures.process",
+                 )
+
+# answers to the questions of analyze_archive.py
+NO = "n\nn\nn\n"
+
+
+def _maxrss_mb(ru_maxrss):
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        return ru_maxrss / 2 ** 20
+    return ru_maxrss / 2 ** 10
+
+
+def _folder_size(folder):
+    size = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+# ### phases, run in a child process ###
+
+
+class Phase:
+
+    """
+        set up what a phase needs, the timed part is the method named
+        after the phase
+    """
+
+    def __init__(self, archive, workdir, workers):
+        sys.path.insert(0, REPO_DIR)
+        import yaml
+        from mastotools.source import open_archive
+        from import_mastodon import CommandImportMastodon
+
+        self.archive = archive
+        self.workdir = workdir
+        self.workers = workers
+        self.source = open_archive(archive, staging=workdir)
+        with self.source.open_text("actor.json") as f:
+            self.account = json.load(f)["id"]
+
+        with open(os.path.join(REPO_DIR, "config.yaml")) as f:
+            self.config = yaml.safe_load(f)
+        # import as much as possible
+        self.config.update(followers_only=True,
+                           replytoself=True,
+                           originalsource=True,
+                           watermark=True,
+                           watermark_text="Don't copy that floppy!",
+                           workers=workers,
+                           tags={"include": None, "exclude": None},
+                           )
+        CommandImportMastodon.populate_context(self.account, self.config)
+
+        self.cmd = CommandImportMastodon()
+        self.cmd.site = SimpleNamespace(config={})
+        self.cmd.config = self.config
+        self.cmd.source = self.source
+        self.cmd.output_folder = os.path.join(workdir, "site")
+
+    def timeline(self):
+        return self.source.ordered_items("outbox.json")
+
+    def import_list(self):
+        return self.cmd.analyze_timeline(self.timeline(),
+                                         True,
+                                         self.account,
+                                         True,
+                                         self.config["tags"],
+                                         )
+
+    def analyze_timeline(self):
+        items = sum(1 for _ in self.import_list())
+        return items, self.source.stat("outbox.json")[0]
+
+    def prepare_content(self):
+        from mastotools.manifest import Manifest
+        from mastotools.posts import PostWriter
+
+        writer = PostWriter(self.config,
+                            self.cmd.output_folder,
+                            self.source,
+                            Manifest(self.cmd.output_folder),
+                            )
+        posts = [(post.content, writer.tags_and_media(post))
+                 for post in self.import_list()]
+
+        start = time.perf_counter()
+        size = 0
+        for content, (_, image_files, media_files) in posts:
+            size += len(writer.prepare_content(content,
+                                               image_files,
+                                               media_files,
+                                               self.config["domain"],
+                                               ))
+        # media files are only planned to be copied, see mastotools.plan
+        return len(posts), size, time.perf_counter() - start
+
+    def import_posts(self):
+        manifest = self._import()
+        return len(manifest.posts), _folder_size(self.cmd.output_folder)
+
+    def import_posts_rerun(self):
+        self._import()
+        start = time.perf_counter()
+        manifest = self._import()
+        return (len(manifest.posts),
+                _folder_size(self.cmd.output_folder),
+                time.perf_counter() - start,
+                )
+
+    def watermark_images(self):
+        manifest = self._import()
+        images = os.path.join(self.cmd.output_folder, "images")
+        count = sum(1 for key in manifest.media if key.startswith("images/"))
+        size = _folder_size(images)
+        self._plan()
+        self.cmd.plan_watermarks(self.config["watermark_text"])
+        start = time.perf_counter()
+        self.cmd.watermark_images(images, self.config["watermark_text"])
+        return count, size, time.perf_counter() - start
+
+    def _plan(self):
+        from mastotools.plan import ImportPlan
+
+        self.cmd.plan = ImportPlan(self.cmd.output_folder,
+                                   defer_copies=self.source.sequential,
+                                   )
+        self.cmd.plan.start(self.cmd.manifest)
+
+    def _import(self):
+        from mastotools.manifest import Manifest
+
+        self.cmd.manifest = Manifest(self.cmd.output_folder)
+        self._plan()
+        self.cmd.import_posts(self.timeline(),
+                              True,
+                              self.account,
+                              self.config,
+                              )
+        if self.cmd.plan.copies:
+            self.cmd.copy_media()
+        self.cmd.manifest.save()
+        self.cmd.plan.remove()
+        return self.cmd.manifest
+
+
+def startup(name):
+
+    """
+        time loading the plugin like Nikola does (by path, with Nikola
+        already imported) or the modules of analyze_archive.py, returns
+        (seconds, heavy modules imported)
+    """
+
+    import importlib.util
+    import runpy
+
+    if name == "plugin_startup":
+        import nikola.plugin_categories  # noqa: F401
+        import nikola.plugins.basic_import  # noqa: F401
+        import nikola.plugins.command.init  # noqa: F401
+
+    before = set(sys.modules)
+    start = time.perf_counter()
+    if name == "plugin_startup":
+        spec = importlib.util.spec_from_file_location(
+            "import_mastodon", os.path.join(REPO_DIR, "import_mastodon.py"))
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    else:
+        # without an archive the script stops after its imports
+        sys.argv = ["analyze_archive.py"]
+        sys.path.insert(0, REPO_DIR)
+        try:
+            runpy.run_path(os.path.join(REPO_DIR, "analyze_archive.py"))
+        except SystemExit:
+            pass
+    seconds = time.perf_counter() - start
+    heavy = [m for m in HEAVY_MODULES
+             if m in sys.modules and m not in before]
+    return seconds, heavy
+
+
+def run_phase(name, archive, workdir, workers):
+
+    """
+        run a phase and print its result as JSON, phases return
+        (items, bytes) or (items, bytes, seconds) if only a part of it is
+        timed
+    """
+
+    if name in STARTUP:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            seconds, heavy = startup(name)
+        print(json.dumps({"seconds": seconds,
+                          "items": 1,
+                          "bytes": None,
+                          "heavy_modules": heavy,
+                          }))
+        return
+
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        phase = Phase(archive, workdir, workers)
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        result = getattr(phase, name)()
+        seconds = time.perf_counter() - start
+        phase.source.close()
+
+    if len(result) == 3:
+        items, size, seconds = result
+    else:
+        items, size = result
+    print(json.dumps({"seconds": seconds,
+                      "setup_seconds": setup,
+                      "items": items,
+                      "bytes": size,
+                      # peak of the largest worker process
+                      "workers_peak_rss_mb": _maxrss_mb(resource.getrusage(
+                          resource.RUSAGE_CHILDREN).ru_maxrss),
+                      }))
+
+
+# ### harness ###
+
+
+def measure(cmd, stdin=""):
+
+    """
+        run a command, returns (stdout, wall time, peak RSS in MB)
+    """
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd,
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            cwd=REPO_DIR,
+                            text=True,
+                            )
+    proc.stdin.write(stdin)
+    proc.stdin.close()
+    out = proc.stdout.read()
+    proc.stdout.close()
+    # reap the process ourselves to get its resource usage
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError("{} failed with status {}".format(
+            " ".join(cmd), proc.returncode))
+    return out, seconds, _maxrss_mb(usage.ru_maxrss)
+
+
+def benchmark(name, archive, workers, total):
+
+    """
+        run a phase in a fresh process, returns its result dict
+    """
+
+    if name in STARTUP:
+        runs = []
+        for _ in range(STARTUP_RUNS):
+            out, _, peak = measure([sys.executable,
+                                    os.path.abspath(__file__),
+                                    "--phase", name,
+                                    ])
+            runs.append(json.loads(out.splitlines()[-1]))
+        result = min(runs, key=lambda r: r["seconds"])
+    elif name.startswith("analyze_archive"):
+        if name.endswith("cold"):
+            shutil.rmtree(os.path.normpath(archive) + ".index",
+                          ignore_errors=True)
+        _, seconds, peak = measure([sys.executable,
+                                    os.path.join(REPO_DIR,
+                                                 "analyze_archive.py"),
+                                    archive,
+                                    ],
+                                   NO,
+                                   )
+        result = {"seconds": seconds, "items": total, "bytes": None}
+    else:
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        try:
+            out, _, peak = measure([sys.executable,
+                                    os.path.abspath(__file__),
+                                    "--phase", name,
+                                    "--workers", str(workers),
+                                    "--workdir", workdir,
+                                    archive,
+                                    ])
+            result = json.loads(out.splitlines()[-1])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # peak of the phase's (main) process, worker processes are reported
+    # separately by the phase
+    result["peak_rss_mb"] = peak
+    result["items_per_sec"] = result["items"] / result["seconds"] \
+        if result["seconds"] else None
+    result["mb_per_sec"] = result["bytes"] / 2 ** 20 / result["seconds"] \
+        if result["bytes"] and result["seconds"] else None
+    return result
+
+
+def outbox_total(archive):
+    sys.path.insert(0, REPO_DIR)
+    from mastotools.source import open_archive
+
+    with open_archive(archive) as source:
+        reader = source.ordered_items("outbox.json")
+        return sum(1 for _ in reader)
+
+
+def compare(results, baseline, tolerance):
+
+    """
+        return phases with a throughput below the baseline by more than
+        tolerance
+    """
+
+    slower = []
+    for name, result in results["phases"].items():
+        old = baseline.get("phases", {}).get(name)
+        if not old or not old.get("items_per_sec") \
+                or not result["items_per_sec"]:
+            continue
+        ratio = result["items_per_sec"] / old["items_per_sec"]
+        if ratio < 1 - tolerance:
+            slower.append((name, ratio))
+    return slower
+
+
+def fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("archive", nargs="?",
+                        help="archive folder/zip/tar.gz (default: generate "
+                             "one with --toots)")
+    parser.add_argument("--toots", type=int, default=10000,
+                        help="size of the generated archive")
+    parser.add_argument("--format", choices=("folder", "zip", "tar.gz"),
+                        default="folder",
+                        help="format of the generated archive")
+    parser.add_argument("--phases", nargs="+", choices=PHASES,
+                        default=PHASES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline",
+                        help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed loss of throughput (default: 0.2)")
+    # internal, run a single phase
+    parser.add_argument("--phase", choices=PHASES, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        run_phase(args.phase, args.archive, args.workdir, args.workers)
+        return
+
+    tmp = None
+    # the phases run with the repository as working directory
+    if args.archive is not None:
+        args.archive = os.path.abspath(args.archive)
+    archive = args.archive
+    # startup phases don't need an archive
+    needs_archive = any(name not in STARTUP for name in args.phases)
+    if archive is None and needs_archive:
+        sys.path.insert(0, BENCH_DIR)
+        from synthetic_archive import generate, pack
+
+        tmp = tempfile.mkdtemp(prefix="bench-archive-")
+        archive = os.path.join(tmp, "archive")
+        print("...generate archive with {} toots...".format(args.toots))
+        generate(archive, args.toots)
+        if args.format != "folder":
+            archive = pack(archive, args.format)
+
+    results = {"archive": archive,
+               "toots": args.toots if args.archive is None and needs_archive
+               else None,
+               "workers": args.workers,
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "phases": {},
+               }
+    try:
+        total = outbox_total(archive) if archive else None
+        for name in args.phases:
+            print("...{}...".format(name))
+            results["phases"][name] = benchmark(name,
+                                                archive,
+                                                args.workers,
+                                                total,
+                                                )
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    print()
+    print("{:<22}{:>10}{:>10}{:>12}{:>10}{:>10}".format(
+        "phase", "seconds", "items", "items/sec", "MB/sec", "RSS MB"))
+    for name, r in results["phases"].items():
+        print("{:<22}{:>10}{:>10}{:>12}{:>10}{:>10}".format(
+            name,
+            fmt(r["seconds"], ".2f"),
+            r["items"],
+            fmt(r["items_per_sec"], ".0f"),
+            fmt(r["mb_per_sec"], ".1f"),
+            fmt(r["peak_rss_mb"], ".0f"),
+            ))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print()
+    print("results written to", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for name, ratio in slower:
+            print("REGRESSION: {} at {:.0%} of baseline throughput".format(
+                name, ratio))
+    else:
+        slower = []
+
+    heavy = [(name, r["heavy_modules"])
+             for name, r in results["phases"].items()
+             if r.get("heavy_modules")]
+    for name, modules in heavy:
+        print("REGRESSION: {} imports {}".format(name, ", ".join(modules)))
+    if slower or heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    generate a synthetic Mastodon archive for benchmarking
+
+    the archive has the same structure as a real export (outbox.json,
+    actor.json, likes.json, media_attachments/files/...), toots are written
+    one at a time so even a million toots don't need much memory
+
+    $ ./synthetic_archive.py --toots 10000 path/to/archive
+    $ ./synthetic_archive.py --toots 100000 --format tar.gz archive
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import tarfile
+import zipfile
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+PUBLIC = "https://www.w3.org/ns/activitystreams#Public"
+
+DOMAIN = "https://example.social"
+USERNAME = "me"
+
+# share of the media attachments by type
+MEDIA_TYPES = (("image/png", ".png", 0.6),
+               ("image/jpeg", ".jpg", 0.25),
+               ("video/mp4", ".mp4", 0.1),
+               ("audio/mpeg", ".mp3", 0.05),
+               )
+
+# liked posts by URL pattern, see mastotools.likes
+LIKE_PATTERNS = ("{}/users/{}/statuses/{}",
+                 "{}/p/{}/{}",
+                 "{}/objects/{}-{}",
+                 "{}/item/{}-{}",
+                 "{}/videos/watch/{}-{}",
+                 "{}/notes/{}{}",
+                 )
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua ut enim "
+         "ad minim veniam quis nostrud exercitation ullamco laboris nisi "
+         "aliquip ex ea commodo consequat duis aute irure in reprehenderit "
+         "voluptate velit esse cillum fugiat nulla pariatur").split()
+
+
+class Generator:
+
+    """
+        random toots, likes and media files with reproducible results for a
+        given seed
+    """
+
+    def __init__(self, toots, media_ratio=0.2, reply_ratio=0.3,
+                 self_reply_ratio=0.5, boost_ratio=0.15, tag_ratio=0.4,
+                 tags=200, tag_skew=1.1, instances=200, profiles=5000,
+                 likes=None, seed=1):
+        self.toots = toots
+        self.media_ratio = media_ratio
+        self.reply_ratio = reply_ratio
+        self.self_reply_ratio = self_reply_ratio
+        self.boost_ratio = boost_ratio
+        self.tag_ratio = tag_ratio
+        self.likes = toots if likes is None else likes
+        self.random = random.Random(seed)
+
+        self.actor = "{}/users/{}".format(DOMAIN, USERNAME)
+        self.tags = ["tag{}".format(i) for i in range(tags)]
+        # zipf-like distribution, a few hashtags are used all the time
+        self.tag_weights = list(accumulate(1 / (i + 1) ** tag_skew
+                                           for i in range(tags)))
+        self.instances = ["https://instance{}.example".format(i)
+                          for i in range(instances)]
+        self.profiles = ["{}/users/user{}".format(
+                             self.random.choice(self.instances), i)
+                         for i in range(profiles)]
+        self.media_weights = list(accumulate(w for _, _, w in MEDIA_TYPES))
+        self.media_count = 0
+        # encoded images by size, see image()
+        self._images = {}
+
+    def words(self, n):
+        return " ".join(self.random.choice(WORDS) for _ in range(n))
+
+    def activities(self):
+
+        """
+            yield (activity, [(archive path, media type)]) in outbox order
+        """
+
+        rnd = self.random
+        published = datetime(2017, 4, 1, tzinfo=timezone.utc)
+        # the timeline covers a few years no matter how many toots
+        step = timedelta(days=6 * 365) / max(self.toots, 1)
+        own = []
+
+        for n in range(self.toots):
+            published += step
+            date = published.strftime("%Y-%m-%dT%H:%M:%SZ")
+            status = "{}/statuses/{}".format(self.actor, 100000000 + n)
+
+            if rnd.random() < self.boost_ratio:
+                profile = rnd.choice(self.profiles)
+                yield {"id": status + "/activity",
+                       "type": "Announce",
+                       "actor": self.actor,
+                       "published": date,
+                       "to": [PUBLIC],
+                       "cc": [profile, self.actor + "/followers"],
+                       "object": "{}/statuses/{}".format(
+                           profile, rnd.randrange(10 ** 9)),
+                       }, []
+                continue
+
+            r = rnd.random()
+            if r < 0.8:
+                to, cc = [PUBLIC], [self.actor + "/followers"]
+            elif r < 0.95:
+                to, cc = [self.actor + "/followers"], []
+            else:
+                to, cc = [rnd.choice(self.profiles)], []
+
+            content = "<p>{}</p>".format(self.words(rnd.randint(5, 40)))
+            in_reply_to = None
+            r = rnd.random()
+            if r < self.reply_ratio:
+                if own and rnd.random() < self.self_reply_ratio:
+                    in_reply_to = rnd.choice(own)
+                else:
+                    profile = rnd.choice(self.profiles)
+                    in_reply_to = "{}/statuses/{}".format(
+                        profile, rnd.randrange(10 ** 9))
+                    content = self.mention(profile) + content
+            elif r < self.reply_ratio + 0.03:
+                # orphaned reply, the replied toot is gone
+                content = self.mention(rnd.choice(self.profiles)) + content
+            own.append(status)
+            del own[:-50]
+
+            tag = []
+            if rnd.random() < self.tag_ratio:
+                # no set, its order would change from run to run
+                names = rnd.choices(self.tags,
+                                    cum_weights=self.tag_weights,
+                                    k=rnd.randint(1, 3))
+                for name in dict.fromkeys(names):
+                    tag.append({"type": "Hashtag",
+                                "href": "{}/tags/{}".format(DOMAIN, name),
+                                "name": "#" + name,
+                                })
+                    content += ("<p><a href=\"{}/tags/{}\" class=\"mention "
+                                "hashtag\" rel=\"tag\">#<span>{}</span></a>"
+                                "</p>").format(DOMAIN, name, name)
+
+            attachment, files = [], []
+            if rnd.random() < self.media_ratio:
+                for _ in range(rnd.choice((1, 1, 1, 2, 4))):
+                    attachment.append(self.attachment(files))
+                # the occasional extra link to the media file
+                content += "<p><a href=\"{}/media/{}\">{}/media/</a></p>" \
+                    .format(DOMAIN, n, DOMAIN)
+
+            yield {"id": status + "/activity",
+                   "type": "Create",
+                   "actor": self.actor,
+                   "published": date,
+                   "to": to,
+                   "cc": cc,
+                   "object": {"id": status,
+                              "type": "Note",
+                              "summary": None,
+                              "inReplyTo": in_reply_to,
+                              "published": date,
+                              "url": "{}/@{}/{}".format(DOMAIN, USERNAME,
+                                                        100000000 + n),
+                              "attributedTo": self.actor,
+                              "to": to,
+                              "cc": cc,
+                              "sensitive": False,
+                              "content": content,
+                              "attachment": attachment,
+                              "tag": tag,
+                              },
+                   }, files
+
+    @staticmethod
+    def mention(profile):
+        return ("<p><span class=\"h-card\"><a href=\"{}\" class=\"u-url "
+                "mention\">@<span>{}</span></a></span> </p>").format(
+                    profile, profile.rsplit("/", 1)[1])
+
+    def attachment(self, files):
+        mediatype, ext, _ = MEDIA_TYPES[bisect(self.media_weights,
+                                               self.random.random()
+                                               * self.media_weights[-1])]
+        n = self.media_count
+        self.media_count += 1
+        path = "/media_attachments/files/{:03d}/{:03d}/{:03d}/original/" \
+               "{:016x}{}".format(n // 1000000 % 1000,
+                                  n // 1000 % 1000,
+                                  n % 1000,
+                                  self.random.getrandbits(64),
+                                  ext,
+                                  )
+        files.append((path, mediatype))
+        return {"type": "Document",
+                "mediaType": mediatype,
+                "url": path,
+                "name": self.words(6) if self.random.random() < 0.5 else None,
+                "blurhash": "UBL_:rOpGG-oBUNG,qRj2so|=eE1w^n4S5NH",
+                }
+
+    def media(self, mediatype):
+
+        """
+            content of a media file, images are real (small) images that
+            can be watermarked, audio/video files are random bytes
+        """
+
+        rnd = self.random
+        if mediatype.startswith("image/"):
+            size = rnd.choice(((320, 240), (640, 480), (1280, 720),
+                               (1920, 1080)))
+            # some bytes after the end of the image keep files unique
+            return self.image(size, mediatype) + rnd.randbytes(16)
+        return rnd.randbytes(rnd.randint(50, 500) * 1024)
+
+    def image(self, size, mediatype):
+        key = size, mediatype
+        if key not in self._images:
+            from PIL import Image, ImageDraw
+
+            im = Image.new("RGB", size, (40, 90, 140))
+            draw = ImageDraw.Draw(im)
+            for i in range(0, size[0], 16):
+                draw.line((i, 0, size[0] - i, size[1]),
+                          fill=(i % 256, 200, 100), width=3)
+            buf = io.BytesIO()
+            im.save(buf, "PNG" if mediatype == "image/png" else "JPEG")
+            self._images[key] = buf.getvalue()
+        return self._images[key]
+
+    def liked(self):
+        rnd = self.random
+        for n in range(self.likes):
+            r = rnd.random()
+            if r < 0.02:
+                yield "tag:{},2019:objectId={}".format(
+                    rnd.choice(self.instances).split("//")[1], n)
+            elif r < 0.85:
+                yield "{}/statuses/{}".format(rnd.choice(self.profiles),
+                                              rnd.randrange(10 ** 9))
+            else:
+                yield rnd.choice(LIKE_PATTERNS[1:]).format(
+                    rnd.choice(self.instances),
+                    "user{}".format(rnd.randrange(1000)),
+                    rnd.randrange(10 ** 9))
+
+    def actor_json(self):
+        return {"@context": "https://www.w3.org/ns/activitystreams",
+                "id": self.actor,
+                "type": "Person",
+                "following": self.actor + "/following",
+                "followers": self.actor + "/followers",
+                "inbox": self.actor + "/inbox",
+                "outbox": "outbox.json",
+                "preferredUsername": USERNAME,
+                "name": "Synthetic user",
+                "summary": "<p>generated for benchmarks</p>",
+                "url": "{}/@{}".format(DOMAIN, USERNAME),
+                }
+
+
+def write_collection(f, id, items, total):
+
+    """
+        write an OrderedCollection, items are written as they come
+    """
+
+    f.write(json.dumps({"@context": "https://www.w3.org/ns/activitystreams",
+                        "id": id,
+                        "type": "OrderedCollection",
+                        "totalItems": total,
+                        })[:-1])
+    f.write(", \"orderedItems\": [")
+    for n, item in enumerate(items):
+        if n:
+            f.write(", ")
+        f.write(json.dumps(item))
+    f.write("]}")
+
+
+def generate(folder, toots, **options):
+
+    """
+        write a synthetic archive to folder, returns the Generator
+    """
+
+    gen = Generator(toots, **options)
+    os.makedirs(folder, exist_ok=True)
+
+    def items():
+        for activity, files in gen.activities():
+            for path, mediatype in files:
+                dst = os.path.join(folder, *path.split("/")[1:])
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                with open(dst, "wb") as f:
+                    f.write(gen.media(mediatype))
+            yield activity
+
+    with open(os.path.join(folder, "outbox.json"), "w") as f:
+        write_collection(f, "outbox.json", items(), toots)
+    with open(os.path.join(folder, "likes.json"), "w") as f:
+        write_collection(f, "likes.json", gen.liked(), gen.likes)
+    with open(os.path.join(folder, "actor.json"), "w") as f:
+        json.dump(gen.actor_json(), f)
+    return gen
+
+
+def pack(folder, fmt):
+
+    """
+        pack an archive folder into folder.zip or folder.tar.gz, returns
+        the file name
+    """
+
+    names = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            names.append((path, os.path.relpath(path, folder)))
+
+    if fmt == "zip":
+        filename = folder.rstrip(os.sep) + ".zip"
+        with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as z:
+            for path, name in names:
+                z.write(path, name)
+    else:
+        filename = folder.rstrip(os.sep) + ".tar.gz"
+        with tarfile.open(filename, "w:gz") as t:
+            for path, name in names:
+                t.add(path, name)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("folder", help="archive folder to be created")
+    parser.add_argument("--toots", type=int, default=1000)
+    parser.add_argument("--likes", type=int, default=None,
+                        help="number of likes (default: same as toots)")
+    parser.add_argument("--media-ratio", type=float, default=0.2,
+                        help="share of toots with media attachments")
+    parser.add_argument("--reply-ratio", type=float, default=0.3,
+                        help="share of toots that are replies")
+    parser.add_argument("--self-reply-ratio", type=float, default=0.5,
+                        help="share of replies to own toots")
+    parser.add_argument("--boost-ratio", type=float, default=0.15)
+    parser.add_argument("--tag-ratio", type=float, default=0.4,
+                        help="share of toots with hashtags")
+    parser.add_argument("--tags", type=int, default=200,
+                        help="number of different hashtags")
+    parser.add_argument("--tag-skew", type=float, default=1.1,
+                        help="exponent of the zipf-like hashtag distribution")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--format", choices=("folder", "zip", "tar.gz"),
+                        default="folder",
+                        help="keep the folder or pack it (the folder is "
+                             "removed afterwards)")
+    args = parser.parse_args()
+
+    gen = generate(args.folder,
+                   args.toots,
+                   media_ratio=args.media_ratio,
+                   reply_ratio=args.reply_ratio,
+                   self_reply_ratio=args.self_reply_ratio,
+                   boost_ratio=args.boost_ratio,
+                   tag_ratio=args.tag_ratio,
+                   tags=args.tags,
+                   tag_skew=args.tag_skew,
+                   likes=args.likes,
+                   seed=args.seed,
+                   )
+    print("toots:", args.toots)
+    print("likes:", gen.likes)
+    print("media files:", gen.media_count)
+
+    if args.format != "folder":
+        print("archive:", pack(args.folder, args.format))
+        shutil.rmtree(args.folder)
+    else:
+        print("archive:", args.folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,64 @@
 
 import json
 import os
-import shlex
-import shutil
-import subprocess
-import yaml
-from collections import Counter
-
-from PIL import Image
+import sys
+from itertools import chain
 
 from nikola.plugin_categories import Command
 from nikola.plugins.basic_import import ImportMixin
 from nikola.plugins.command.init import SAMPLE_CONF, prepare_config
 
+# Nikola loads this file by path, make the helper package next to it
+# importable; every nikola command loads this plugin, so heavy dependencies
+# (yaml, Pillow, process pools) are only imported by the code running the
+# import
+_PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PLUGIN_DIR not in sys.path:
+    sys.path.insert(0, _PLUGIN_DIR)
+
+from mastotools.manifest import Manifest  # noqa: E402
+from mastotools.posts import (  # noqa: E402
+    DATED,
+    UNCHANGED,
+    WRITTEN,
+    PostWriter,
+    plan_posts,
+    status_slug,
+)
+from mastotools.merge import (  # noqa: E402
+    MergedOutbox,
+    MergedSource,
+    actor_ids,
+    main_actor,
+    open_archives,
+)
+from mastotools.plan import (  # noqa: E402
+    COPY,
+    FILE,
+    REMOVE,
+    WATERMARK,
+    WRITE,
+    ImportPlan,
+    marked_path,
+    plan_key,
+)
+from mastotools.profiler import Profiler  # noqa: E402
+from mastotools.search import SearchIndex, static_files  # noqa: E402
+from mastotools.stats import (  # noqa: E402
+    DIRECT,
+    FOLLOWERS_ONLY,
+    PUBLIC,
+    TimelineStats,
+)
+from mastotools.threads import single_toots, threads  # noqa: E402
+from mastotools.toot import Toot  # noqa: E402
+from mastotools.variants import (  # noqa: E402
+    configured_widths,
+    make_all_variants,
+    variant_path,
+    variant_widths,
+)
+
 HLINE = """
 ********************************************************
 """
@@ -27,10 +73,43 @@ class CommandImportMastodon(Command, ImportMixin):
 
     name = "import_mastodon"
     needs_config = True
-    doc_usage = "[options] extracted_archive_folder"
+    doc_usage = "[options] extracted_archive_folder|archive_file " \
+                "[more archives of moved accounts]"
     doc_purpose = "import a Mastodon archive"
     
-    cmd_options = ImportMixin.cmd_options
+    # replaced by an enabled one with --profile
+    profiler = Profiler()
+    # operations of the import, see mastotools.plan
+    plan = None
+
+    cmd_options = ImportMixin.cmd_options + [
+        {
+            "name": "profile",
+            "long": "profile",
+            "type": bool,
+            "default": False,
+            "help": "Time the phases of the import, show the throughput "
+                    "and write a report to import_mastodon_profile.json in "
+                    "the output folder",
+        },
+        {
+            "name": "cprofile",
+            "long": "cprofile",
+            "type": bool,
+            "default": False,
+            "help": "Like --profile, additionally write cProfile stats of "
+                    "the main process to import_mastodon.prof",
+        },
+        {
+            "name": "dry_run",
+            "long": "dry-run",
+            "type": bool,
+            "default": False,
+            "help": "Show how many files and bytes the import would write "
+                    "without writing anything to the site (the JSON files of "
+                    "tar archives are stored in a temporary folder)",
+        },
+    ]
 
     def _execute(self, options, args):
         
@@ -39,80 +118,206 @@ class CommandImportMastodon(Command, ImportMixin):
                 - read config
                 - read archive
                 - generate list of posts to be imported
-                - edit post html and saves to file
-                - save metadata file
-                - copy images
+                - edit post html and metadata, decide which files to
+                  write, copy and watermark (the import plan)
+                - save post html and metadata files and copy images while
+                  the next posts are prepared
                 - watermark images
+                - make smaller variants of images
+                - update manifest of imported posts and media
+
+            what has been done is journaled in the output folder, an
+            interrupted import is resumed from its last checkpoint (see
+            mastotools.plan); with --dry-run the plan is only reported
+
+            with --profile every phase is timed, see mastotools.profiler
         """
 
         if not args:
             print(self.help())
             return
+
+        # Nikola stops reading options at the first archive, options given
+        # after the archives ("archive -o my_archive") are read here
+        args = self.trailing_options(options, args)
                 
-        self.archive_folder = os.path.join(args[0])
-        
         # defaults to "new_site", can be specified by providing the -o option
         self.output_folder = options["output_folder"]
                
         self.import_into_existing_site = False
         self.url_map = {}
 
-        with open(os.path.join("plugins",
-                               "import_mastodon",
-                               "config.yaml",
-                               )
-                  ) as f:
-            self.config = yaml.safe_load(f)
-
-        self.raw_import_data = {}
-        
-        # file contains all toot data
-        with open(os.path.join(self.archive_folder, "outbox.json")) as f:
-            _data = json.load(f)
-
-        # file contains profile information
-        # TODO generate About Me page
-        self.raw_import_data["outbox"] = _data["orderedItems"]
+        self.profiler = Profiler(options.get("profile"),
+                                 options.get("cprofile"),
+                                 )
+        profiler = self.profiler
+        dry_run = options.get("dry_run")
+
+        with profiler.phase("read config"):
+            import yaml
+            with open(os.path.join("plugins",
+                                   "import_mastodon",
+                                   "config.yaml",
+                                   )
+                      ) as f:
+                self.config = yaml.safe_load(f)
+
+        # extracted archive folder or the original zip/tar file, the JSON
+        # files of a tar file are staged next to the output folder (in the
+        # system's temporary folder for a dry run), its media files are only
+        # hashed until they are copied, see mastotools.source.TarSource;
+        # several archives (of accounts moved to another instance) are
+        # imported as one, see mastotools.merge
+        with profiler.phase("open archive"):
+            self.source = open_archives(args,
+                                        None if dry_run else
+                                        os.path.dirname(
+                                            os.path.abspath(self.output_folder)),
+                                        bool(configured_widths(self.config)),
+                                        )
+
+        with self.source:
+            self.raw_import_data = {}
         
-        with open(os.path.join(self.archive_folder, "actor.json")) as f:
-            _data = json.load(f)
+            # file contains profile information
+            # TODO generate About Me page
+            if isinstance(self.source, MergedSource):
+                actors = self.source.actors()
+            else:
+                with self.source.open_text("actor.json") as f:
+                    actors = [json.load(f)]
 
-        self.raw_import_data["profile"] = _data
+            # the site belongs to the current account, replies to all of
+            # the user's accounts count as replies to oneself
+            self.raw_import_data["profile"] = actors[main_actor(actors)]
+            accounts = [i for actor in actors for i in actor_ids(actor)]
      
-        # init new site
-        conf_template = self.generate_base_site()
-        
-        # configuration of target Nikola site
-        self.context = self.populate_context(
-            self.raw_import_data["profile"]["id"], self.config)
+            # wanted watermark state of images, needed when copying images
+            if self.config["watermark"]:
+                if self.config["watermark_text"] is None \
+                        or self.config["watermark_text"] == "":
+                    self.config["watermark_text"] = "Don't copy that floppy!"
+            else:
+                self.config["watermark_text"] = None
+
+            # results of previous imports into this site
+            self.manifest = Manifest(self.output_folder)
+
+            # a plan left behind by an interrupted import is only resumed
+            # for the same archives and config
+            metadata_format = self.site.config.get("METADATA_FORMAT",
+                                                   "nikola").lower()
+            self.plan = ImportPlan(self.output_folder,
+                                   plan_key([os.path.abspath(path)
+                                             for path in args],
+                                            self.source.stat("outbox.json"),
+                                            self.config,
+                                            metadata_format,
+                                            ),
+                                   dry_run,
+                                   defer_copies=self.source.sequential,
+                                   )
+
+            # a site that has been imported into before (or by an
+            # interrupted import) already has its config
+            first_import = not (os.path.exists(self.manifest.path)
+                                or os.path.exists(self.plan.info_path))
+
+            with profiler.phase("generate site"):
+                # configuration of target Nikola site
+                self.context = self.populate_context(
+                    self.raw_import_data["profile"]["id"], self.config)
+
+                if not dry_run and first_import:
+                    # init new site
+                    conf_template = self.generate_base_site()
+
+                    self.write_configuration(
+                        self.get_configuration_output_path(),
+                        conf_template.render(**prepare_config(self.context)),
+                    )
+
+                    # add extra configuration to Nikola config file
+                    self.write_extra_config(
+                        self.get_configuration_output_path())
+
+            self.plan.start(self.manifest)
+            if self.plan.done:
+                print("...resume interrupted import ({} operations "
+                      "done)...".format(len(self.plan.done)))
+
+            # file contains all toot data, toots are read one at a time
+            with profiler.phase("import posts"):
+                self.import_posts(self.source.ordered_items("outbox.json"),
+                                  self.config["followers_only"],
+                                  accounts,
+                                  self.config,
+                                  )
+                if self.config["watermark"]:
+                    self.plan_watermarks(self.config["watermark_text"])
+                profiler.count(nbytes=self.source.stat("outbox.json")[0])
+
+            if dry_run:
+                self.dry_run_report()
+                print("Dry run, nothing written.")
+                return
+
+            # media files of tar archives
+            if self.plan.copies:
+                print("...copy media files from the archive...")
+                with profiler.phase("copy media"):
+                    self.copy_media()
+
+            # mark images with a horizontal text line
+            if self.config["watermark"]:
+                print("...add watermarks to images...")
+                with profiler.phase("watermark images"):
+                    self.watermark_images(os.path.join(self.output_folder,
+                                                       "images",
+                                                       ),
+                                          self.config["watermark_text"],
+                                          )
+
+            # smaller copies of the (watermarked) images
+            widths = configured_widths(self.config)
+            if widths:
+                print("...make image variants...")
+                with profiler.phase("image variants"):
+                    self.image_variants(os.path.join(self.output_folder,
+                                                     "images",
+                                                     ),
+                                        widths,
+                                        self.config.get("image_quality")
+                                        or 80,
+                                        )
+
+            with profiler.phase("save manifest"):
+                self.manifest.save()
+                # the import is complete
+                self.plan.remove()
+
+        profiler.finish(os.path.join(self.output_folder,
+                                     "import_mastodon_profile.json"),
+                        os.path.join(self.output_folder,
+                                     "import_mastodon.prof"),
+                        )
 
-        self.write_configuration(self.get_configuration_output_path(),
-                                 conf_template.render(
-                                     **prepare_config(self.context))
-                                 )
-                
-        # add extra configuration to Nikola config file
-        self.write_extra_config(self.get_configuration_output_path())
+        print("Done.")
 
-        self.import_posts(self.raw_import_data["outbox"],
-                          self.config["followers_only"],
-                          self.raw_import_data["profile"]["id"],
-                          self.config,
-                          )
+    def trailing_options(self, options, args):
 
-        # mark images with a horizontal text line
-        if self.config["watermark"]:
-            print("...add watermarks to images...")
-            if self.config["watermark_text"] is None \
-                    or self.config["watermark_text"] == "":
-                self.config["watermark_text"] = "Don't copy that floppy!"
-            self.watermark_images(os.path.join(self.output_folder,
-                                               "images",
-                                               ),
-                                  self.config["watermark_text"],
-                                  )
-        
-        print("Done.")
+        """
+            read options among the positional arguments into options,
+            returns the archives
+        """
+
+        archives, args = [], list(args)
+        while args:
+            if args[0].startswith("-") and args[0] != "-":
+                _, args = self.cmdparser.parse_only(args, options)
+            else:
+                archives.append(args.pop(0))
+        return archives
 
     @staticmethod
     def populate_context(profile_id, config):
@@ -157,22 +362,27 @@ class CommandImportMastodon(Command, ImportMixin):
         "html": (".html", ".htm")
         }"""
         
+        # search page of the imported posts, see mastotools.search
+        search = """
+        ("/pages/search/", "Search"),""" if config.get("search", True) \
+            else ""
+
         # add URL to main website to navigation links if given
         if config["site"]["main_url"]:
             context["NAVIGATION_LINKS"] = """{{
     DEFAULT_LANG: (
         ("{}", "Back to main site"),
         ("/archive.html", "Archives"),
-        ("/categories/index.html", "Share status"),
+        ("/categories/index.html", "Share status"),{}
     ),
-}}""".format(config["site"]["main_url"])
+}}""".format(config["site"]["main_url"], search)
         else:
-            context["NAVIGATION_LINKS"] = """{
+            context["NAVIGATION_LINKS"] = """{{
     DEFAULT_LANG: (
         ("/archive.html", "Archives"),
-        ("/categories/index.html", "Share status"),
+        ("/categories/index.html", "Share status"),{}
     ),
-}"""
+}}""".format(search)
 
         # Disable comments
         context["COMMENT_SYSTEM"] = ""
@@ -216,171 +426,215 @@ CONTENT_FOOTER = \"""Contents &copy; {date} - {author} - Powered by
                   that's what I often do and let's face it, nobody except me
                   will use this thing...
                 - no direct messages
+
+            with "threads" set in the config replies to own posts are
+            appended to the post of the toot they reply to
+
+            posts that have been imported before with identical content
+            are not written again; posts are prepared by a pool of worker
+            processes unless "workers" is set to 1 in the config
+
+            the files are written and copied by I/O threads while the next
+            posts are prepared, operations done by an interrupted import
+            are skipped (see mastotools.plan); the words of all posts go
+            into the search index of the site unless "search" is disabled
+            in the config
         """
 
-        import_list = self.analyze_timeline(tl,
+        profiler = self.profiler
+
+        import_list = self.analyze_timeline(profiler.iterate("parse", tl),
                                             post_fo,
                                             account,
                                             config["replytoself"],
                                             config["tags"],
+                                            profiler,
                                             )
 
-        for nr, post in enumerate(import_list):
+        writer = self.post_writer()
 
-            # post titles and slugs will just be numbers
-            # number filled with leadng zeros
-            title = slug = str(nr).zfill(len(str(len(import_list))))
-            
-            post_date = post["published"]
-            
-            # link to original post, this may result in deadlinks
-            # if you move or delete your account
-            post_link = post["id"] if config["originalsource"] else ""
-
-            # turn visibility status into category, in Nikola a post can
-            # only belong to one category
-            if post["to"][0].endswith("#Public"):
-                cat = "public"
-            elif post["to"][0].endswith("/followers"):
-                cat = "followers only"
-            else:
-                cat = ""
-            
-            # add hashtags and collect media/image file paths
-            tags, media_files, image_files = [], [], []
-            try:
-                for tag in post["tag"]:
-                    if tag["type"] == "Hashtag":
-                        tags.append(tag["name"])
-            except (TypeError, KeyError):
-                pass
-
-            # images and other media files
-            try:
-                for media in post["attachment"]:
-                    # media type is either audio or video
-                    _mediatype = media["mediaType"].split("/")[0]
-                    tags.append(_mediatype)
-                    # tuple of appended media files as "(audio, path)"
-                    # tuple of appended image files as ("path, description")
-                    image_files.append((media["url"], media["name"])) if _mediatype == "image"\
-                        else media_files.append((_mediatype, media["url"]))
-            except (TypeError, KeyError):
-                pass
-            
-            # edit html source
-            content = self.prepare_content(post["content"],
-                                           image_files,
-                                           media_files,
-                                           config["domain"],
-                                           )
-                            
-            # additional metadata
-            # the passed metadata objects are limited by the
-            # basic_import's write_metadata function
-            more = {"link": post_link,  # original Mastodon post
-                    "hidetitle": True,  # doesn't work for index pages
-                    "category": cat,
-                    }
-
-            # write metadata to separate file
-            self.write_metadata(os.path.join(self.output_folder,
-                                             "posts",
-                                             slug + ".meta"),
-                                title,
-                                slug,
-                                post_date,
-                                "",  # description always empty
-                                tags,
-                                more,
+        if config.get("threads") and config["replytoself"]:
+            import_list = threads(import_list)
+        else:
+            import_list = single_toots(import_list)
+
+        index = SearchIndex() if config.get("search", True) else None
+
+        self.plan.set_executor(writer.execute, writer.flush)
+        try:
+            counts = plan_posts(writer,
+                                self.assign_slugs(import_list,
+                                                  tl.header,
+                                                  config.get("post_layout"),
+                                                  ),
+                                self.plan,
+                                index,
+                                config.get("workers") or os.cpu_count() or 1,
                                 )
-                                
-            # write content to html source file
-            self.write_content(os.path.join(self.output_folder,
-                                            "posts",
-                                            slug + ".html"),
-                               content,
-                               )
-
-    def prepare_content(self, content_raw, image_files, media_files, domain):
-        
+
+            profiler.count(items=sum(counts.values()))
+            profiler.end_progress()
+
+            if index is not None:
+                with profiler.step("search index"):
+                    self.plan_search(index, writer)
+
+            # the last files of the posts are done
+            self.plan.checkpoint()
+        finally:
+            writer.close()
+
+        written = counts[WRITTEN] - self.plan.skipped[WRITE]
+        if self.plan.dry_run:
+            print("posts to write:", written)
+        else:
+            print("posts written:", written)
+            print("files written and copied:",
+                  sum(n for kind, n in self.plan.counts.items()
+                      if kind not in (WATERMARK, REMOVE))
+                  - len(self.plan.copies))
+            if self.plan.counts[REMOVE]:
+                print("files of moved posts and of replies now in threads "
+                      "removed:",
+                      self.plan.counts[REMOVE])
+        if self.plan.skipped[WRITE]:
+            print("posts written by the interrupted import:",
+                  self.plan.skipped[WRITE])
+        print("posts unchanged since last import:", counts[UNCHANGED])
+        if isinstance(tl, MergedOutbox):
+            print("copies of toots in several archives skipped:",
+                  tl.duplicates)
+
+    def post_writer(self):
+        return PostWriter(self.config,
+                          self.output_folder,
+                          self.source,
+                          self.manifest,
+                          self.site.config.get("METADATA_FORMAT",
+                                               "nikola").lower(),
+                          self.profiler,
+                          )
+
+    def plan_search(self, index, writer):
+
         """
-            edit html source in preparation of the Nikola build process:
-                - remove occasional (dunno why) extra link to media files
-                - copy image files to images folder
-                - copy audio/video files to files folder
-                - add media tag(s) to meta info
-                - show image description beneath image 
-                - add div with style to source for gray background with
-                  provided custom.css (see README)
+            add the files of the search index, the script and the search
+            page to the plan, files that didn't change are left alone
         """
-        
-        content = ""
-
-        # split source by <p>, search for media link
-        # (http://instance.domain/media/...) and remove p tag /w content        
-        # begin search after first occurence
-        for p in content_raw.split("<p>")[1:]:
-            if (domain + "/media/") not in p:
-                content += ("<p>" + p)
-                
-        image_html = ""
-        for f, descr in image_files:
-            # file structure is
-            # /media_attachments/files/123/123/123/original/dfghjdfghj.png
-            # filenames are probably unique so we try the easy way and skip the
-            # folder structure
-            shutil.copy(os.path.join(self.archive_folder,
-                                     *f.split("/")[1:]
-                                     ),
-                        os.path.join(self.output_folder, "images")
-                        )
-            
-            image_html += """<p><img src="{}"""".format(
-                os.path.join("..", "..", "images", f.split("/")[-1]),
-                )
-            
-            if descr != "None":
-                image_html += """<div class="comments"><p><i>Image description:</i> {}</p></div>\n""".format(descr)
-
-        media_html = ""
-        for t, f in media_files:
-            shutil.copy(os.path.join(self.archive_folder,
-                                     *f.split("/")[1:]
-                                     ),
-                        os.path.join(self.output_folder, "files")
-                        )
-            
-            media_html += """<p><{0} controls><source src="{1}" type="{0}/{2}"></{0}></p>\n""".format(
-                t,  # audio or video
-                os.path.join("..", "..", "files", f.split("/")[-1]),
-                f.split(".")[1],    # suffix
-                )       
-       
-        source_file = ("<div class=\"main-content\">"
-                       + content
-                       + image_html
-                       + media_html
-                       + "</div>")        
-        
-        # TODO maybe: hashtag links in post content link to tag page on
-        # the Mastodon instance which might be useful, hashtags are also
-        # stored as Nikola site tags so we have both
-        
-        return source_file
+
+        for path, text in chain(index.files(), static_files()):
+            self.plan.add_file(path, text)
+        self.plan.add_file("pages/search.meta",
+                           writer.metadata_text("Search",
+                                                "search",
+                                                index.docs[0][1]
+                                                if index.docs else "",
+                                                "",
+                                                [],
+                                                {},
+                                                ))
+        print("posts in search index:", len(index.docs))
+
+    def plan_watermarks(self, text):
+
+        """
+            add images without the wanted watermark to the plan
+        """
+
+        for key, entry in self.manifest.media.items():
+            if key.startswith("images/") and entry["watermark"] != text:
+                if not self.plan.add_watermark(key, text):
+                    # marked by an interrupted import
+                    entry["watermark"] = text
+
+    def dry_run_report(self):
+
+        """
+            print what the import would write
+        """
+
+        plan = self.plan
+        print(HLINE)
+        print("Import plan")
+        print("~~~~~~~~~~~")
+        print("posts to write: {} ({} files, {} bytes)".format(
+            plan.counts[WRITE], 2 * plan.counts[WRITE], plan.bytes[WRITE]))
+        print("media files to copy: {} ({} bytes)".format(
+            plan.counts[COPY], plan.bytes[COPY]))
+        print("images to watermark: {} ({} bytes)".format(
+            plan.counts[WATERMARK], plan.bytes[WATERMARK]))
+        print("search index files to write: {} ({} bytes)".format(
+            plan.counts[FILE], plan.bytes[FILE]))
+        if plan.counts[REMOVE]:
+            print("files of moved posts and of replies now in threads to "
+                  "remove:",
+                  plan.counts[REMOVE])
+        if plan.skipped:
+            print("operations done by the interrupted import:",
+                  sum(plan.skipped.values()))
+        widths = configured_widths(self.config)
+        if widths:
+            # variants are made from the watermarked images
+            text = self.config["watermark_text"]
+            for key, entry in self.manifest.media.items():
+                if text and key.startswith("images/"):
+                    entry["watermark"] = text
+            jobs, _ = self.variant_jobs(os.path.join(self.output_folder,
+                                                     "images",
+                                                     ),
+                                        widths,
+                                        self.config.get("image_quality")
+                                        or 80,
+                                        )
+            print("image variants to make:",
+                  sum(len(todo) for _, todo in jobs))
+        print(HLINE)
+
+    def assign_slugs(self, import_list, header, layout=None):
+
+        """
+            yield (slug, toot, replies) for (toot, replies) to be imported
+        """
+
+        for nr, (post, replies) in enumerate(import_list):
+
+            # with the dated layout the slug is the number of the status
+            # ID, it doesn't depend on other toots
+            if layout == DATED:
+                yield status_slug(post), post, replies
+                continue
+
+            # post titles and slugs will just be numbers
+            # number filled with leadng zeros; the number of imported toots
+            # is only known after the outbox has been read completely so the
+            # width is taken from the total number of activities in the outbox
+            if nr == 0:
+                width = len(str(header.get("totalItems", 99999)))
+            # toots imported in a previous run keep their slug, new toots
+            # are numbered consecutively
+            slug = self.manifest.slug(post.id)
+            if slug is None:
+                slug = str(self.manifest.next_number).zfill(width)
+                self.manifest.next_number += 1
+            yield slug, post, replies
 
     @staticmethod
-    def analyze_timeline(tl, post_fo, account, replytoself, tags):
+    def analyze_timeline(tl, post_fo, account, replytoself, tags,
+                         profiler=None):
 
         """
-            - create list of toots to be saved in the static archive
-            - print stats info to console
+            - yield toots to be saved in the static archive (as compact
+              Toot records, see mastotools.toot)
+            - print stats info to console when the timeline is exhausted
         """
         
-        posttype, to, inreplyto = [], [], []
-        import_list = []
-        # follow only, orphaned replies
-        fo_counter, orph_counter, own_replies, tagged_posts = 0, 0, 0, 0
+        # numbers of the whole outbox, collected while going through it
+        stats = TimelineStats()
+        # profile ID or IDs of all accounts of the user
+        accounts = {account} if isinstance(account, str) else set(account)
+        step = (profiler or Profiler()).step
+        # imported, follow only, replies to own posts
+        import_counter, fo_counter, own_replies = 0, 0, 0
 
         # create empty tag lists if not set in config
         if not isinstance(tags["include"], list):
@@ -397,75 +651,49 @@ CONTENT_FOOTER = \"""Contents &copy; {date} - {author} - Powered by
         just_count = True if len(tags["include"]) > 0 else False
 
         for value in tl:
-            try:
-                # ## count all sorts of toots
-                # Create = toot, Announce = boost
-                posttype.append(value["type"])
-                # public posts, followers only posts, direct messages
-                if value["object"]["to"][0].endswith("#Public"):
-                    to.append("public")
-                elif value["object"]["to"][0].endswith("/followers"):
-                    to.append("followers only")
-                else:
-                    to.append("direct message")
-                # original toots and replies
-                if value["object"]["inReplyTo"] is None:
-                    inreplyto.append(None)
-                else:
-                    inreplyto.append(True)
-                # ##############################################
-                
-                # create list of toots to be imported
-
-                # collect hashtags in post
-                _post_tags = []
-                for _ in value["object"]["tag"]:
-                    if _["type"] == "Hashtag":
-                        _post_tags.append(_["name"][1:])
-                        tagged_posts += 1
-
-                # reset for each post
-                excluded_by_tag = False
-                
-                # include posts with given hashtags
-                if len(tags["include"]) > 0:
-                    if any(x in tags["include"] for x in _post_tags):
-                        import_list.append(value["object"])
-                # mark post as not to be imported
-                elif len(tags["exclude"]) > 0:
-                    if any(x in tags["exclude"] for x in _post_tags):
-                        excluded_by_tag = True
-                
-                if value["type"] == "Create":
-                    if value["object"]["inReplyTo"] is None:
-                        # count and do not import orphaned replies
-                        _firstline = value["object"]["content"].split(
-                            "</p>")[0][3:]
-                        # post starts with addressing user by @ (hyperlinked
-                        # and not hyperlinked)
-                        if _firstline.startswith("@") or \
-                                (_firstline.startswith(
-                                    "<span class=\"h-card\"><a href=")
-                                 and "class=\"u-url mention\">@<span>" in
-                                 _firstline):
-                            orph_counter += 1
-                        elif value["object"]["to"][0].endswith("#Public") and \
-                                not (just_count or excluded_by_tag):
-                            import_list.append(value["object"])
-                        elif (value["object"]["to"][0].endswith("/followers")
-                              and post_fo):
-                            if not (just_count or excluded_by_tag):
-                                import_list.append(value["object"]) 
-                                fo_counter += 1
-                    # import replies to own posts
-                    elif value["object"]["inReplyTo"].split("/statuses/")[0] \
-                            == account and replytoself:
+            # count all sorts of toots, boosts have no object to import
+            with step("classify"):
+                activity = stats.add(value)
+            if activity is None or activity.object is None:
+                continue
+
+            # pass on toots to be imported
+
+            # reset for each post
+            excluded_by_tag = False
+
+            # include posts with given hashtags
+            if len(tags["include"]) > 0:
+                if any(x in tags["include"] for x in activity.tags):
+                    import_counter += 1
+                    yield Toot.from_activity(activity)
+            # mark post as not to be imported
+            elif len(tags["exclude"]) > 0:
+                if any(x in tags["exclude"] for x in activity.tags):
+                    excluded_by_tag = True
+
+            if activity.type == "Create":
+                if activity.in_reply_to is None:
+                    # do not import orphaned replies (post starts with
+                    # addressing user by @, hyperlinked and not hyperlinked)
+                    if activity.orphan is not None:
+                        pass
+                    elif activity.visibility == PUBLIC and \
+                            not (just_count or excluded_by_tag):
+                        import_counter += 1
+                        yield Toot.from_activity(activity)
+                    elif activity.visibility == FOLLOWERS_ONLY and post_fo:
                         if not (just_count or excluded_by_tag):
-                            import_list.append(value["object"])
-                            own_replies += 1
-                        
-            except (TypeError, IndexError):
-                pass
+                            fo_counter += 1
+                            import_counter += 1
+                            yield Toot.from_activity(activity)
+                # import replies to own posts
+                elif activity.in_reply_to.split("/statuses/")[0] \
+                        in accounts and replytoself:
+                    if not (just_count or excluded_by_tag):
+                        own_replies += 1
+                        import_counter += 1
+                        yield Toot.from_activity(activity)
 
         # this accumulation of print statements is the result of "I want to
         # know more" and lots of delicious copypasta; not fancy and could have
@@ -477,72 +705,125 @@ CONTENT_FOOTER = \"""Contents &copy; {date} - {author} - Powered by
         print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
         # number of toots
-        print("total number of toots:", len(tl))
+        print("total number of toots:", stats.total)
 
         # number of boosts
-        print("among them boosts:", Counter(posttype)["Announce"])
+        print("among them boosts:", stats.posttype["Announce"])
 
         print(HLINE)
 
         # public posts, follower only posts, direct messages
-        print("public posts:", Counter(to)["public"])
-        print("followers only posts:", Counter(to)["followers only"])
-        print("direct messages:", Counter(to)["direct message"])
+        print("public posts:", stats.visibility[PUBLIC])
+        print("followers only posts:", stats.visibility[FOLLOWERS_ONLY])
+        print("direct messages:", stats.visibility[DIRECT])
 
         print(HLINE)
 
         # original toots and replies
-        print("original toots:", Counter(inreplyto)[None])
-        print("among them (probably) orphaned replies:", orph_counter)
-        print("replies:", len(inreplyto) - Counter(inreplyto)[None])
-        print("posts with hashtags:", tagged_posts)
+        print("original toots:", stats.originals)
+        print("among them (probably) orphaned replies:", stats.orphaned)
+        print("replies:", stats.replies)
+        print("posts with hashtags:", stats.tagged_posts)
 
         print(HLINE)
 
-        print("number of toots to be imported:", len(import_list))
+        print("number of toots imported:", import_counter)
         print("among them posted 'followers only' (needs config):", fo_counter)
         print("among them replies to own posts (needs config):", own_replies)
 
         print(HLINE)
 
-        return import_list
+    def copy_media(self):
+
+        """
+            copy the media files of tar archives to the site, all of them
+            in one pass over the archive (see mastotools.source.TarSource);
+            every file is journaled as soon as it's in place
+        """
+
+        jobs = self.plan.copies
+        nbytes = 0
+        for nr in self.source.copy_each((op[3], op[2]) for op in jobs):
+            self.plan.journal(jobs[nr])
+            nbytes += jobs[nr][4]
+        print("media files copied:", len(jobs))
 
-    def write_metadata(self, filename, title, slug, post_date, description,
-                       tags, more):
+        self.profiler.count(len(jobs), nbytes)
+
+    def watermark_images(self, folder, text):
 
         """
-            write .meta files to posts folder, bluntly stolen from the original
-            Google+ import plugin
+            add watermark to images (needs config), images are processed
+            in parallel by a pool of worker processes; only the images
+            planned (see plan_watermarks) are marked, every image is
+            journaled before it's replaced by its watermarked copy so none
+            is marked twice
         """
 
-        super(CommandImportMastodon, self).write_metadata(
-            filename,
-            title,
-            slug,
-            post_date,
-            description,
-            tags,
-            **more
-            )
+        from mastotools.watermark import watermark_each
 
-    @staticmethod
-    def watermark_images(folder, text):
+        jobs = self.plan.watermarks
+        count, nbytes = 0, 0
+        paths = [os.path.join(folder, *op[1].split("/")[1:]) for op in jobs]
+        results = watermark_each(((path, marked_path(path))
+                                  for path in paths),
+                                 text,
+                                 self.config.get("workers"),
+                                 )
+        for nr, marked in results:
+            op = jobs[nr]
+            self.manifest.media[op[1]]["watermark"] = text
+            self.plan.journal(op)
+            if marked:
+                os.replace(marked_path(paths[nr]), paths[nr])
+            count += marked
+            nbytes += op[3]
+        print("watermarked images:", count)
+
+        self.profiler.count(count, nbytes)
+
+    def image_variants(self, folder, widths, quality):
+
+        """
+            make smaller variants of the images referenced by srcset in the
+            posts, variants of unchanged images with the same watermark and
+            quality are kept
+        """
+
+        jobs, done = self.variant_jobs(folder, widths, quality)
+        count = make_all_variants(jobs, quality, self.config.get("workers"))
+        self.manifest.variants.update(done)
+        print("image variants written:", count)
+
+        if self.profiler.enabled:
+            self.profiler.count(count,
+                                sum(os.path.getsize(dst)
+                                    for _, todo in jobs
+                                    for dst, _ in todo
+                                    if os.path.exists(dst)),
+                                )
+
+    def variant_jobs(self, folder, widths, quality):
 
         """
-            add watermark to images (needs config)
+            (image, [(variant, width), ...]) of the variants to be made and
+            the manifest entries of these variants
         """
 
-        command = "convert -background \"#0008\" -fill LightGray -gravity center -size {}x{} -pointsize {} -family \"DejaVu Sans\" label:\"{}\" {} +swap -gravity center -composite {}"
-        for image in os.listdir(folder):
-            w, h = Image.open(os.path.join(folder, image)).size
-            args = shlex.split(
-                command.format(w,
-                               h / 8,  # height of vertical banner
-                               h / 20,  # fontsize
-                               text,
-                               os.path.join(folder, image),
-                               # file is replaced
-                               os.path.join(folder, image),
-                               ),
-                )
-            subprocess.run(args)
+        jobs, done = [], {}
+        for key, entry in self.manifest.media.items():
+            if not key.startswith("images/"):
+                continue
+            rel = key.split("/", 1)[1]
+            state = {"watermark": entry["watermark"], "quality": quality}
+            todo = []
+            for width in variant_widths(entry.get("width"), widths):
+                vrel = variant_path(rel, width)
+                dst = os.path.join(folder, *vrel.split("/"))
+                if self.manifest.variants.get("images/" + vrel) != state \
+                        or not os.path.exists(dst):
+                    todo.append((dst, width))
+                    done["images/" + vrel] = state
+            if todo:
+                jobs.append((os.path.join(folder, *rel.split("/")), todo))
+        return jobs, done
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+"""
+    helper modules shared by the Nikola import plugin and the
+    analyze_archive.py script
+"""
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""
+    analysis of many archives without any questions asked (batch_analyze.py)
+
+    every archive is reduced to a summary of plain numbers (and a few top
+    lists) by a worker process, summaries are added up to an aggregate of
+    the whole corpus; the indexes of the archives are stored next to them
+    as with analyze_archive.py, so repeated runs only read what changed
+"""
+
+import os
+import traceback
+from collections import Counter
+
+from mastotools.index import open_index
+from mastotools.likes import LikeClassifier
+from mastotools.stats import DIRECT, FOLLOWERS_ONLY, PUBLIC
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# number columns of the CSV file, in this order
+COLUMNS = ("toots",
+           "boosts",
+           "public",
+           "followers_only",
+           "direct",
+           "originals",
+           "orphaned",
+           "replies",
+           "tagged_posts",
+           "hashtags",
+           "boosted_profiles",
+           "replied_profiles",
+           "vanished_profiles",
+           "broken_profiles",
+           "likes",
+           "liked_instances",
+           "liked_profiles",
+           "media_files",
+           "media_bytes",
+           "duplicate_groups",
+           "duplicate_bytes",
+           )
+
+# counters kept in summaries (and added up), top entries only
+COUNTERS = {"years": None,
+            "like_platforms": None,
+            "media_types": None,
+            "top_hashtags": 25,
+            "top_liked_instances": 20,
+            }
+
+# columns counting distinct profiles, hashtags or instances: they can't be
+# added up, summaries carry the whole counters ("values") to count the
+# distinct ones of the corpus
+DISTINCT = ("hashtags",
+            "boosted_profiles",
+            "replied_profiles",
+            "vanished_profiles",
+            "broken_profiles",
+            "liked_instances",
+            "liked_profiles",
+            )
+
+# top lists taken from the merged counters of DISTINCT columns
+TOP = {"top_hashtags": "hashtags",
+       "top_liked_instances": "liked_instances",
+       }
+
+
+def is_archive(path):
+
+    """
+        extracted archive folder or archive file (judged by its name)
+    """
+
+    if os.path.isdir(path):
+        return os.path.exists(os.path.join(path, "outbox.json"))
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def find_archives(paths):
+
+    """
+        archives given by paths; a folder that isn't an archive itself is
+        searched (not recursively) for archive folders and files, index
+        folders are skipped
+    """
+
+    found = []
+    for path in paths:
+        if is_archive(path) or not os.path.isdir(path):
+            found.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            entry = os.path.join(path, name)
+            if not name.endswith(".index") and is_archive(entry):
+                found.append(entry)
+    return found
+
+
+def summarize(index):
+
+    """
+        numbers of an ArchiveIndex as a JSON serializable dict
+    """
+
+    stats = index.timeline_stats()
+    likes = index.like_stats()
+    media = index.media_inventory()
+    values = {"hashtags": stats.hashtags,
+              "boosted_profiles": stats.boosted,
+              "replied_profiles": stats.replied,
+              "vanished_profiles": stats.vanished,
+              "broken_profiles": stats.broken,
+              "liked_instances": likes.instances,
+              "liked_profiles": likes.profiles,
+              }
+    return {
+        "toots": stats.total,
+        "boosts": stats.posttype["Announce"],
+        "public": stats.visibility[PUBLIC],
+        "followers_only": stats.visibility[FOLLOWERS_ONLY],
+        "direct": stats.visibility[DIRECT],
+        "originals": stats.originals,
+        "orphaned": stats.orphaned,
+        "replies": stats.replies,
+        "tagged_posts": stats.tagged_posts,
+        "hashtags": len(stats.hashtags),
+        "boosted_profiles": len(stats.boosted),
+        "replied_profiles": len(stats.replied),
+        "vanished_profiles": len(stats.vanished),
+        "broken_profiles": len(stats.broken),
+        "likes": likes.total,
+        "liked_instances": len(likes.instances),
+        "liked_profiles": len(likes.profiles),
+        "media_files": len(media.files),
+        "media_bytes": media.total,
+        "duplicate_groups": len(media.duplicates),
+        "duplicate_bytes": media.wasted,
+        "years": dict(sorted(stats.years.items())),
+        "like_platforms": dict(likes.platforms.most_common()),
+        "media_types": dict(media.count.most_common()),
+        "top_hashtags": dict(stats.hashtags.most_common(
+            COUNTERS["top_hashtags"])),
+        "top_liked_instances": dict(likes.instances.most_common(
+            COUNTERS["top_liked_instances"])),
+        "values": {name: dict(values[name]) for name in DISTINCT},
+    }
+
+
+def without_values(summary):
+
+    """
+        summary without the counters only needed for the aggregate
+    """
+
+    return {k: v for k, v in summary.items() if k != "values"}
+
+
+def analyze(path, config=None):
+
+    """
+        summary of the archive at path, {"path", "error"} if it can't be
+        read (runs in a worker process)
+    """
+
+    try:
+        index = open_index(path,
+                           classifier=LikeClassifier.from_config(config),
+                           )
+        try:
+            summary = summarize(index)
+        finally:
+            index.close()
+    except Exception as e:
+        return {"path": path,
+                "error": "{}: {}".format(type(e).__name__, e),
+                "traceback": traceback.format_exc(),
+                }
+    return dict(path=path, **summary)
+
+
+def aggregate(summaries):
+
+    """
+        numbers of all readable archives added up; distinct profiles,
+        hashtags and instances are counted in the merged counters of all
+        archives, the top lists are taken from them as well
+    """
+
+    total = dict.fromkeys(COLUMNS, 0)
+    counters = {name: Counter() for name in COUNTERS}
+    values = {name: Counter() for name in DISTINCT}
+    archives, failed = 0, 0
+    for summary in summaries:
+        if "error" in summary:
+            failed += 1
+            continue
+        archives += 1
+        for name in COLUMNS:
+            if name not in values:
+                total[name] += summary[name]
+        for name in COUNTERS:
+            if name not in TOP:
+                counters[name].update(summary[name])
+        for name in DISTINCT:
+            values[name].update(summary["values"][name])
+    total["archives"], total["failed"] = archives, failed
+    for name in DISTINCT:
+        total[name] = len(values[name])
+    for name, column in TOP.items():
+        counters[name] = values[column]
+    for name, n in COUNTERS.items():
+        counter = counters[name]
+        total[name] = dict(sorted(counter.items()) if n is None
+                           else counter.most_common(n))
+    return total
+
+
+def csv_rows(summaries, total):
+
+    """
+        header and one row per archive plus the aggregate, only numbers
+    """
+
+    yield ("path", "error") + COLUMNS
+    for summary in summaries:
+        yield ((summary["path"], summary.get("error", ""))
+               + tuple(summary.get(name, "") for name in COLUMNS))
+    yield ("TOTAL", "") + tuple(total[name] for name in COLUMNS)
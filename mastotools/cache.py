@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""
+    on-disk cache of profile check results (SQLite)
+
+    the status of every checked URL is stored with the time of the check
+    and reused until it is older than the time to live of its kind (the
+    profile is available, gone, or could not be reached); hosts that could
+    not be reached at all are stored too, profiles on such a host are not
+    requested one by one until the host's entry expires
+"""
+
+import os
+import sqlite3
+import time
+
+from mastotools.checker import UNAVAILABLE
+
+FILENAME = "reachability.sqlite"
+
+HOUR = 3600
+
+# seconds
+TTL = {"available": 7 * 24 * HOUR,
+       "gone": 30 * 24 * HOUR,
+       "unavailable": 24 * HOUR,
+       "host": 24 * HOUR,
+       }
+
+# profile is deleted or suspended, this is unlikely to change soon
+GONE = (404, 410)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    checked REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    checked REAL NOT NULL
+);
+"""
+
+
+def default_path():
+    cache = os.environ.get("XDG_CACHE_HOME") \
+        or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "import_mastodon", FILENAME)
+
+
+def kind(status):
+
+    """
+        available, gone or unavailable (for the time to live)
+    """
+
+    if status in UNAVAILABLE or (isinstance(status, int) and status >= 500):
+        return "unavailable"
+    if status in GONE:
+        return "gone"
+    return "available"
+
+
+def _decode(status):
+    return int(status) if status.isdigit() else status
+
+
+class ReachabilityCache:
+
+    """
+        - path: SQLite database, created if missing
+        - ttl: seconds per kind of result, see TTL
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or default_path()
+        self.ttl = dict(TTL, **(ttl or {}))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+
+        """
+            cache as set in the config (check_cache), None if disabled;
+            times to live are given in hours
+        """
+
+        settings = (config or {}).get("check_cache", {})
+        if settings is False:
+            return None
+        settings = settings or {}
+        if settings.get("enabled") is False:
+            return None
+        ttl = {name: float(settings[name]) * HOUR for name in TTL
+               if settings.get(name) is not None}
+        return cls(settings.get("path"), ttl)
+
+    def _fresh(self, status, checked, now, ttl=None):
+        return now - checked < (ttl if ttl is not None
+                                else self.ttl[kind(status)])
+
+    def urls(self, urls, now=None):
+
+        """
+            dict url -> status of the URLs with a fresh result
+        """
+
+        now = now or time.time()
+        result = {}
+        for url in urls:
+            row = self._db.execute("SELECT status, checked FROM urls "
+                                   "WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                status = _decode(row[0])
+                if self._fresh(status, row[1], now):
+                    result[url] = status
+        return result
+
+    def hosts(self, now=None):
+
+        """
+            dict host -> status of hosts known to be unreachable
+        """
+
+        now = now or time.time()
+        return {host: _decode(status)
+                for host, status, checked
+                in self._db.execute("SELECT host, status, checked FROM hosts")
+                if self._fresh(status, checked, now, self.ttl["host"])}
+
+    def store(self, statuses, hosts=None, now=None):
+
+        """
+            remember the results of a check: url -> status and unreachable
+            host -> status
+        """
+
+        now = now or time.time()
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO urls "
+                                 "VALUES (?, ?, ?)",
+                                 ((url, str(status), now)
+                                  for url, status in statuses.items()))
+            self._db.executemany("INSERT OR REPLACE INTO hosts "
+                                 "VALUES (?, ?, ?)",
+                                 ((host, str(status), now)
+                                  for host, status in (hosts or {}).items()))
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+    check if profile URLs are still reachable
+
+    requests are sent concurrently from a thread pool; every host gets its
+    own session so connections are reused, and a semaphore per host limits
+    the number of parallel requests to a single instance
+
+    once a host can't be reached at all (no connection), its remaining
+    profiles get the host's status without being requested; with a cache
+    (see mastotools.cache) fresh results of earlier checks are reused and
+    only the other URLs are requested
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+# results other than HTTP status codes
+SSL_ERROR = "SSL error"
+CONNECTION_ERROR = "connection error"
+TIMEOUT = "timeout"
+
+UNAVAILABLE = (SSL_ERROR, CONNECTION_ERROR, TIMEOUT)
+
+
+class ProfileChecker:
+
+    """
+        - workers: number of requests in flight overall
+        - per_host: number of requests in flight per host
+        - timeout: seconds for connecting and for reading the response
+        - retries: retries on connection errors and 429/5xx responses
+        - cache: ReachabilityCache or None
+    """
+
+    def __init__(self, workers=32, per_host=4, timeout=10, retries=2,
+                 cache=None):
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        # URLs of the last check answered by the cache or by the status of
+        # their unreachable host, without a request of their own
+        self.cached, self.skipped = 0, 0
+        self._skipped = set()
+        # host -> status of hosts that can't be reached
+        self._down = {}
+        self._sessions = {}
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def _session(self, host):
+        with self._lock:
+            if host not in self._sessions:
+                retry = Retry(total=self.retries,
+                              backoff_factor=0.2,
+                              status_forcelist=(429, 502, 503, 504),
+                              allowed_methods=("HEAD",),
+                              raise_on_status=False,
+                              )
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.per_host,
+                                      max_retries=retry,
+                                      )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+                self._limits[host] = threading.Semaphore(self.per_host)
+            return self._sessions[host], self._limits[host]
+
+    def status(self, url):
+
+        """
+            HTTP status code of a HEAD request (redirects are not followed)
+            or one of the error strings above
+        """
+
+        host = urlsplit(url).netloc
+        session, limit = self._session(host)
+        with limit:
+            # another profile on this host failed meanwhile
+            down = self._down.get(host)
+            if down is not None:
+                with self._lock:
+                    self._skipped.add(url)
+                return down
+            status, down = self._head(session, url)
+            if down:
+                with self._lock:
+                    self._down.setdefault(host, status)
+            return status
+
+    def _head(self, session, url):
+
+        """
+            (status, True if the host itself can't be reached); a profile
+            that is slow to answer says nothing about the host's other
+            profiles, only failing to connect does
+        """
+
+        try:
+            return session.head(url,
+                                timeout=self.timeout,
+                                allow_redirects=False,
+                                ).status_code, False
+        except requests.exceptions.SSLError:
+            return SSL_ERROR, True
+        except requests.exceptions.ConnectTimeout:
+            return TIMEOUT, True
+        except requests.exceptions.Timeout:
+            return TIMEOUT, False
+        except requests.exceptions.ConnectionError as e:
+            # read timeouts end up here once retries are exhausted
+            reason = getattr(e.args[0], "reason", None) if e.args \
+                else None
+            if isinstance(reason, ReadTimeoutError):
+                return TIMEOUT, False
+            # refused, unknown host; not a connection dropped by the host
+            return CONNECTION_ERROR, isinstance(reason, NewConnectionError)
+        except requests.exceptions.RequestException:
+            return CONNECTION_ERROR, False
+
+    def check(self, urls):
+
+        """
+            return dict url -> status for all given URLs
+        """
+
+        urls = list(dict.fromkeys(urls))
+        self.cached, self.skipped = 0, 0
+        if not urls:
+            return {}
+
+        result, todo, known = {}, urls, {}
+        if self.cache is not None:
+            result = self.cache.urls(urls)
+            self.cached = len(result)
+            known = self.cache.hosts()
+            todo = [url for url in urls if url not in result]
+
+        self._down, self._skipped = dict(known), set()
+        checked = {}
+        if todo:
+            with ThreadPoolExecutor(max_workers=min(self.workers,
+                                                    len(todo))) as pool:
+                checked = dict(zip(todo, pool.map(self.status, todo)))
+        self.skipped = len(self._skipped)
+
+        if self.cache is not None:
+            # only new results, entries must expire some time
+            self.cache.store({url: status for url, status in checked.items()
+                              if url not in self._skipped},
+                             {host: status for host, status
+                              in self._down.items() if host not in known},
+                             )
+        self.close()
+        result.update(checked)
+        # in the order of urls
+        return {url: result[url] for url in urls}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._limits.clear()
+            self._down = {}
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+    the plugin's config.yaml as read by the analyzer scripts
+
+    importing yaml takes a while, the scripts only need a few settings, so
+    the file is only parsed if one of them is actually set
+"""
+
+import os
+
+
+def configured(text, key):
+
+    """
+        whether a top level key of a YAML text has a value, either on its
+        line or in the indented lines below it; a rough check that errs on
+        the side of parsing the file
+    """
+
+    lines = iter(text.splitlines())
+    for line in lines:
+        if not line.startswith(key + ":"):
+            continue
+        value = line[len(key) + 1:].strip()
+        if value and not value.startswith("#"):
+            return True
+        for line in lines:
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            # the next key, or a nested value
+            return line[0].isspace()
+        return False
+    return False
+
+
+def read_config(path, keys):
+
+    """
+        the config at path as dict, empty if there is no such file or none
+        of the keys is set
+    """
+
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if not any(configured(text, key) for key in keys):
+        return {}
+    import yaml
+    return yaml.safe_load(text) or {}
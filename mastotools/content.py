@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+"""
+    single pass tokenizer for the HTML content of toots
+
+    Mastodon only produces a handful of elements (p, br, a, span), so the
+    content is cut into tags, comments and text by one regular expression
+    and rewritten token by token into a list which is joined once; tokens
+    that are not touched are copied verbatim
+
+    used to rewrite the content of posts (remove links to media files,
+    point hashtag links to the site's tag pages) and to find mentions
+"""
+
+import html
+import re
+from collections import namedtuple
+from urllib.parse import quote, unquote
+
+TEXT, START, END, OTHER = "text", "start", "end", "other"
+
+# kind, lowercase tag name (None for text and comments), the token itself
+Token = namedtuple("Token", "kind name raw")
+
+_TOKEN = re.compile(r"""
+    (?P<comment><!--.*?-->)
+    | <(?P<end>/?)(?P<name>[a-zA-Z][a-zA-Z0-9]*)
+      (?P<attrs>(?:[^>"']|"[^"]*"|'[^']*')*)>
+    | (?P<text>[^<]+|<)
+    """, re.DOTALL | re.VERBOSE)
+
+_ATTR = re.compile(r"""
+    (?P<name>[^\s"'=<>/]+)
+    (?:\s*=\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<uq>[^\s>]+)))?
+    """, re.VERBOSE)
+
+# nothing left to show in a paragraph made of these
+_EMPTY = {"br", "span"}
+
+
+def tokens(content):
+
+    """
+        iterate over the tokens of an HTML string, joining the raw tokens
+        gives back the string
+    """
+
+    for m in _TOKEN.finditer(content):
+        raw = m.group()
+        if m.group("name") is not None:
+            yield Token(END if m.group("end") else START,
+                        m.group("name").lower(),
+                        raw,
+                        )
+        elif m.group("comment") is not None:
+            yield Token(OTHER, None, raw)
+        else:
+            yield Token(TEXT, None, raw)
+
+
+def attributes(token):
+
+    """
+        attributes of a start tag as dict, values are unescaped
+    """
+
+    # skip "<name"
+    raw = token.raw[len(token.name) + 1:-1]
+    attrs = {}
+    for m in _ATTR.finditer(raw):
+        value = m.group("dq")
+        if value is None:
+            value = m.group("sq")
+        if value is None:
+            value = m.group("uq") or ""
+        attrs.setdefault(m.group("name").lower(), html.unescape(value))
+    return attrs
+
+
+def replace_attribute(token, name, value):
+
+    """
+        raw start tag with the value of an existing attribute replaced,
+        everything else stays as it is
+    """
+
+    start = len(token.name) + 1
+    for m in _ATTR.finditer(token.raw, start, len(token.raw) - 1):
+        if m.group("name").lower() == name:
+            return "{}{}=\"{}\"{}".format(token.raw[:m.start()],
+                                          m.group("name"),
+                                          html.escape(value),
+                                          token.raw[m.end():],
+                                          )
+    return token.raw
+
+
+def classes(attrs):
+    return attrs.get("class", "").split()
+
+
+def hashtag(href):
+
+    """
+        name of the hashtag a link to a tag page of an instance points to
+        (https://instance/tags/name)
+    """
+
+    return unquote(href.split("?", 1)[0].split("#", 1)[0]
+                   .rstrip("/").rsplit("/", 1)[-1])
+
+
+def tag_link(name):
+
+    """
+        Nikola's magic link to the site's tag page of a hashtag, resolved
+        when the site is built
+    """
+
+    return "link://tag/" + quote(name, safe="")
+
+
+def rewrite(content, media_prefix=None, tag_url=None):
+
+    """
+        rewrite the HTML content of a toot in a single pass:
+            - links to URLs starting with media_prefix are removed,
+              paragraphs that are left empty by this are removed too
+            - with tag_url, hashtag links point to tag_url(name)
+    """
+
+    out = []
+    # index of the current paragraph's start tag in out, whether something
+    # was removed from it and whether there is something left to show
+    para, removed, visible = None, False, False
+    # inside a removed link
+    skip = False
+
+    for token in tokens(content):
+        kind, name = token.kind, token.name
+
+        if skip:
+            if kind == END and name == "a":
+                skip = False
+            continue
+
+        if kind == START and name == "a":
+            attrs = attributes(token)
+            href = attrs.get("href", "")
+            if media_prefix and href.startswith(media_prefix):
+                skip, removed = True, True
+                continue
+            if tag_url is not None and "hashtag" in classes(attrs):
+                out.append(replace_attribute(token,
+                                             "href",
+                                             tag_url(hashtag(href)),
+                                             ))
+                visible = True
+                continue
+
+        if kind == START and name == "p":
+            para, removed, visible = len(out), False, False
+        elif kind == END and name == "p":
+            if para is not None and removed and not visible:
+                # drop what is left of the paragraph
+                del out[para:]
+                para = None
+                continue
+            para = None
+        elif para is not None and not visible:
+            if kind == TEXT:
+                visible = not token.raw.isspace()
+            elif kind == START:
+                visible = name not in _EMPTY
+        out.append(token.raw)
+
+    return "".join(out)
+
+
+Mention = namedtuple("Mention", "name url")
+
+
+def mentions(content):
+
+    """
+        hyperlinked mentions of users (<a class="u-url mention">), list of
+        Mention("@user", profile URL)
+    """
+
+    result = []
+    url, text = None, None
+    for token in tokens(content):
+        if token.kind == START and token.name == "a":
+            attrs = attributes(token)
+            cls = classes(attrs)
+            if "mention" in cls and "hashtag" not in cls:
+                url, text = attrs.get("href", ""), []
+        elif url is not None:
+            if token.kind == END and token.name == "a":
+                result.append(Mention(html.unescape("".join(text)).strip(),
+                                      url,
+                                      ))
+                url = None
+            elif token.kind == TEXT:
+                text.append(token.raw)
+    return result
+
+
+def leading_mention(content):
+
+    """
+        the user a toot starts with addressing, Mention("@user", profile
+        URL) if hyperlinked, Mention("@user", None) if not (the profile is
+        gone), None if the toot doesn't start with "@"
+    """
+
+    it = tokens(content)
+    for token in it:
+        if token.kind == TEXT and token.raw.isspace():
+            continue
+        if token.kind == START and token.name == "p":
+            continue
+        if token.kind == TEXT:
+            text = html.unescape(token.raw).lstrip()
+            if text.startswith("@"):
+                return Mention(text.split()[0], None)
+            return None
+        if token.kind == START and token.name == "span" \
+                and "h-card" in classes(attributes(token)):
+            # <span class="h-card"><a href=... class="u-url mention">
+            found = mentions(_until_end(it, "span"))
+            return found[0] if found else None
+        return None
+    return None
+
+
+def _until_end(it, name):
+
+    """
+        raw content up to the end tag of the element just started
+    """
+
+    depth, raw = 1, []
+    for token in it:
+        if token.name == name:
+            depth += 1 if token.kind == START else -1
+            if not depth:
+                break
+        raw.append(token.raw)
+    return "".join(raw)
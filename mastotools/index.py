@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+"""
+    columnar index of an archive for repeated analysis
+
+    the first analysis of an archive reduces outbox.json, likes.json and
+    the list of media files to a few arrays of numbers (one entry per
+    activity/like/media file) plus tables of the strings they refer to;
+    the index is stored in a folder next to the archive ("archive.index")
+    and later runs map the arrays into memory instead of parsing the JSON
+    files again
+
+    the index is invalidated by size and mtime of the archive's files and
+    by changed rules for classifying likes
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections import Counter
+
+from mastotools.inventory import MediaInventory, find_duplicates
+from mastotools.likes import LikeClassifier, LikeStats, instance
+from mastotools.source import open_archive
+from mastotools.stats import (
+    DIRECT,
+    FOLLOWERS_ONLY,
+    PUBLIC,
+    VANISHED,
+    TimelineStats,
+    counted,
+)
+
+VERSION = 4
+
+META = "meta.json"
+
+# column name -> array typecode
+COLUMNS = {
+    # outbox, one entry per activity
+    "type": "i",        # index in types table, -1 if missing
+    "visibility": "B",  # see VISIBILITY, 0 for boosts/malformed entries
+    "year": "i",        # index in years table, -1 if not counted
+    "reply": "i",       # index in profiles table, see NO_OBJECT/ORIGINAL
+    "boosted": "i",     # index in profiles table, -1 if no boost
+    "orphan": "i",      # 2 * index in profiles table + kind, -1 if none
+    "tag_offsets": "I",  # tags of activity n are tag_ids[off[n]:off[n+1]]
+    "tag_ids": "i",     # index in tags table
+    # likes, one entry per like
+    "like_platform": "i",  # index in platforms table
+    "like_profile": "i",   # index in profiles table, -1 if none
+    "like_instance": "i",  # index in instances table, -1 if unknown
+    # media attachments, one entry per file, names in media table
+    "media_size": "q",
+    "media_duplicate": "i",  # number of the group of identical files, -1
+}
+
+TABLES = ("types", "profiles", "tags", "years", "platforms", "instances",
+          "media")
+
+VISIBILITY = {PUBLIC: 1, FOLLOWERS_ONLY: 2, DIRECT: 3}
+
+# values of the reply column that aren't profiles
+NO_OBJECT, ORIGINAL = -1, -2
+
+
+def index_folder(path):
+
+    """
+        the index is stored next to the archive folder or file
+    """
+
+    return os.path.normpath(path) + ".index"
+
+
+def media_digest(folder):
+
+    """
+        hash of name, size and mtime of every file below the media folder
+        of an extracted archive, None if there is none; replacing a file
+        deep down doesn't change the folder itself
+    """
+
+    if not os.path.isdir(folder):
+        return None
+    entries, stack = [], [folder]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    entries.append((os.path.relpath(entry.path, folder),
+                                    st.st_size,
+                                    st.st_mtime_ns,
+                                    ))
+    h = hashlib.sha1()
+    for entry in sorted(entries):
+        h.update("{}\0{}\0{}\n".format(*entry).encode("utf-8",
+                                                       "surrogateescape"))
+    return h.hexdigest()
+
+
+def signature(path):
+
+    """
+        size and mtime of the archive file or of the relevant files of an
+        extracted archive (of all media files, see media_digest)
+    """
+
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return [[st.st_size, st.st_mtime_ns]]
+    sig = []
+    for name in ("outbox.json", "likes.json"):
+        try:
+            st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            sig.append(None)
+        else:
+            sig.append([st.st_size, st.st_mtime_ns])
+    sig.append(media_digest(os.path.join(path, "media_attachments")))
+    return sig
+
+
+class _Table:
+
+    """
+        interned strings, string -> index
+    """
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self._index = {s: i for i, s in enumerate(self.strings)}
+
+    def add(self, s):
+        try:
+            return self._index[s]
+        except KeyError:
+            self._index[s] = len(self.strings)
+            self.strings.append(s)
+            return self._index[s]
+
+
+class ArchiveIndex:
+
+    """
+        columns and string tables of an archive, built from an archive
+        source with build() or loaded from disk with load()
+    """
+
+    def __init__(self, columns, tables):
+        self.columns = columns
+        self.tables = tables
+        self._maps = []
+
+    @classmethod
+    def build(cls, source, classifier=None):
+
+        """
+            read an archive source once and build its index
+        """
+
+        classifier = classifier or LikeClassifier()
+
+        tables = {name: _Table() for name in TABLES}
+        cols = {name: array(code) for name, code in COLUMNS.items()}
+        cols["tag_offsets"].append(0)
+
+        for value in source.ordered_items("outbox.json"):
+            cls._add_activity(value, cols, tables)
+
+        for url in source.ordered_items("likes.json"):
+            platform, profile = classifier.classify(url)
+            domain = instance(url)
+            cols["like_platform"].append(tables["platforms"].add(platform))
+            cols["like_profile"].append(-1 if profile is None
+                                        else tables["profiles"].add(profile))
+            cols["like_instance"].append(-1 if domain is None
+                                         else tables["instances"].add(domain))
+
+        files = list(source.media_files())
+        for name, size in files:
+            tables["media"].add(name)
+            cols["media_size"].append(size)
+        group = {name: n
+                 for n, names in enumerate(find_duplicates(source, files))
+                 for name in names}
+        cols["media_duplicate"].extend(group.get(name, -1)
+                                       for name, _ in files)
+
+        return cls({name: memoryview(col) for name, col in cols.items()},
+                   {name: table.strings for name, table in tables.items()})
+
+    @staticmethod
+    def _add_activity(value, cols, tables):
+
+        """
+            store what the activity counts for in TimelineStats (see
+            mastotools.stats.counted)
+        """
+
+        c = counted(value)
+
+        def profile(name):
+            return -1 if name is None else tables["profiles"].add(name)
+
+        cols["type"].append(-1 if c.type is None
+                            else tables["types"].add(c.type))
+        cols["boosted"].append(profile(c.boosted))
+        if c.visibility is None:
+            cols["visibility"].append(0)
+            cols["year"].append(-1)
+            cols["reply"].append(NO_OBJECT)
+            cols["orphan"].append(-1)
+            cols["tag_offsets"].append(len(cols["tag_ids"]))
+            return
+
+        cols["visibility"].append(VISIBILITY[c.visibility])
+        cols["year"].append(-1 if c.year is None
+                            else tables["years"].add(c.year))
+        cols["reply"].append(ORIGINAL if c.replied is None
+                             else profile(c.replied))
+        if c.orphan is None:
+            cols["orphan"].append(-1)
+        else:
+            kind, who = c.orphan
+            cols["orphan"].append(2 * profile(who) + (kind != VANISHED))
+        for tag in c.tags:
+            cols["tag_ids"].append(tables["tags"].add(tag))
+        cols["tag_offsets"].append(len(cols["tag_ids"]))
+
+    def save(self, folder, sig):
+
+        """
+            write columns as raw arrays and the string tables as JSON
+        """
+
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(os.path.join(folder, META)):
+            os.remove(os.path.join(folder, META))
+        for name, col in self.columns.items():
+            with open(os.path.join(folder, name + ".bin"), "wb") as f:
+                f.write(col)
+        tmp = os.path.join(folder, META + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": VERSION,
+                       "signature": sig,
+                       "byteorder": sys.byteorder,
+                       "itemsizes": {name: array(code).itemsize
+                                     for name, code in COLUMNS.items()},
+                       "tables": self.tables,
+                       },
+                      f,
+                      )
+        # meta file last, an incomplete index is never valid
+        os.replace(tmp, os.path.join(folder, META))
+
+    @classmethod
+    def load(cls, folder, sig):
+
+        """
+            map a stored index into memory, None if there is no valid index
+            for the given signature
+        """
+
+        try:
+            with open(os.path.join(folder, META), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != VERSION \
+                or meta.get("signature") != sig \
+                or meta.get("byteorder") != sys.byteorder \
+                or meta.get("itemsizes") != {name: array(code).itemsize
+                                             for name, code
+                                             in COLUMNS.items()}:
+            return None
+
+        index = cls({}, meta["tables"])
+        for name, code in COLUMNS.items():
+            with open(os.path.join(folder, name + ".bin"), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # empty files can't be mapped
+                    index.columns[name] = memoryview(array(code))
+                    continue
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(m)
+            index._maps.append((m, view))
+            index.columns[name] = view.cast(code)
+        return index
+
+    def close(self):
+        for col in self.columns.values():
+            col.release()
+        for m, view in self._maps:
+            view.release()
+            m.close()
+
+    def timeline_stats(self):
+
+        """
+            TimelineStats of the outbox computed from the columns
+        """
+
+        cols, profiles = self.columns, self.tables["profiles"]
+        stats = TimelineStats()
+        stats.total = len(cols["type"])
+
+        for i, n in Counter(cols["type"]).items():
+            if i >= 0:
+                stats.posttype[self.tables["types"][i]] = n
+        for i, n in Counter(cols["boosted"]).items():
+            if i >= 0:
+                stats.boosted[profiles[i]] = n
+
+        names = {code: name for name, code in VISIBILITY.items()}
+        for code, n in Counter(cols["visibility"]).items():
+            if code:
+                stats.visibility[names[code]] = n
+
+        for i, n in Counter(cols["reply"]).items():
+            if i == ORIGINAL:
+                stats.originals = n
+            elif i >= 0:
+                stats.replies += n
+                stats.replied[profiles[i]] = n
+
+        for i, n in Counter(cols["orphan"]).items():
+            if i >= 0:
+                stats.orphaned += n
+                (stats.broken if i % 2 else stats.vanished)[
+                    profiles[i // 2]] = n
+
+        for i, n in Counter(cols["year"]).items():
+            if i >= 0:
+                stats.years[self.tables["years"][i]] = n
+
+        for i, n in Counter(cols["tag_ids"]).items():
+            stats.hashtags[self.tables["tags"][i]] = n
+        stats.tagged_posts = len(cols["tag_ids"])
+
+        return stats
+
+    def like_stats(self):
+
+        """
+            LikeStats of likes.json computed from the columns
+        """
+
+        stats = LikeStats()
+        stats.total = len(self.columns["like_platform"])
+        for i, n in Counter(self.columns["like_platform"]).items():
+            stats.platforms[self.tables["platforms"][i]] = n
+        for i, n in Counter(self.columns["like_profile"]).items():
+            if i >= 0:
+                stats.profiles[self.tables["profiles"][i]] = n
+        for i, n in Counter(self.columns["like_instance"]).items():
+            if i >= 0:
+                stats.instances[self.tables["instances"][i]] = n
+        return stats
+
+    def media_files(self):
+
+        """
+            yield (member name, size) of all media attachments
+        """
+
+        yield from zip(self.tables["media"], self.columns["media_size"])
+
+    def media_inventory(self):
+
+        """
+            MediaInventory of the media attachments
+        """
+
+        groups = {}
+        for name, n in zip(self.tables["media"],
+                           self.columns["media_duplicate"]):
+            if n >= 0:
+                groups.setdefault(n, []).append(name)
+        return MediaInventory(list(self.media_files()), groups.values())
+
+
+def open_index(path, classifier=None):
+
+    """
+        return the index of the archive at path, building and storing it
+        if there is no valid one
+    """
+
+    classifier = classifier or LikeClassifier()
+    folder = index_folder(path)
+    sig = {"files": signature(path), "likes": classifier.key}
+    index = ArchiveIndex.load(folder, sig)
+    if index is not None:
+        return index
+
+    with open_archive(path) as source:
+        index = ArchiveIndex.build(source, classifier)
+    try:
+        index.save(folder, sig)
+    except OSError as e:
+        print("could not write archive index:", e)
+    return index
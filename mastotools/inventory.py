@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+    inventory of the media attachments of an archive
+
+    files are grouped by type, the largest files are listed and identical
+    files are found; only files sharing their size with another file can be
+    identical, so only these are hashed (concurrently, hashing is mostly
+    waiting for the disk and hashlib releases the GIL)
+"""
+
+import heapq
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE, VIDEO, AUDIO = "Image", "Video", "Audio"
+
+TYPES = {
+    "jpg": IMAGE, "jpeg": IMAGE, "png": IMAGE, "gif": IMAGE, "webp": IMAGE,
+    "avif": IMAGE, "heic": IMAGE,
+    "mp4": VIDEO, "webm": VIDEO, "mov": VIDEO, "m4v": VIDEO,
+    "mp3": AUDIO, "m4a": AUDIO, "wav": AUDIO, "ogg": AUDIO, "oga": AUDIO,
+    "flac": AUDIO, "opus": AUDIO,
+}
+
+
+def media_type(name):
+
+    """
+        Image/Video/Audio or the file's extension
+    """
+
+    ext = os.path.splitext(name)[1][1:].lower()
+    return TYPES.get(ext, ext or "unknown")
+
+
+def find_duplicates(source, files, workers=None):
+
+    """
+        groups of identical files among [(member name, size)] of an archive
+        source, returns a list of lists of member names
+    """
+
+    by_size = defaultdict(list)
+    for name, size in files:
+        # empty files are all alike but don't waste anything
+        if size:
+            by_size[size].append(name)
+    candidates = [name for names in by_size.values() if len(names) > 1
+                  for name in names]
+    if not candidates:
+        return []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = pool.map(source.hash, candidates)
+        by_hash = defaultdict(list)
+        for name, digest in zip(candidates, hashes):
+            by_hash[digest].append(name)
+    return [names for names in by_hash.values() if len(names) > 1]
+
+
+def human_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return "{:.1f} {}".format(size, unit) if unit != "B" \
+        else "{} B".format(size)
+
+
+class MediaInventory:
+
+    """
+        numbers of the media attachments of an archive
+    """
+
+    def __init__(self, files, duplicates=()):
+        # [(member name, size)]
+        self.files = files
+        self.total = 0
+        self.count, self.size = Counter(), Counter()
+        for name, size in files:
+            t = media_type(name)
+            self.count[t] += 1
+            self.size[t] += size
+            self.total += size
+        # [(size, [member names])], largest waste first
+        sizes = dict(files)
+        self.duplicates = sorted(((sizes[names[0]], names)
+                                  for names in duplicates),
+                                 key=lambda d: -d[0] * (len(d[1]) - 1))
+
+    def largest(self, n=10):
+        return heapq.nlargest(n, self.files, key=lambda f: f[1])
+
+    @property
+    def wasted(self):
+
+        """
+            bytes taken by all but one copy of identical files
+        """
+
+        return sum(size * (len(names) - 1) for size, names in self.duplicates)
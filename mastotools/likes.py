@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+    classification of liked posts by platform
+
+    every platform is recognized by a regular expression on the URL of the
+    liked post, the first matching rule wins; a rule's pattern may contain
+    a group named "profile" which is counted as the liked profile
+
+    more rules can be given in the config (like_platforms), they are
+    checked before the built-in ones
+"""
+
+import hashlib
+import json
+import re
+from collections import Counter
+
+VANISHED = "unknown (vanished posts)"
+
+# (platform, pattern)
+RULES = (
+    (VANISHED, r"^(?:tag|urn):"),
+    ("Mastodon", r"^(?P<profile>[^?#]*?/users/[^/?#]+)"),
+    ("Pixelfed", r"/p/"),
+    ("Pleroma", r"/objects/"),
+    ("Hubzilla", r"/item/"),
+    ("PeerTube", r"/videos/"),
+    ("Misskey", r"/notes/"),
+)
+
+_DOMAIN = re.compile(r"^(?:[a-z][a-z0-9+.-]*://(?:[^@/?#]*@)?|tag:)"
+                     r"(?P<domain>[^/?#:,]+)",
+                     re.IGNORECASE,
+                     )
+
+
+def instance(url):
+
+    """
+        domain of the instance a liked post is on, None if unknown
+    """
+
+    m = _DOMAIN.match(url)
+    return m.group("domain").lower() if m else None
+
+
+class LikeClassifier:
+
+    """
+        precompiled rules, classify() returns (platform, profile or None)
+    """
+
+    def __init__(self, rules=RULES):
+        self.rules = tuple((platform, pattern) for platform, pattern in rules)
+        self._compiled = []
+        for platform, pattern in self.rules:
+            pattern = re.compile(pattern)
+            self._compiled.append((platform,
+                                   pattern,
+                                   "profile" in pattern.groupindex,
+                                   ))
+
+    @classmethod
+    def from_config(cls, config):
+
+        """
+            built-in rules extended by the "like_platforms" of the config,
+            a mapping of platform name -> pattern or list of patterns
+        """
+
+        extra = []
+        for platform, patterns in ((config or {}).get("like_platforms")
+                                   or {}).items():
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            extra.extend((platform, pattern) for pattern in patterns)
+        return cls(tuple(extra) + RULES)
+
+    @property
+    def key(self):
+
+        """
+            fingerprint of the rules, results classified with other rules
+            are not comparable
+        """
+
+        return hashlib.sha1(json.dumps(self.rules).encode("utf-8")) \
+            .hexdigest()
+
+    def classify(self, url):
+        for platform, pattern, profile in self._compiled:
+            m = pattern.search(url)
+            if m is not None:
+                return platform, m.group("profile") if profile else None
+        # unknown platforms are grouped by instance
+        return "unknown ({})".format(instance(url)), None
+
+
+class LikeStats:
+
+    """
+        numbers of likes.json, see ArchiveIndex.like_stats
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.platforms = Counter()
+        # instance domains of liked posts
+        self.instances = Counter()
+        # liked profiles
+        self.profiles = Counter()
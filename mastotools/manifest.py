@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+    manifest of a previous import run
+
+    the manifest is stored as JSON in the output folder and remembers for
+    every imported toot (keyed by status ID) its slug and a hash of the
+    generated post, the content hashes of archive members and the
+    watermark state of media files; a re-import only touches what is new
+    or changed
+"""
+
+import hashlib
+import json
+import os
+
+from mastotools.variants import image_width
+
+FILENAME = "import_mastodon_manifest.json"
+
+
+def post_hash(*fields):
+
+    """
+        sha1 hex digest of everything that ends up in a post's files
+    """
+
+    return hashlib.sha1(json.dumps(fields,
+                                   sort_keys=True,
+                                   default=str,
+                                   ).encode("utf-8")).hexdigest()
+
+
+class Manifest:
+
+    """
+        - posts: status ID -> {"slug", "hash", "folder"}, "folder" is the
+          posts folder relative to the site (not known for posts written
+          by older versions)
+        - sources: archive member -> {"size", "mtime", "hash"}
+        - media: content-addressed path relative to the site ->
+          {"watermark", "width"}, "watermark" is the text the file has been
+          marked with or None, "width" is only known for images that have
+          variants
+        - variants: path of an image variant relative to the site ->
+          {"watermark", "quality"} of the image it was made from
+        - next_number: first free number for new post slugs
+    """
+
+    VERSION = 2
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, FILENAME)
+        self.posts, self.sources, self.media = {}, {}, {}
+        self.variants = {}
+        self.next_number = 0
+        # entries added since the last pop_changes, used to collect the
+        # results of worker processes
+        self._changes = {"posts": {}, "sources": {}, "media": {}}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.load_data(json.load(f))
+
+    def load_data(self, data):
+        self.posts = data.get("posts", {})
+        self.next_number = data.get("next_number", 0)
+        # media layout of older manifests is not compatible
+        if data.get("version") == self.VERSION:
+            self.sources = data.get("sources", {})
+            self.media = data.get("media", {})
+            self.variants = data.get("variants", {})
+
+    def data(self):
+        return {"version": self.VERSION,
+                "posts": self.posts,
+                "sources": self.sources,
+                "media": self.media,
+                "variants": self.variants,
+                "next_number": self.next_number,
+                }
+
+    def slug(self, status_id):
+        try:
+            return self.posts[status_id]["slug"]
+        except KeyError:
+            return None
+
+    def post_unchanged(self, status_id, digest, files):
+
+        """
+            True if the post has been written with identical content and
+            its files still exist
+        """
+
+        entry = self.posts.get(status_id)
+        return entry is not None and entry["hash"] == digest \
+            and all(os.path.exists(f) for f in files)
+
+    def add_post(self, status_id, slug, digest, folder):
+        self.posts[status_id] = self._changes["posts"][status_id] = \
+            {"slug": slug, "hash": digest, "folder": folder}
+
+    def remove_post(self, status_id):
+        # None marks the removal in the changes
+        self.posts.pop(status_id, None)
+        self._changes["posts"][status_id] = None
+
+    def media_hash(self, source, name):
+
+        """
+            content hash of an archive member, the member is only hashed if
+            its size or mtime differ from the previous run (which is the
+            case for every freshly extracted export)
+        """
+
+        size, mtime = source.stat(name)
+        entry = self.sources.get(name)
+        if entry is None or (size, mtime) != (entry["size"], entry["mtime"]):
+            entry = self.sources[name] = self._changes["sources"][name] = \
+                {"size": size, "mtime": mtime, "hash": source.hash(name)}
+        return entry["hash"]
+
+    def media_unchanged(self, key, dst, watermark):
+
+        """
+            True if the media file is already in place with the wanted
+            watermark (or none yet, watermarks are added afterwards)
+        """
+
+        entry = self.media.get(key)
+        return entry is not None and os.path.exists(dst) \
+            and entry["watermark"] in (None, watermark)
+
+    def add_media(self, key):
+        self.media[key] = self._changes["media"][key] = {"watermark": None}
+
+    def media_width(self, key, path):
+
+        """
+            width of an image (None if it has no variants), remembered so
+            the image is only opened once
+        """
+
+        if "width" not in self.media[key]:
+            self.set_media_width(key, image_width(path))
+        return self.media[key]["width"]
+
+    def set_media_width(self, key, width):
+        self.media[key] = self._changes["media"][key] = \
+            dict(self.media[key], width=width)
+
+    def pop_changes(self):
+        changes = self._changes
+        self._changes = {"posts": {}, "sources": {}, "media": {}}
+        return changes
+
+    def merge_changes(self, changes):
+        for status_id, entry in changes["posts"].items():
+            if entry is None:
+                self.posts.pop(status_id, None)
+            else:
+                self.posts[status_id] = entry
+        self.sources.update(changes["sources"])
+        self.media.update(changes["media"])
+
+    def save(self):
+
+        """
+            write manifest, a crash while writing keeps the old one
+        """
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data(), f)
+        os.replace(tmp, self.path)
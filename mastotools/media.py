@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+    content-addressed storage of media files in the site
+
+    media files are stored under their content hash
+    ("images/ab/abcdef....png") so identical attachments are stored once
+    and different files with the same name can't overwrite each other;
+    files are copied the cheapest way the filesystem offers
+"""
+
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# ioctl request to clone a file's extents (Btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+COPY_BUFSIZE = 1 << 20
+
+
+def media_path(digest, name):
+
+    """
+        relative path of a media file in the images/files folder, the
+        first two characters of the hash are used as subfolder to keep
+        folders small
+    """
+
+    ext = os.path.splitext(name)[1].lower()
+    return "/".join((digest[:2], digest + ext))
+
+
+def _reflink(fsrc, fdst):
+    if fcntl is None:
+        raise OSError("reflinks not supported")
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_range(fsrc, fdst):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError("copy_file_range not supported")
+    size = os.fstat(fsrc.fileno()).st_size
+    offset = 0
+    while offset < size:
+        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset)
+        if n == 0:
+            break
+        offset += n
+
+
+def copy_file(src, dst, hardlink=False):
+
+    """
+        copy src to dst, in order of preference by
+            - hardlink (if allowed, the site then shares the file with the
+              extracted archive)
+            - reflink (copy-on-write clone, no data is copied at all)
+            - copy_file_range (copy inside the kernel)
+            - buffered copy
+        returns the method that was used
+    """
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if hardlink:
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+
+    # copy to a temporary file first, dst either is complete or not there
+    tmp = "{}.part{}".format(dst, os.getpid())
+    with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+        for method, func in (("reflink", _reflink),
+                             ("copy_file_range", _copy_range),
+                             ):
+            try:
+                func(fsrc, fdst)
+                break
+            except OSError:
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        else:
+            method = "copy"
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+    os.replace(tmp, dst)
+    return method
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+    several archives of one person imported as one
+
+    people who moved to another instance have an export of every account;
+    the outboxes are merged by date in a single streaming pass (k-way merge,
+    Mastodon writes the outbox oldest first), only one activity per archive
+    is held at a time
+
+    copies of the same toot in several archives (exported twice, or copied
+    to the new account by a migration tool) are dropped: they have the same
+    date and either the same ID or, if they come from different archives,
+    the same text; only the IDs and text hashes of the current date are
+    remembered, so copies with another date (a tool that posted them anew)
+    are kept; activities without a date count as posted at the date of the
+    activity before them in their outbox
+
+    media files of the first archive keep their member names, members of
+    the other archives are addressed as "<number>:<member>" so files with
+    the same path in different archives don't get mixed up
+"""
+
+import hashlib
+import heapq
+import html
+import json
+
+from mastotools.content import TEXT, tokens
+from mastotools.source import member_name, open_archive
+
+
+def open_archives(paths, staging=None, widths=False):
+
+    """
+        source of a single archive or a MergedSource of several
+    """
+
+    sources = []
+    try:
+        for path in paths:
+            sources.append(open_archive(path, staging, widths))
+    except BaseException:
+        for source in sources:
+            source.close()
+        raise
+    return sources[0] if len(sources) == 1 else MergedSource(sources)
+
+
+def archive_prefix(nr):
+    return "{}:".format(nr) if nr else ""
+
+
+def actor_ids(actor):
+
+    """
+        IDs of an account: its own and the ones it was known as before
+        ("alsoKnownAs" of a moved account)
+    """
+
+    ids = [actor["id"]]
+    aka = actor.get("alsoKnownAs") or []
+    if isinstance(aka, str):
+        aka = [aka]
+    ids.extend(i for i in aka if i not in ids)
+    return ids
+
+
+def main_actor(actors):
+
+    """
+        index of the current account among the actors of several archives,
+        the first one that hasn't moved elsewhere
+    """
+
+    for nr, actor in enumerate(actors):
+        if not actor.get("movedTo"):
+            return nr
+    return 0
+
+
+def text_hash(content):
+
+    """
+        hash of the text of a toot without markup, links to hashtags and
+        profiles differ between instances
+    """
+
+    text = "".join(token.raw for token in tokens(content or "")
+                   if token.kind == TEXT)
+    return hashlib.sha1(" ".join(html.unescape(text).split())
+                        .encode("utf-8")).hexdigest()
+
+
+def _keys(value):
+
+    """
+        keys identifying an activity: its IDs and what it is about (only
+        compared between archives, toots of one archive with the same text
+        and date are still different toots)
+    """
+
+    if not isinstance(value, dict):
+        return (), ()
+    obj = value.get("object")
+    if isinstance(obj, dict):
+        attachments = obj.get("attachment")
+        return ((value.get("id"), obj.get("id")),
+                (("text",
+                  text_hash(obj.get("content")),
+                  len(attachments) if isinstance(attachments, list) else 0,
+                  ),))
+    # boost: the boosted toot
+    return (value.get("id"),), (("boost", str(obj)),)
+
+
+def _published(value):
+    return (value.get("published") if isinstance(value, dict) else None) \
+        or ""
+
+
+def _prefixed(value, prefix):
+
+    """
+        point media attachments of an activity to its archive
+    """
+
+    obj = value.get("object") if isinstance(value, dict) else None
+    if prefix and isinstance(obj, dict) \
+            and isinstance(obj.get("attachment"), list):
+        for media in obj["attachment"]:
+            if isinstance(media, dict) and "url" in media:
+                media["url"] = prefix + member_name(media["url"])
+    return value
+
+
+class MergedOutbox:
+
+    """
+        outbox activities of several archives in order of their date
+        without duplicates, `header` like a single OrderedItemsReader
+        (totalItems add up)
+    """
+
+    def __init__(self, readers):
+        self.readers = readers
+        # number of dropped copies, known after iterating
+        self.duplicates = 0
+
+    @property
+    def header(self):
+        header = {}
+        for reader in self.readers:
+            for key, value in reader.header.items():
+                if key == "totalItems" and key in header:
+                    header[key] += value
+                else:
+                    header.setdefault(key, value)
+        return header
+
+    def __iter__(self):
+        streams = [self._stream(nr, reader)
+                   for nr, reader in enumerate(self.readers)]
+        # IDs of the activities of the current date, archives of their
+        # content keys
+        date, ids, contents = None, set(), {}
+        # activities of the same date come in the order of the archives
+        for published, nr, value in heapq.merge(*streams,
+                                                key=lambda item: item[0]):
+            if published != date:
+                date, ids, contents = published, set(), {}
+            id_keys, content_keys = _keys(value)
+            id_keys = {k for k in id_keys if k is not None}
+            # same ID, or same content in another archive
+            if id_keys & ids or any(contents.get(k, set()) - {nr}
+                                    for k in content_keys):
+                self.duplicates += 1
+                continue
+            ids |= id_keys
+            for key in content_keys:
+                contents.setdefault(key, set()).add(nr)
+            yield value
+
+    @staticmethod
+    def _stream(nr, reader):
+        prefix = archive_prefix(nr)
+        # activities without a date are merged with the date of the one
+        # before them, so they keep their place and the stream stays in
+        # order
+        date = ""
+        for value in reader:
+            date = _published(value) or date
+            yield date, nr, _prefixed(value, prefix)
+
+
+class MergedSource:
+
+    """
+        several archive sources as one, see the module docstring for member
+        names; outbox.json is the merged outbox, other members are read
+        from the first archive unless prefixed
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    @property
+    def sequential(self):
+        return any(source.sequential for source in self.sources)
+
+    def _route(self, name):
+        nr, sep, member = name.partition(":")
+        if sep and nr.isdigit():
+            return self.sources[int(nr)], member
+        return self.sources[0], name
+
+    def open(self, name):
+        source, name = self._route(name)
+        return source.open(name)
+
+    def open_text(self, name):
+        source, name = self._route(name)
+        return source.open_text(name)
+
+    def ordered_items(self, name):
+        if name == "outbox.json":
+            return MergedOutbox([s.ordered_items(name)
+                                 for s in self.sources])
+        source, name = self._route(name)
+        return source.ordered_items(name)
+
+    def actors(self):
+        actors = []
+        for source in self.sources:
+            with source.open_text("actor.json") as f:
+                actors.append(json.load(f))
+        return actors
+
+    def exists(self, name):
+        source, name = self._route(name)
+        return source.exists(name)
+
+    def stat(self, name):
+        if name == "outbox.json":
+            stats = [s.stat(name) for s in self.sources]
+            return sum(s[0] for s in stats), max(s[1] for s in stats)
+        source, name = self._route(name)
+        return source.stat(name)
+
+    def hash(self, name):
+        source, name = self._route(name)
+        return source.hash(name)
+
+    def copy(self, name, dst, hardlink=False):
+        source, name = self._route(name)
+        source.copy(name, dst, hardlink)
+
+    def copy_each(self, jobs, hardlink=False):
+        todo = [[] for _ in self.sources]
+        for nr, (name, dst) in enumerate(jobs):
+            source, name = self._route(name)
+            todo[self.sources.index(source)].append((nr, name, dst))
+        for source, jobs in zip(self.sources, todo):
+            for i in source.copy_each([(name, dst) for _, name, dst in jobs],
+                                      hardlink):
+                yield jobs[i][0]
+
+    def image_width(self, name):
+        source, name = self._route(name)
+        return source.image_width(name)
+
+    def media_files(self):
+        for nr, source in enumerate(self.sources):
+            prefix = archive_prefix(nr)
+            for name, size in source.media_files():
+                yield prefix + name, size
+
+    def reopen(self):
+        for source in self.sources:
+            source.reopen()
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
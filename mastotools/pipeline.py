@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+    stages of the import connected by bounded queues
+
+    reading the outbox (parsing, classifying, assigning slugs) runs in a
+    thread of its own and stays a limited number of toots ahead of the
+    posts being written; file operations (copying media, writing .meta and
+    .html files) are handed to a few I/O threads so the disk is busy while
+    the next post's content is prepared; memory is capped by the depth of
+    the queues
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# toots read ahead of the posts being written
+PREFETCH_DEPTH = 256
+# file operations waiting for an I/O thread
+IO_DEPTH = 64
+IO_THREADS = 4
+
+
+def prefetch(iterable, depth=PREFETCH_DEPTH):
+
+    """
+        iterate over iterable in a background thread, at most depth items
+        are waiting to be consumed; exceptions are raised in the consuming
+        thread
+    """
+
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except BaseException as e:
+            put((False, e))
+        else:
+            put((False, None))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = q.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        # the consumer gave up, let the producer finish
+        stop.set()
+        thread.join()
+
+
+class IOQueue:
+
+    """
+        file operations executed by a pool of threads, submit() blocks if
+        depth operations are waiting; the first error is raised by the next
+        submit() or flush()
+
+        with threads=0 operations are executed right away
+    """
+
+    def __init__(self, threads=IO_THREADS, depth=IO_DEPTH):
+        self.threads = threads
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(max(depth, 1))
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._error = None
+
+    def submit(self, fn, *args):
+        self._raise()
+        if not self.threads:
+            fn(*args)
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.threads,
+                                            thread_name_prefix="io",
+                                            )
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if self._error is None and not future.cancelled():
+                self._error = future.exception()
+        self._slots.release()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def flush(self):
+
+        """
+            wait for all submitted operations
+        """
+
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+        self._raise()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
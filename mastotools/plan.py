@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+"""
+    import plan: the operations of an import and a journal of the ones done
+
+    preparing the posts (reading the outbox, rewriting and rendering the
+    posts, hashing the media files) results in operations: write the files
+    of a post, copy a media file, watermark an image, write a file of the
+    search index, remove the files of a post that moved; they are executed
+    by I/O threads right away while the next posts are prepared, only
+    watermarks (and copies from tar archives, which are done in a single
+    pass over the archive) wait until all posts are done
+
+    every CHECKPOINT_OPS operations the import waits until they are on disk
+    and appends a short record of each of them to a journal in the output
+    folder (kind, target and what identifies the content, e.g. the hash of
+    a post, not the content itself); images are watermarked into a copy
+    (see marked_path), the watermark is journaled and only then the image
+    is replaced by the copy, so an image is either marked and journaled or
+    not marked at all
+
+    an interrupted import (Ctrl-C, crash, full disk) is resumed by running
+    it again with the same archives and config: the posts are prepared
+    again, but operations with a record in the journal are not executed
+    again, so files are written, copied and watermarked only once (an image
+    must not be watermarked twice, a watermarked copy journaled but not in
+    place yet replaces its image when the next import starts); operations
+    done after the last checkpoint are simply done again, that's fine for writing and
+    copying files
+
+    with dry_run the operations are only counted
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+
+VERSION = 2
+
+# operations (first item of every list)
+#   [WRITE, status ID, meta file, html file, post hash, metadata, html text]
+#   [COPY, media key, destination, archive member, size]
+#   [WATERMARK, media key, text, size]
+#   [FILE, path, hash, text, size] (gzipped if the path ends in .gz)
+#   [REMOVE, path] (file of a post written elsewhere before)
+WRITE, COPY, WATERMARK, FILE, REMOVE = \
+    "write", "copy", "watermark", "file", "remove"
+
+# number of items of an operation that make up its journal record
+RECORD = {WRITE: 5, COPY: 3, WATERMARK: 3, FILE: 3, REMOVE: 2}
+
+# archives, config and version of the plan
+INFO_FILE = "import_mastodon_plan.json"
+JOURNAL_FILE = "import_mastodon_plan.done"
+
+# operations between checkpoints (watermarks and deferred copies are
+# journaled one by one)
+CHECKPOINT_OPS = 1000
+
+# folders of the media files and image variants in the site, temporary
+# files ("abc.png.part1234", "abc-480w.webp.tmp1234") are written there
+MEDIA_FOLDERS = ("images", "files")
+PARTIAL = re.compile(r"\.(part|tmp)\d+$")
+# suffix of watermarked copies of images, see marked_path
+MARKED = ".marked"
+
+
+def plan_key(*parts):
+
+    """
+        hash of everything a plan depends on (archives, config, ...)
+    """
+
+    return hashlib.sha1(json.dumps(parts,
+                                   sort_keys=True,
+                                   default=str,
+                                   ).encode("utf-8")).hexdigest()
+
+
+def file_data(path, text):
+
+    """
+        content of a FILE operation's file
+    """
+
+    data = text.encode("utf-8")
+    if path.endswith(".gz"):
+        # no timestamp, the same text always gives the same file
+        data = gzip.compress(data, compresslevel=6, mtime=0)
+    return data
+
+
+def marked_path(path):
+
+    """
+        watermarked copy of an image, it replaces the image once the
+        watermark is journaled
+    """
+
+    return path + MARKED
+
+
+def op_size(op):
+
+    """
+        bytes an operation writes
+    """
+
+    if op[0] == WRITE:
+        return len(op[5].encode("utf-8")) + len(op[6].encode("utf-8"))
+    if op[0] == REMOVE:
+        return 0
+    return op[-1]
+
+
+def op_record(op):
+
+    """
+        journal line of an operation
+    """
+
+    return json.dumps(op[:RECORD[op[0]]])
+
+
+class ImportPlan:
+
+    """
+        operations of an import in the output folder, see the module
+        docstring; key identifies archive and config the plan is made for
+    """
+
+    def __init__(self, folder, key=None, dry_run=False,
+                 every=CHECKPOINT_OPS, defer_copies=False):
+        self.folder = folder
+        self.key = key
+        self.dry_run = dry_run
+        self.every = every
+        self.defer_copies = defer_copies
+        self.info_path = os.path.join(folder, INFO_FILE)
+        self.journal_path = os.path.join(folder, JOURNAL_FILE)
+        # number, files and bytes per kind of operation to do
+        self.ops = 0
+        self.counts, self.bytes = Counter(), Counter()
+        # journal records of an interrupted import, number of operations
+        # per kind not done again because of them
+        self.done, self.skipped = set(), Counter()
+        # WATERMARK operations, see CommandImportMastodon.watermark_images
+        self.watermarks = []
+        # COPY operations with defer_copies, see
+        # CommandImportMastodon.copy_media
+        self.copies = []
+        # destination -> size of planned copies, a file is copied once
+        self._copies = {}
+        # execute(op) and flush() of the other operations
+        self._execute = self._flush = None
+        # records of the operations executed since the last checkpoint
+        self._unsaved = []
+
+    def _info(self):
+        try:
+            with open(self.info_path, encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return info if info.get("version") == VERSION else None
+
+    def resumable(self):
+
+        """
+            True if an interrupted import with the same key left a journal
+            behind
+        """
+
+        info = self._info()
+        return info is not None and info["key"] == self.key
+
+    def start(self, manifest):
+
+        """
+            resume an interrupted import with the same key, otherwise
+            discard what's left of another one and start a new journal
+        """
+
+        if self._info() is not None and not self.dry_run:
+            self.remove_partial()
+        if self.resumable():
+            self.done = set(self._journal())
+            return
+        self.discard(manifest)
+        if self.dry_run:
+            return
+        self.remove()
+        os.makedirs(self.folder, exist_ok=True)
+        tmp = self.info_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": VERSION, "key": self.key}, f)
+            os.replace(tmp, self.info_path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def set_executor(self, execute, flush):
+
+        """
+            operations other than watermarks are handed to execute() as
+            they are added, flush() waits until they are done
+        """
+
+        self._execute, self._flush = execute, flush
+
+    def add(self, op):
+
+        """
+            add an operation, copies of a file already planned are dropped;
+            returns False if the operation has been done by an interrupted
+            import (or is a dropped copy)
+        """
+
+        if op[0] == COPY:
+            if op[2] in self._copies:
+                return False
+            self._copies[op[2]] = op[4]
+        record = op_record(op)
+        if record in self.done:
+            self.skipped[op[0]] += 1
+            return False
+        self.ops += 1
+        self.counts[op[0]] += 1
+        self.bytes[op[0]] += op_size(op)
+        if op[0] == WATERMARK:
+            self.watermarks.append(op)
+        elif op[0] == COPY and self.defer_copies:
+            self.copies.append(op)
+        elif self._execute is not None and not self.dry_run:
+            self._execute(op)
+            self._unsaved.append(record)
+            if len(self._unsaved) >= self.every:
+                self.checkpoint()
+        return True
+
+    def add_watermark(self, key, text):
+
+        """
+            plan to watermark an image (media key "images/..."), False if
+            it has been watermarked by an interrupted import
+        """
+
+        path = os.path.join(self.folder, *key.split("/"))
+        size = self._copies.get(path)
+        if size is None:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+        return self.add([WATERMARK, key, text, size])
+
+    def add_file(self, path, text):
+
+        """
+            plan to write a file (path relative to the output folder) unless
+            it's already there with the same content
+        """
+
+        path = os.path.join(self.folder, *path.split("/"))
+        data = file_data(path, text)
+        if os.path.exists(path) and os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return
+        self.add([FILE, path, hashlib.sha1(data).hexdigest(), text,
+                  len(data)])
+
+    def checkpoint(self):
+
+        """
+            wait until the operations executed so far are done and journal
+            them
+        """
+
+        if self._flush is not None:
+            self._flush()
+        if self._unsaved:
+            self._append("".join(record + "\n" for record in self._unsaved))
+            self._unsaved = []
+
+    def journal(self, op):
+
+        """
+            a single operation (watermark, deferred copy) is done
+        """
+
+        self._append(op_record(op) + "\n")
+
+    def _append(self, text):
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+    def _journal(self):
+
+        """
+            records of the operations done
+        """
+
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                json.loads(line)
+            except ValueError:
+                # cut off by a crash
+                continue
+            yield line
+
+    def discard(self, manifest):
+
+        """
+            an interrupted import of another archive or config is not
+            resumed, but files it has already copied or watermarked are
+            recorded in the (previous) manifest so they are copied again
+            if needed; files of posts the manifest doesn't know are
+            removed, they are written again if they are still wanted
+        """
+
+        if self._info() is None:
+            return
+        for line in self._journal():
+            record = json.loads(line)
+            if record[0] == WRITE:
+                if record[1] not in manifest.posts and not self.dry_run:
+                    for path in (record[2], record[3]):
+                        if os.path.exists(path):
+                            os.remove(path)
+                continue
+            entry = manifest.media.get(record[1])
+            if record[0] == COPY and entry is not None:
+                manifest.media[record[1]] = {"watermark": None}
+            elif record[0] == WATERMARK and entry is not None:
+                entry["watermark"] = record[2]
+
+    def remove_partial(self):
+
+        """
+            clean up the media folders after a killed import: temporary
+            files are removed, watermarked copies of images replace their
+            image if the watermark has been journaled and are removed
+            otherwise
+        """
+
+        marked = set()
+        for line in self._journal():
+            record = json.loads(line)
+            if record[0] == WATERMARK:
+                marked.add(record[1])
+        stack = [os.path.join(self.folder, name) for name in MEDIA_FOLDERS]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(MARKED):
+                        path = entry.path[:-len(MARKED)]
+                        key = os.path.relpath(path, self.folder)
+                        if key.replace(os.sep, "/") in marked:
+                            os.replace(entry.path, path)
+                        else:
+                            os.remove(entry.path)
+                    elif PARTIAL.search(entry.name):
+                        os.remove(entry.path)
+
+    def remove(self):
+
+        """
+            delete the plan (after the import is complete)
+        """
+
+        for path in (self.info_path, self.info_path + ".tmp",
+                     self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
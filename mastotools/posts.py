@@ -0,0 +1,601 @@
+# -*- coding: utf-8 -*-
+
+"""
+    turn toots into Nikola posts
+
+    preparing posts results in the operations of an import plan (see
+    mastotools.plan), they are executed by I/O threads while the next
+    posts are prepared
+
+    every post is independent of the others once its slug is assigned, so
+    posts can be prepared by a pool of worker processes; work is handed out
+    in chunks and the operations and manifest updates of the workers are
+    merged in the order the chunks were submitted, the result is identical
+    to preparing the posts one after another
+
+    the toots are read ahead in a thread of their own and files are
+    written by I/O threads, see mastotools.pipeline
+"""
+
+import io
+import os
+from collections import Counter, deque
+
+from lxml import etree, html as lxml_html
+from nikola import utils
+from nikola.plugins.basic_import import replacer
+
+from mastotools.content import rewrite, tag_link
+from mastotools.manifest import Manifest, post_hash
+from mastotools.media import media_path
+from mastotools.pipeline import IOQueue, prefetch
+from mastotools.plan import COPY, FILE, REMOVE, WRITE, file_data
+from mastotools.profiler import Profiler
+from mastotools.search import document
+from mastotools.stats import FOLLOWERS_ONLY, PUBLIC
+from mastotools.variants import configured_widths, srcset
+
+# posts per work unit handed to a worker process
+CHUNK_SIZE = 64
+
+# WRITTEN: the post is going to be written
+WRITTEN, UNCHANGED = "written", "unchanged"
+
+# categories of posts by visibility, direct messages have none
+CATEGORIES = {PUBLIC: "public", FOLLOWERS_ONLY: "followers only"}
+
+# layouts of the posts folder
+FLAT, DATED = "flat", "dated"
+
+
+def status_slug(post):
+
+    """
+        stable slug of a toot, the number of its status ID
+    """
+
+    return post.id.rstrip("/").rsplit("/", 1)[1]
+
+
+def toot_domain(post):
+
+    """
+        instance (https://instance.domain) a toot was posted on, imported
+        archives may come from several accounts (see mastotools.merge)
+    """
+
+    domain, sep, _ = post.id.partition("/users/")
+    return domain if sep else None
+
+
+def render_html(content):
+
+    """
+        the .html file of a post as ImportMixin.write_content writes it
+        (links rewritten by the import's link map, re-serialized by lxml)
+    """
+
+    try:
+        doc = lxml_html.document_fromstring(content)
+        doc.rewrite_links(replacer)
+        return lxml_html.tostring(doc, encoding="utf8").decode("utf-8")
+    except etree.ParserError:
+        return content
+
+
+def post_folder(post, layout=FLAT):
+
+    """
+        folder of a post relative to the site, posts/YYYY/MM with the dated
+        layout
+    """
+
+    if layout == DATED:
+        return "/".join(("posts", post.published[:4], post.published[5:7]))
+    return "posts"
+
+
+class PostWriter:
+
+    """
+        prepare .meta/.html files of posts and copies of their media files
+        as operations of an import plan (collected in ops, see pop_ops),
+        execute such operations
+    """
+
+    def __init__(self, config, output_folder, source, manifest,
+                 metadata_format="nikola", profiler=None):
+        self.config = config
+        self.output_folder = output_folder
+        self.source = source
+        self.manifest = manifest
+        self.metadata_format = metadata_format
+        self.profiler = profiler or Profiler()
+        self.widths = configured_widths(config)
+        self.layout = config.get("post_layout") or FLAT
+        # media links are relative to the output page of a post
+        # (posts/slug/index.html or posts/YYYY/MM/slug/index.html)
+        self.up = ("..",) * (2 if self.layout == FLAT else 4)
+        self.io = IOQueue()
+        # planned operations, not handed on yet
+        self.ops = []
+        # words of the posts for the search index, see mastotools.search
+        self.search = config.get("search", True)
+        self.docs = []
+        # media files planned to be copied, not in place yet
+        self._queued = set()
+        # folders files have been removed from
+        self._emptied = set()
+
+    def write(self, slug, post, replies=()):
+
+        """
+            plan to write a single post, posts that have been imported
+            before with identical content are not written again
+
+            replies (to oneself) are appended to the toot's content, see
+            mastotools.threads
+        """
+
+        config = self.config
+        profiler = self.profiler
+
+        title = slug
+
+        post_date = post.published
+
+        # link to original post, this may result in deadlinks
+        # if you move or delete your account
+        post_link = post.id if config["originalsource"] else ""
+
+        # turn visibility status into category, in Nikola a post can
+        # only belong to one category
+        cat = CATEGORIES.get(post.visibility, "")
+
+        tags, parts = [], []
+        for toot in (post, *replies):
+            _tags, image_files, media_files = self.tags_and_media(toot)
+            tags.extend(t for t in _tags if t not in tags)
+
+            # edit html source
+            with profiler.step("content rewrite"):
+                parts.append(self.prepare_content(toot.content,
+                                                  image_files,
+                                                  media_files,
+                                                  toot_domain(toot) or
+                                                  config["domain"],
+                                                  ))
+        content = "".join(parts)
+        profiler.add("content rewrite", items=1, nbytes=len(content))
+
+        # additional metadata
+        # the passed metadata objects are limited by the
+        # basic_import's write_metadata function
+        more = {"link": post_link,  # original Mastodon post
+                "hidetitle": True,  # doesn't work for index pages
+                "category": cat,
+                }
+
+        if self.search:
+            with profiler.step("search words"):
+                # link to the page of the post relative to the site
+                self.docs.append(document(
+                    "/".join((post_folder(post, self.layout), slug, "")),
+                    post,
+                    replies,
+                ))
+
+        # replies written as posts of their own by an earlier import (without
+        # threads) are only published as part of their thread now
+        for toot in replies:
+            if toot.id in self.manifest.posts:
+                for path in self.old_files(toot, ()):
+                    self.ops.append([REMOVE, path])
+                self.manifest.remove_post(toot.id)
+
+        rel_folder = post_folder(post, self.layout)
+        folder = os.path.join(self.output_folder, *rel_folder.split("/"))
+        meta_file = os.path.join(folder, slug + ".meta")
+        html_file = os.path.join(folder, slug + ".html")
+
+        # leave files of unchanged posts (and their mtime) alone
+        digest = post_hash(title, slug, post_date, tags, more, content)
+        if self.manifest.post_unchanged(post.id,
+                                        digest,
+                                        (meta_file, html_file),
+                                        ):
+            return UNCHANGED
+
+        # the files are rendered here (in the worker processes) so the
+        # plan holds their exact content
+        with profiler.step("html render"):
+            metadata = self.metadata_text(title,
+                                          slug,
+                                          post_date,
+                                          "",  # description always empty
+                                          tags,
+                                          more,
+                                          )
+            text = render_html(content)
+        # a post is only published once, even if the layout changed
+        for path in self.old_files(post, (meta_file, html_file)):
+            self.ops.append([REMOVE, path])
+        self.ops.append([WRITE, post.id, meta_file, html_file, digest,
+                         metadata, text])
+
+        self.manifest.add_post(post.id, slug, digest, rel_folder)
+        return WRITTEN
+
+    def old_files(self, post, files):
+
+        """
+            files of a post written by an earlier import to another place
+            (other layout or slug) than files; older manifests don't know the
+            folder, the folders of both layouts are tried
+        """
+
+        entry = self.manifest.posts.get(post.id)
+        if entry is None:
+            return []
+        if "folder" in entry:
+            folders = [entry["folder"]]
+        else:
+            folders = [post_folder(post, FLAT), post_folder(post, DATED)]
+        old = []
+        for folder in folders:
+            base = os.path.join(self.output_folder,
+                                *folder.split("/"),
+                                entry["slug"],
+                                )
+            for path in (base + ".meta", base + ".html"):
+                if path not in files and os.path.exists(path):
+                    old.append(path)
+        return old
+
+    def pop_ops(self):
+        ops, self.ops = self.ops, []
+        return ops
+
+    def pop_docs(self):
+        docs, self.docs = self.docs, []
+        return docs
+
+    def execute(self, op):
+
+        """
+            execute a planned operation (WRITE, COPY, FILE or REMOVE) by an
+            I/O thread
+        """
+
+        if op[0] == WRITE:
+            self.io.submit(self.write_files, op[2], op[5], op[3], op[6])
+        elif op[0] == FILE:
+            self.io.submit(self.write_file, op[1], op[3])
+        elif op[0] == REMOVE:
+            self.io.submit(self.remove_file, op[1])
+        else:
+            self.io.submit(self.copy_file, op[3], op[2])
+
+    def write_files(self, meta_file, metadata, html_file, text):
+
+        """
+            write .meta and .html file of a post
+        """
+
+        profiler = self.profiler
+        utils.makedirs(os.path.dirname(meta_file))
+
+        # write metadata to separate file
+        with profiler.step("metadata write"):
+            with io.open(meta_file, "w+", encoding="utf8") as fd:
+                size = fd.write(metadata)
+        profiler.add("metadata write", items=1, nbytes=size)
+
+        # write content to html source file
+        with profiler.step("html write"):
+            with open(html_file, "wb+") as fd:
+                size = fd.write(text.encode("utf-8"))
+        profiler.add("html write", items=1, nbytes=size)
+
+    @staticmethod
+    def tags_and_media(post):
+
+        """
+            return tags, image files and other media files of a toot
+            (mastotools.toot.Toot)
+        """
+
+        # hashtags, collect media/image file paths
+        tags, media_files, image_files = list(post.tags), [], []
+
+        # images and other media files
+        for media in post.attachments:
+            # media type is either audio or video
+            _mediatype = media.media_type.split("/")[0]
+            tags.append(_mediatype)
+            # tuple of appended media files as "(audio, path)"
+            # tuple of appended image files as ("path, description")
+            image_files.append((media.url, media.name)) if _mediatype == "image"\
+                else media_files.append((_mediatype, media.url))
+
+        return tags, image_files, media_files
+
+    def prepare_content(self, content_raw, image_files, media_files, domain):
+
+        """
+            edit html source in preparation of the Nikola build process:
+                - remove occasional (dunno why) extra link to media files
+                - point hashtag links to the site's tag pages
+                  (see mastotools.content)
+                - copy image files to images folder
+                - offer smaller variants of images (see mastotools.variants)
+                - copy audio/video files to files folder
+                  (both content-addressed, see copy_media)
+                - add media tag(s) to meta info
+                - show image description beneath image
+                - add div with style to source for gray background with
+                  provided custom.css (see README)
+        """
+
+        # remove links to media files (http://instance.domain/media/...)
+        # and the paragraphs left empty, hashtag links go to the site's tag
+        # pages unless disabled in the config
+        html = [rewrite(content_raw,
+                        domain + "/media/",
+                        tag_link if self.config.get("local_tag_links", True)
+                        else None,
+                        )]
+
+        for f, descr in image_files:
+            # file structure is
+            # /media_attachments/files/123/123/123/original/dfghjdfghj.png
+            # files are stored by content hash in the images folder
+            rel = self.copy_media(f, "images")
+            if rel is None:
+                continue
+            src = os.path.join(*self.up, "images", *rel.split("/"))
+
+            # variants are made after all posts are written, see
+            # CommandImportMastodon.image_variants
+            variants = ""
+            if self.widths:
+                variants = srcset(src,
+                                  self.manifest.media["images/" + rel]
+                                  .get("width"),
+                                  self.widths,
+                                  )
+
+            html.append("""<p><img src="{}"{}></p>\n""".format(src,
+                                                                variants,
+                                                                ))
+
+            if descr != "None":
+                html.append("""<div class="comments"><p><i>Image description:</i> {}</p></div>\n""".format(descr))
+
+        for t, f in media_files:
+            rel = self.copy_media(f, "files")
+            if rel is None:
+                continue
+
+            html.append("""<p><{0} controls><source src="{1}" type="{0}/{2}"></{0}></p>\n""".format(
+                t,  # audio or video
+                os.path.join(*self.up, "files", *rel.split("/")),
+                f.split(".")[1],    # suffix
+                ))
+
+        source_file = "<div class=\"main-content\">{}</div>".format("".join(html))
+
+        return source_file
+
+    def copy_media(self, url, folder):
+
+        """
+            copy media file from the archive to the images/files folder of
+            the site, returns its path relative to that folder
+
+            files are stored by content hash so identical files are only
+            stored once and files with the same name don't overwrite each
+            other; files already in place from a previous import are not
+            copied again; returns None for files missing in the archive
+        """
+
+        if not self.source.exists(url):
+            print("media file missing in the archive, skipped:", url)
+            return None
+        rel = media_path(self.manifest.media_hash(self.source, url), url)
+        key = "/".join((folder, rel))
+        dst = os.path.join(self.output_folder, folder, *rel.split("/"))
+        if key in self._queued:
+            return rel
+        if not self.manifest.media_unchanged(
+                key,
+                dst,
+                self.config["watermark_text"] if folder == "images" else None,
+                ):
+            self.manifest.add_media(key)
+            if folder == "images" and self.widths:
+                # the file isn't in place yet
+                self.manifest.set_media_width(key,
+                                              self.source.image_width(url))
+            self._queued.add(key)
+            self.ops.append([COPY, key, dst, url, self.source.stat(url)[0]])
+        elif folder == "images" and self.widths:
+            # manifest of an import without image variants
+            self.manifest.media_width(key, dst)
+        return rel
+
+    def write_file(self, path, text):
+        with self.profiler.step("index write"):
+            data = file_data(path, text)
+            utils.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(data)
+        self.profiler.add("index write", items=1, nbytes=len(data))
+
+    def remove_file(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self._emptied.add(os.path.dirname(path))
+
+    def copy_file(self, url, dst):
+        with self.profiler.step("media copy"):
+            self.source.copy(url, dst, self.config.get("hardlink_media"))
+        self.profiler.add("media copy",
+                          items=1,
+                          nbytes=os.path.getsize(dst)
+                          if self.profiler.enabled else 0,
+                          )
+
+    def flush(self):
+
+        """
+            wait until all files are written
+        """
+
+        self.io.flush()
+
+    def close(self):
+
+        """
+            wait until all files are written and stop the I/O threads
+        """
+
+        self.io.close()
+        # folders of the dated layout left empty by removed posts, only
+        # when nothing is written any more
+        posts = os.path.join(self.output_folder, "posts")
+        for folder in sorted(self._emptied, reverse=True):
+            while folder.startswith(posts + os.sep):
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    break
+                folder = os.path.dirname(folder)
+        self._emptied = set()
+
+    def metadata_text(self, title, slug, post_date, description, tags, more):
+
+        """
+            content of a .meta file, bluntly stolen from the original
+            Google+ import plugin (same as basic_import's write_metadata but
+            without the need for a site object so it works in worker
+            processes)
+        """
+
+        data = {"title": title,
+                "slug": slug,
+                "date": post_date,
+                "tags": ",".join(tags),
+                "description": description,
+                }
+        data.update(more)
+        return utils.write_metadata(data,
+                                    metadata_format=self.metadata_format,
+                                    comment_wrap=False,
+                                    )
+
+
+# state of a worker process
+_writer = None
+
+
+def _init_worker(config, output_folder, source, manifest, metadata_format,
+                 profile):
+    global _writer
+    source.reopen()
+    _writer = PostWriter(config,
+                         output_folder,
+                         source,
+                         Manifest(output_folder),
+                         metadata_format,
+                         Profiler(profile),
+                         )
+    # the manifest of the main process, it may differ from the saved one
+    _writer.manifest.load_data(manifest)
+
+
+def _write_chunk(chunk):
+    counts = Counter(_writer.write(*job) for job in chunk)
+    return (counts,
+            _writer.pop_ops(),
+            _writer.pop_docs(),
+            _writer.manifest.pop_changes(),
+            _writer.profiler.pop_steps(),
+            )
+
+
+def plan_posts(writer, jobs, plan, index=None, workers=1,
+               chunk_size=CHUNK_SIZE):
+
+    """
+        add the operations writing the posts of an iterable of (slug, toot,
+        replies) to an ImportPlan and all posts to a SearchIndex (unless
+        None), returns a Counter of written (to be written) and unchanged
+        posts
+
+        with more than one worker the posts are prepared by a process pool;
+        only a few chunks per worker are in flight at any time so memory
+        stays bounded with a streamed outbox
+    """
+
+    counts = Counter()
+    progress = writer.profiler.progress
+
+    if workers == 1:
+        for job in prefetch(jobs):
+            counts[writer.write(*job)] += 1
+            for op in writer.pop_ops():
+                plan.add(op)
+            for doc in writer.pop_docs():
+                if index is not None:
+                    index.add(*doc)
+            progress(sum(counts.values()))
+        return counts
+
+    pending = deque()
+
+    def merge(future):
+        chunk_counts, ops, docs, changes, steps = future.result()
+        counts.update(chunk_counts)
+        for op in ops:
+            plan.add(op)
+        for doc in docs:
+            if index is not None:
+                index.add(*doc)
+        writer.manifest.merge_changes(changes)
+        writer.profiler.merge_steps(steps)
+        progress(sum(counts.values()))
+
+    # only needed here, importing it takes a while
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(writer.config,
+                                       writer.output_folder,
+                                       writer.source,
+                                       writer.manifest.data(),
+                                       writer.metadata_format,
+                                       writer.profiler.enabled,
+                                       ),
+                             ) as pool:
+        # start the worker processes before the thread reading the outbox,
+        # forking while other threads are running may copy locks in a held
+        # state
+        pool.submit(int).result()
+
+        chunk = []
+        for job in prefetch(jobs):
+            chunk.append(job)
+            if len(chunk) < chunk_size:
+                continue
+            pending.append(pool.submit(_write_chunk, chunk))
+            chunk = []
+            if len(pending) >= 2 * workers:
+                merge(pending.popleft())
+        if chunk:
+            pending.append(pool.submit(_write_chunk, chunk))
+        while pending:
+            merge(pending.popleft())
+
+    return counts
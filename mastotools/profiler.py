@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+    opt-in instrumentation of an import
+
+    an import is divided into phases (reading the config, generating the
+    site, importing posts, ...), within a phase single steps (parsing,
+    classifying, rewriting content, copying media, ...) are timed every
+    time they are executed; time spent in nested steps is only counted for
+    the innermost step
+
+    steps may be executed in several threads at once, their times add up
+
+    a disabled profiler does nothing, its steps are empty context managers
+"""
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_NULL = nullcontext()
+
+
+class Profiler:
+
+    """
+        collects time, number of calls, items and bytes per phase and step
+    """
+
+    def __init__(self, enabled=False, cprofile=False, stream=sys.stderr,
+                 interval=1.0):
+        self.enabled = enabled or cprofile
+        self.stream = stream
+        # seconds between progress lines
+        self.interval = interval
+        # phase name -> {"seconds", "items", "bytes", "steps"}, in order
+        self.phases = {}
+        # steps of the current phase, name -> [seconds, calls, items, bytes]
+        self.steps = {}
+        self._phase = None
+        self._phase_start = None
+        # per thread: time spent in nested steps of the steps being executed
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._progress = None
+        self._cprofile = None
+        if cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+        self._start = time.perf_counter()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    @contextmanager
+    def phase(self, name):
+
+        """
+            time a phase of the import
+        """
+
+        if not self.enabled:
+            yield
+            return
+        self._phase = {"seconds": 0.0, "items": 0, "bytes": 0, "steps": {}}
+        self.phases[name] = self._phase
+        self.steps = self._phase["steps"]
+        start = self._phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phase["seconds"] = time.perf_counter() - start
+            self.end_progress()
+            self._phase = None
+            self.steps = {}
+
+    def count(self, items=0, nbytes=0):
+
+        """
+            count items and bytes processed by the current phase
+        """
+
+        if self._phase is not None:
+            self._phase["items"] += items
+            self._phase["bytes"] += nbytes
+
+    def step(self, name):
+
+        """
+            context manager timing a step
+        """
+
+        if not self.enabled:
+            return _NULL
+        return self._step(name)
+
+    @contextmanager
+    def _step(self, name):
+        try:
+            stack = self._local.nested
+        except AttributeError:
+            stack = self._local.nested = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                entry = self._entry(name)
+                entry[0] += elapsed - nested
+                entry[1] += 1
+
+    def add(self, name, items=0, nbytes=0):
+
+        """
+            count items and bytes processed by a step
+        """
+
+        if self.enabled:
+            with self._lock:
+                entry = self._entry(name)
+                entry[2] += items
+                entry[3] += nbytes
+
+    def _entry(self, name):
+        try:
+            return self.steps[name]
+        except KeyError:
+            entry = self.steps[name] = [0.0, 0, 0, 0]
+            return entry
+
+    def iterate(self, name, iterable):
+
+        """
+            time getting the items of an iterable as a step, e.g. parsing
+        """
+
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iterable)
+
+    def _iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self._step(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            self.add(name, items=1)
+            yield item
+
+    def pop_steps(self):
+
+        """
+            return and reset the steps collected so far, used by worker
+            processes to hand their numbers to the main process
+        """
+
+        with self._lock:
+            steps, self.steps = self.steps, {}
+        return steps
+
+    def merge_steps(self, steps):
+        with self._lock:
+            for name, (seconds, calls, items, nbytes) in steps.items():
+                entry = self._entry(name)
+                entry[0] += seconds
+                entry[1] += calls
+                entry[2] += items
+                entry[3] += nbytes
+
+    def progress(self, items, label="posts"):
+
+        """
+            print the number of items processed by the current phase and the
+            throughput now and then, bytes are the bytes of all steps
+        """
+
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._progress is None:
+            # throughput since the start of the phase
+            self._progress = [self._phase_start or now, now - self.interval]
+        start, last = self._progress
+        if now - last < self.interval:
+            return
+        self._progress[1] = now
+        elapsed = max(now - start, 1e-9)
+        with self._lock:
+            nbytes = sum(entry[3] for entry in self.steps.values())
+        self.stream.write("\r{}: {} ({:.1f} {}/sec, {:.1f} MB/sec)".format(
+            label,
+            items,
+            items / elapsed,
+            label,
+            nbytes / 2 ** 20 / elapsed,
+        ))
+        self.stream.flush()
+
+    def end_progress(self):
+
+        """
+            finish the progress line before printing something else
+        """
+
+        if self._progress is not None:
+            self.stream.write("\n")
+            self._progress = None
+
+    def report(self):
+
+        """
+            the collected numbers as a dict
+        """
+
+        phases = {}
+        for name, phase in self.phases.items():
+            seconds = phase["seconds"]
+            phases[name] = {
+                "seconds": seconds,
+                "items": phase["items"],
+                "bytes": phase["bytes"],
+                "items_per_sec": phase["items"] / seconds if seconds else None,
+                "mb_per_sec": phase["bytes"] / 2 ** 20 / seconds
+                if seconds else None,
+                "steps": {step: {"seconds": s,
+                                 "calls": calls,
+                                 "items": items,
+                                 "bytes": nbytes,
+                                 }
+                          for step, (s, calls, items, nbytes)
+                          in phase["steps"].items()},
+            }
+        return {"seconds": time.perf_counter() - self._start,
+                "phases": phases,
+                }
+
+    def finish(self, report_file=None, cprofile_file=None):
+
+        """
+            print a summary, write the JSON report and the cProfile stats
+            (main process only)
+        """
+
+        if not self.enabled:
+            return
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            if cprofile_file:
+                self._cprofile.dump_stats(cprofile_file)
+                print("cProfile stats written to", cprofile_file)
+
+        report = self.report()
+        print()
+        print("Import profile (total {:.2f} s)".format(report["seconds"]))
+        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+        for name, phase in report["phases"].items():
+            print("{:<30}{:>9.2f} s{:>10} items{:>10.1f} MB".format(
+                name, phase["seconds"], phase["items"],
+                phase["bytes"] / 2 ** 20))
+            for step, entry in phase["steps"].items():
+                # steps of worker processes add up to more than the phase
+                print("    {:<26}{:>9.2f} s{:>10} calls{:>10.1f} MB".format(
+                    step, entry["seconds"], entry["calls"],
+                    entry["bytes"] / 2 ** 20))
+
+        if report_file:
+            with open(report_file, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print("profile report written to", report_file)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+    incremental reader for the ActivityPub collections of a Mastodon archive
+
+    outbox.json and likes.json are single JSON objects with all the
+    interesting stuff in one huge "orderedItems" array, loading them with
+    json.load means keeping the whole archive in memory; the reader below
+    decodes one array item at a time instead
+"""
+
+import json
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = " \t\n\r"
+
+
+class OrderedItemsReader:
+
+    """
+        iterate over the "orderedItems" of an ActivityPub collection file
+
+        - `f` is a file object opened in text mode
+        - top level fields that come before the array (like "totalItems")
+          are collected in `header` while reading
+        - with close=True the file is closed once iteration has finished
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE, close=False):
+        self._f = f
+        self._close = close
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self.header = {}
+
+    def __iter__(self):
+        try:
+            yield from self._collection()
+        finally:
+            if self._close:
+                self._f.close()
+
+    def _collection(self):
+        self._expect("{")
+        while True:
+            if self._peek() == "}":
+                return
+            key = self._decode()
+            self._expect(":")
+            if key == "orderedItems":
+                yield from self._items()
+            else:
+                self.header[key] = self._decode()
+            if self._peek() == ",":
+                self._pos += 1
+
+    def _items(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._decode()
+            # drop consumed input so the buffer never holds more than the
+            # current item plus one chunk
+            if self._pos > self._chunk_size:
+                self._buf = self._buf[self._pos:]
+                self._pos = 0
+            c = self._peek()
+            self._pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError(
+                    "unexpected {!r} in orderedItems array".format(c))
+
+    def _fill(self, size=None):
+        chunk = self._f.read(size or self._chunk_size)
+        if not chunk:
+            self._eof = True
+        self._buf += chunk
+
+    def _peek(self):
+        """return next non-whitespace character without consuming it"""
+        while True:
+            while self._pos < len(self._buf) \
+                    and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                raise ValueError("unexpected end of file")
+            self._fill()
+
+    def _expect(self, char):
+        c = self._peek()
+        if c != char:
+            raise ValueError("expected {!r}, got {!r}".format(char, c))
+        self._pos += 1
+
+    def _decode(self):
+        """decode the next JSON value, reading more input as needed"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            else:
+                # a number at the end of the buffer may be cut off
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            # grow reads with the pending value to avoid re-decoding a
+            # large toot over and over again
+            self._fill(max(self._chunk_size, len(self._buf) - self._pos))
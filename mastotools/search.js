@@ -0,0 +1,204 @@
+/*
+    search the imported toots in the browser
+
+    loads the index files written by the import (see mastotools/search.py)
+    on demand: index.json first, then only the term shards of the words
+    typed and the post shards of the results shown; every word has to be
+    found, the last one may be the start of a word (search as you type)
+
+    <script src="search.js" data-index="folder of index.json"
+            data-root="site root relative to the page"></script>
+*/
+
+(function () {
+    "use strict";
+
+    var script = document.currentScript;
+    var base = script.getAttribute("data-index");
+    var root = script.getAttribute("data-root") || "";
+    // results shown at a time
+    var PAGE = 20;
+    var WORD = /[\p{L}\p{N}_]+/gu;
+
+    var input = document.getElementById("search-input");
+    var status = document.getElementById("search-status");
+    var results = document.getElementById("search-results");
+
+    var info = null;
+    // promises of loaded files by path
+    var cache = {};
+
+    function load(path) {
+        if (!(path in cache)) {
+            cache[path] = fetch(base + path).then(function (response) {
+                if (!response.ok) {
+                    throw new Error(path + ": " + response.status);
+                }
+                return response.arrayBuffer();
+            }).then(function (buffer) {
+                var bytes = new Uint8Array(buffer);
+                // some servers send .gz files with Content-Encoding: gzip,
+                // the browser has unpacked them already
+                if (bytes[0] === 0x1f && bytes[1] === 0x8b) {
+                    var stream = new Blob([bytes]).stream()
+                        .pipeThrough(new DecompressionStream("gzip"));
+                    return new Response(stream).text();
+                }
+                return new TextDecoder().decode(bytes);
+            }).then(JSON.parse);
+        }
+        return cache[path];
+    }
+
+    function chars(text) {
+        return Array.from(text).length;
+    }
+
+    function words(text) {
+        return (text.normalize("NFC").toLowerCase().match(WORD) || [])
+            .filter(function (word) {
+                return chars(word) >= info.min_length;
+            });
+    }
+
+    function hex(text) {
+        return Array.from(new TextEncoder().encode(text), function (b) {
+            return b.toString(16).padStart(2, "0");
+        }).join("");
+    }
+
+    function shard(prefix) {
+        return load("t/" + hex(prefix) + ".json.gz");
+    }
+
+    function decode(deltas) {
+        var numbers = [];
+        var nr = 0;
+        for (var i = 0; i < deltas.length; i++) {
+            nr += deltas[i];
+            numbers.push(nr);
+        }
+        return numbers;
+    }
+
+    // post numbers of a word, prefix: of all words starting with it
+    async function postings(word, prefix) {
+        var shards = info.shards.filter(function (p) {
+            return word.startsWith(p) || (prefix && p.startsWith(word));
+        });
+        if (!prefix) {
+            // a term is in the shard of its longest prefix
+            shards = shards.sort(function (a, b) {
+                return chars(b) - chars(a);
+            }).slice(0, 1);
+        }
+        var found = new Set();
+        var data = await Promise.all(shards.map(shard));
+        data.forEach(function (terms) {
+            Object.keys(terms).forEach(function (term) {
+                if (term === word || (prefix && term.startsWith(word))) {
+                    decode(terms[term]).forEach(function (nr) {
+                        found.add(nr);
+                    });
+                }
+            });
+        });
+        return found;
+    }
+
+    async function search(query) {
+        var list = words(query);
+        if (!list.length) {
+            return null;
+        }
+        var sets = await Promise.all(list.map(function (word, i) {
+            return postings(word, i === list.length - 1);
+        }));
+        sets.sort(function (a, b) {
+            return a.size - b.size;
+        });
+        var found = Array.from(sets[0]).filter(function (nr) {
+            return sets.every(function (set) {
+                return set.has(nr);
+            });
+        });
+        // newest first
+        return found.sort(function (a, b) {
+            return b - a;
+        });
+    }
+
+    async function show(found, start) {
+        var shown = found.slice(start, start + PAGE);
+        var docs = await Promise.all(shown.map(function (nr) {
+            return load("d/" + Math.floor(nr / info.docs_per_shard) +
+                        ".json.gz").then(function (shard) {
+                return shard[nr % info.docs_per_shard];
+            });
+        }));
+        docs.forEach(function (doc) {
+            var item = document.createElement("div");
+            item.className = "search-result";
+            var link = document.createElement("a");
+            link.href = root + doc[0];
+            link.textContent = doc[1];
+            var text = document.createElement("p");
+            text.textContent = doc[2];
+            item.appendChild(link);
+            item.appendChild(text);
+            results.appendChild(item);
+        });
+        if (start + PAGE < found.length) {
+            var more = document.createElement("button");
+            more.type = "button";
+            more.textContent = "more results";
+            more.addEventListener("click", function () {
+                more.remove();
+                show(found, start + PAGE);
+            });
+            results.appendChild(more);
+        }
+    }
+
+    // only the results of the latest query are shown
+    var current = 0;
+
+    async function update() {
+        var query = input.value;
+        var nr = ++current;
+        try {
+            info = info || await load("index.json");
+            var found = await search(query);
+            if (nr !== current) {
+                return;
+            }
+            results.textContent = "";
+            if (found === null) {
+                status.textContent = "";
+                return;
+            }
+            status.textContent = found.length + " of " + info.docs +
+                " posts found";
+            await show(found, 0);
+        } catch (e) {
+            status.textContent = "Search failed: " + e.message;
+        }
+    }
+
+    var timer = null;
+    input.addEventListener("input", function () {
+        clearTimeout(timer);
+        timer = setTimeout(update, 150);
+    });
+    input.form.addEventListener("submit", function (event) {
+        event.preventDefault();
+        update();
+    });
+
+    // search.html?q=words
+    var query = new URLSearchParams(window.location.search).get("q");
+    if (query) {
+        input.value = query;
+        update();
+    }
+}());
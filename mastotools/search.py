@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+    full-text search of the imported toots in the browser
+
+    the words of every post (text, image descriptions, hashtags) are
+    collected while the posts are prepared; the inverted index (word ->
+    numbers of the posts containing it) is written as gzipped JSON files
+    in the site's files folder, search.js (next to this module) only loads
+    the files a query needs:
+
+        files/search/index.json     number of posts, list of term shards
+        files/search/t/<hex>.json.gz
+                                    terms starting with a prefix (UTF-8 hex
+                                    encoded file name) -> delta encoded
+                                    post numbers
+        files/search/d/<n>.json.gz  [url, date, snippet] of DOCS_PER_SHARD
+                                    posts each
+
+    terms are sharded by their first two characters, shards with too many
+    entries are split by one more character (up to MAX_PREFIX), a term is
+    stored in the shard of the longest prefix listed in index.json; words
+    are found the same way in search.js (lower case, NFC, \\w+ runs of at
+    least MIN_LENGTH characters)
+
+    posts are numbered in the order of the import (oldest first)
+"""
+
+import html
+import json
+import os
+import re
+import unicodedata
+from array import array
+from collections import defaultdict
+
+from mastotools.content import END, START, TEXT, tokens
+
+VERSION = 1
+
+FOLDER = "search"
+
+MIN_LENGTH = 2
+# post numbers per term shard before it's split by a longer prefix
+SHARD_POSTINGS = 20000
+MAX_PREFIX = 4
+DOCS_PER_SHARD = 500
+# characters of text shown in search results
+SNIPPET_LENGTH = 200
+
+_WORD = re.compile(r"\w+")
+
+# elements between words
+_BLOCKS = {"p", "br", "div", "li", "ul", "ol", "blockquote", "pre",
+           "h1", "h2", "h3", "h4", "h5", "h6"}
+
+
+def plain_text(content):
+
+    """
+        text of a toot's HTML content, whitespace collapsed
+    """
+
+    parts = []
+    for token in tokens(content or ""):
+        if token.kind == TEXT:
+            parts.append(token.raw)
+        elif token.kind in (START, END) and token.name in _BLOCKS:
+            parts.append(" ")
+    return " ".join(html.unescape("".join(parts)).split())
+
+
+def words(text):
+
+    """
+        search terms of a text
+    """
+
+    return {word for word
+            in _WORD.findall(unicodedata.normalize("NFC", text).lower())
+            if len(word) >= MIN_LENGTH}
+
+
+def snippet(text):
+    if len(text) <= SNIPPET_LENGTH:
+        return text
+    return text[:SNIPPET_LENGTH].rsplit(" ", 1)[0] + " …"
+
+
+def document(url, post, replies=()):
+
+    """
+        (url, date, snippet, terms) of a post made of a toot and its
+        replies (mastotools.toot.Toot), runs in the worker processes
+    """
+
+    terms = set()
+    first = None
+    for toot in (post, *replies):
+        text = plain_text(toot.content)
+        if first is None:
+            first = text
+        terms |= words(text)
+        terms |= words(" ".join(tag.lstrip("#") for tag in toot.tags))
+        for media in toot.attachments:
+            if media.name:
+                terms |= words(media.name)
+    return url, post.published[:10], snippet(first), sorted(terms)
+
+
+def shard_name(prefix):
+    return prefix.encode("utf-8").hex()
+
+
+class SearchIndex:
+
+    """
+        inverted index of the posts of an import, posts are added in order
+    """
+
+    def __init__(self):
+        # [url, date, snippet] per post number
+        self.docs = []
+        self.postings = defaultdict(lambda: array("I"))
+
+    def add(self, url, date, text, terms):
+        nr = len(self.docs)
+        self.docs.append([url, date, text])
+        for term in terms:
+            self.postings[term].append(nr)
+
+    def _shards(self, terms, length=MIN_LENGTH):
+
+        """
+            (prefix, terms) of the term shards
+        """
+
+        groups = defaultdict(list)
+        for term in terms:
+            groups[term[:length]].append(term)
+        for prefix, group in sorted(groups.items()):
+            longer = [term for term in group if len(term) > length]
+            if length < MAX_PREFIX and longer \
+                    and sum(len(self.postings[term]) for term in group) \
+                    > SHARD_POSTINGS:
+                # the term that is the prefix itself stays
+                if len(longer) < len(group):
+                    yield prefix, [prefix]
+                yield from self._shards(longer, length + 1)
+            else:
+                yield prefix, group
+
+    def files(self):
+
+        """
+            (path relative to the site, JSON text) of all index files,
+            files ending in .gz are meant to be compressed
+        """
+
+        shards = []
+        for prefix, terms in self._shards(self.postings):
+            shards.append(prefix)
+            data = {}
+            for term in sorted(terms):
+                numbers = self.postings[term]
+                data[term] = [numbers[0]] + [b - a for a, b
+                                             in zip(numbers, numbers[1:])]
+            yield ("/".join(("files", FOLDER, "t",
+                             shard_name(prefix) + ".json.gz")),
+                   _dumps(data))
+
+        for start in range(0, len(self.docs), DOCS_PER_SHARD):
+            yield ("/".join(("files", FOLDER, "d",
+                             "{}.json.gz".format(start // DOCS_PER_SHARD))),
+                   _dumps(self.docs[start:start + DOCS_PER_SHARD]))
+
+        yield ("/".join(("files", FOLDER, "index.json")),
+               _dumps({"version": VERSION,
+                       "docs": len(self.docs),
+                       "docs_per_shard": DOCS_PER_SHARD,
+                       "min_length": MIN_LENGTH,
+                       "shards": shards,
+                       }))
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def static_files():
+
+    """
+        (path relative to the site, text) of the script and the search page
+    """
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "search.js"),
+              encoding="utf-8") as f:
+        script = f.read()
+    yield "/".join(("files", FOLDER, "search.js")), script
+    # pages/search.html ends up as /pages/search/index.html
+    yield "pages/search.html", """<form class="search-form" role="search">
+<input type="search" id="search-input" placeholder="Search toots" autocomplete="off" autofocus>
+</form>
+<p id="search-status"></p>
+<div id="search-results"></div>
+<script src="../../files/{0}/search.js" data-index="../../files/{0}/" data-root="../../"></script>
+""".format(FOLDER)
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+
+"""
+    access to the content of a Mastodon archive, either extracted to a
+    folder or as the original zip or tar(.gz) file
+
+    member names are relative paths like "outbox.json" or
+    "media_attachments/files/123/456/789/original/abc.png" regardless of
+    the type of archive
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from mastotools.media import copy_file
+from mastotools.reader import OrderedItemsReader
+from mastotools.variants import image_width
+
+# members read by the plugin and the analyzer
+JSON_MEMBERS = ("outbox.json", "actor.json", "likes.json")
+MEDIA_FOLDER = "media_attachments/"
+
+COPY_BUFSIZE = 1 << 20
+
+
+def file_hash(path, chunk_size=COPY_BUFSIZE):
+
+    """
+        sha1 hex digest of a file's content
+    """
+
+    with open(path, "rb") as f:
+        return stream_hash(f, chunk_size)
+
+
+def stream_hash(f, chunk_size=COPY_BUFSIZE):
+    h = hashlib.sha1()
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def member_name(name):
+
+    """
+        normalize archive member names and media URLs from the outbox
+        ("/media_attachments/...", "./outbox.json")
+    """
+
+    while name.startswith("./"):
+        name = name[2:]
+    return name.lstrip("/")
+
+
+def write_stream(src, dst):
+
+    """
+        write the content of a file object to dst, dst either is complete
+        or not there
+    """
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = "{}.part{}".format(dst, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(src, f, COPY_BUFSIZE)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def open_archive(path, staging=None, widths=False):
+
+    """
+        return a source for an extracted archive folder or a zip/tar
+        archive file
+    """
+
+    if os.path.isdir(path):
+        return FolderSource(path)
+    if zipfile.is_zipfile(path):
+        return ZipSource(path)
+    if tarfile.is_tarfile(path):
+        return TarSource(path, staging, widths)
+    raise ValueError("{} is neither an extracted archive folder nor a "
+                     "zip or tar archive".format(path))
+
+
+class FolderSource:
+
+    """
+        extracted archive folder
+    """
+
+    # members can be read in any order, see TarSource
+    sequential = False
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, *member_name(name).split("/"))
+
+    def open(self, name):
+        return open(self.path(name), "rb")
+
+    def open_text(self, name):
+        return io.TextIOWrapper(self.open(name), encoding="utf-8")
+
+    def ordered_items(self, name):
+
+        """
+            reader yielding the items of a collection file one at a time
+        """
+
+        return OrderedItemsReader(self.open_text(name), close=True)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def stat(self, name):
+        st = os.stat(self.path(name))
+        return st.st_size, st.st_mtime_ns
+
+    def hash(self, name):
+        return file_hash(self.path(name))
+
+    def copy(self, name, dst, hardlink=False):
+        copy_file(self.path(name), dst, hardlink)
+
+    def copy_each(self, jobs, hardlink=False):
+
+        """
+            copy members [(member name, destination)], yields the number of
+            every job as soon as it's done
+        """
+
+        for nr, (name, dst) in enumerate(jobs):
+            self.copy(name, dst, hardlink)
+            yield nr
+
+    def image_width(self, name):
+
+        """
+            width of an image member, see mastotools.variants.image_width
+        """
+
+        with self.open(name) as f:
+            return image_width(f)
+
+    def media_files(self):
+
+        """
+            yield (member name, size) of all media attachments
+        """
+
+        top = self.path(MEDIA_FOLDER)
+        if not os.path.isdir(top):
+            # export without media
+            return
+        stack = [top]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        rel = os.path.relpath(entry.path, self.root)
+                        yield (rel.replace(os.sep, "/"),
+                               entry.stat(follow_symlinks=False).st_size)
+
+    def reopen(self):
+
+        """
+            called in worker processes before the source is used
+        """
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ZipSource(FolderSource):
+
+    """
+        zip archive (current Mastodon versions), members are read directly
+        from the archive without extracting them
+    """
+
+    def __init__(self, path):
+        self.root = path
+        self._zip = zipfile.ZipFile(path)
+        # process the zip file has been opened by
+        self._pid = os.getpid()
+        self._members = {member_name(info.filename): info
+                         for info in self._zip.infolist()
+                         if not info.is_dir()}
+
+    def __getstate__(self):
+        # open zip file can't be passed to worker processes
+        return {"root": self.root}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"])
+
+    def reopen(self):
+        # forked worker processes share the offset of the open zip file
+        # with the parent and each other, reads would get mixed up; a
+        # source passed by pickling has opened the zip file already
+        if self._pid != os.getpid():
+            self._zip.close()
+            self._zip = zipfile.ZipFile(self.root)
+            self._pid = os.getpid()
+
+    def open(self, name):
+        return self._zip.open(self._members[member_name(name)])
+
+    def exists(self, name):
+        return member_name(name) in self._members
+
+    def stat(self, name):
+        info = self._members[member_name(name)]
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        return info.file_size, int(mtime) * 10 ** 9
+
+    def hash(self, name):
+        with self.open(name) as f:
+            return stream_hash(f)
+
+    def copy(self, name, dst, hardlink=False):
+        # members are compressed, nothing to link or clone
+        with self.open(name) as src:
+            write_stream(src, dst)
+
+    def media_files(self):
+        for name, info in self._members.items():
+            if name.startswith(MEDIA_FOLDER):
+                yield name, info.file_size
+
+    def close(self):
+        self._zip.close()
+
+
+class TarSource(FolderSource):
+
+    """
+        tar(.gz) archive (older Mastodon versions)
+
+        compressed tar files can only be read front to back and the members
+        come in no particular order (the profile is usually last), so the
+        archive is read in one sequential pass when it's opened: the JSON
+        files are written to a staging folder, media attachments are only
+        hashed (and measured with widths=True, see image_width); media
+        files are copied by another pass that writes the wanted members
+        straight to their destination, see copy_each
+    """
+
+    sequential = True
+
+    def __init__(self, path, staging=None, widths=False):
+        self.archive = path
+        self.root = tempfile.mkdtemp(prefix=".import_mastodon-",
+                                     dir=staging,
+                                     )
+        # member name -> hash, (size, mtime) and width (images)
+        self._hashes, self._stats, self._widths = {}, {}, {}
+        try:
+            with tarfile.open(path, "r|*") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    name = member_name(member.name)
+                    if name.startswith(MEDIA_FOLDER):
+                        # there's no second chance to read the member
+                        with tar.extractfile(member) as f:
+                            self._scan(f, name, widths)
+                    elif name in JSON_MEMBERS:
+                        self._hashes[name] = self._spool(tar, member, name)
+                    else:
+                        continue
+                    self._stats[name] = (member.size,
+                                         int(member.mtime) * 10 ** 9)
+        except BaseException:
+            self.close()
+            raise
+
+    def _spool(self, tar, member, name):
+        dst = self.path(name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        h = hashlib.sha1()
+        with tar.extractfile(member) as src, open(dst, "wb") as f:
+            for chunk in iter(lambda: src.read(COPY_BUFSIZE), b""):
+                h.update(chunk)
+                f.write(chunk)
+        os.utime(dst, (member.mtime, member.mtime))
+        return h.hexdigest()
+
+    def _scan(self, src, name, widths):
+
+        """
+            hash a media member, with widths the member is also buffered (in
+            memory, big files in the staging folder) to get its width if
+            it's an image
+        """
+
+        if not widths:
+            self._hashes[name] = stream_hash(src)
+            return
+        h = hashlib.sha1()
+        with tempfile.SpooledTemporaryFile(max_size=32 << 20,
+                                           dir=self.root,
+                                           ) as f:
+            for chunk in iter(lambda: src.read(COPY_BUFSIZE), b""):
+                h.update(chunk)
+                f.write(chunk)
+            f.seek(0)
+            self._widths[name] = image_width(f)
+        self._hashes[name] = h.hexdigest()
+
+    def exists(self, name):
+        return member_name(name) in self._hashes
+
+    def stat(self, name):
+        return self._stats[member_name(name)]
+
+    def hash(self, name):
+        return self._hashes[member_name(name)]
+
+    def image_width(self, name):
+        return self._widths.get(member_name(name))
+
+    def copy(self, name, dst, hardlink=False):
+        # a pass over the archive for a single file, see copy_each
+        for _ in self.copy_each([(name, dst)]):
+            pass
+
+    def copy_each(self, jobs, hardlink=False):
+
+        """
+            copy members [(member name, destination)] in one pass over the
+            archive, members are written straight to their destination;
+            yields the number of every job as soon as it's done
+        """
+
+        wanted = {}
+        for nr, (name, dst) in enumerate(jobs):
+            wanted.setdefault(member_name(name), []).append((nr, dst))
+        if not wanted:
+            return
+        with tarfile.open(self.archive, "r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                todo = wanted.pop(member_name(member.name), None)
+                if todo is None:
+                    continue
+                first = todo[0][1]
+                with tar.extractfile(member) as src:
+                    write_stream(src, first)
+                for _, dst in todo[1:]:
+                    # the same member in another folder
+                    copy_file(first, dst)
+                for nr, _ in todo:
+                    yield nr
+                if not wanted:
+                    break
+
+    def media_files(self):
+        for name, (size, _) in self._stats.items():
+            if name.startswith(MEDIA_FOLDER):
+                yield name, size
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
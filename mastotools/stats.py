@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+    classification and statistics of outbox activities
+
+    used by the import plugin and analyze_archive.py, every activity is
+    classified once and all numbers are collected in a single pass with
+    counters (nothing is kept per toot)
+"""
+
+from collections import Counter, namedtuple
+
+from mastotools.content import leading_mention
+
+PUBLIC = "public"
+FOLLOWERS_ONLY = "followers only"
+DIRECT = "direct message"
+
+# orphaned replies: the reply starts with addressing a user but the toot
+# it replied to is gone
+VANISHED = "vanished"   # not hyperlinked, the profile is gone
+BROKEN = "broken"       # hyperlinked, the original post is gone
+
+# type: Create = toot, Announce = boost
+# visibility, in_reply_to, tags, orphan are None for boosts
+Activity = namedtuple("Activity",
+                      "type object visibility in_reply_to tags orphan")
+
+
+def visibility(obj):
+
+    """
+        public posts, followers only posts, direct messages
+    """
+
+    to = obj["to"][0]
+    if to.endswith("#Public"):
+        return PUBLIC
+    if to.endswith("/followers"):
+        return FOLLOWERS_ONLY
+    return DIRECT
+
+
+def orphaned_reply(content):
+
+    """
+        (VANISHED, "@user") or (BROKEN, profile URL) if the toot starts with
+        addressing a user, None otherwise
+    """
+
+    mention = leading_mention(content)
+    if mention is None:
+        return None
+    # post starts with addressing user by leading @
+    # not hyperlinked
+    if mention.url is None:
+        return VANISHED, mention.name
+    # hyperlinked
+    return BROKEN, mention.url
+
+
+def classify(value):
+
+    """
+        classify an outbox activity
+    """
+
+    obj = value["object"]
+    if not isinstance(obj, dict):
+        return Activity(value["type"], None, None, None, None, None)
+    tags = tuple(tag["name"][1:] for tag in obj["tag"]
+                 if tag["type"] == "Hashtag")
+    orphan = None
+    if value["type"] == "Create" and obj["inReplyTo"] is None:
+        orphan = orphaned_reply(obj["content"])
+    return Activity(value["type"],
+                    obj,
+                    visibility(obj),
+                    obj["inReplyTo"],
+                    tags,
+                    orphan,
+                    )
+
+
+# what an outbox activity counts for in TimelineStats, see counted():
+# type and boosted profile (None if unknown), visibility (None for
+# boosts and malformed entries, nothing below is counted then), profile
+# of the replied toot (None for original toots), publishing year (None if
+# missing), hashtags, orphan (see Activity) and the Activity itself (None
+# for malformed entries)
+Counted = namedtuple("Counted",
+                     "type boosted visibility replied year tags orphan "
+                     "activity")
+
+
+def counted(value):
+
+    """
+        classify an outbox activity for TimelineStats, the analyzer's
+        index stores the same values (see mastotools.index)
+    """
+
+    typ = boosted = activity = year = None
+    try:
+        typ = value["type"]
+        # user name list of boosts
+        if typ == "Announce":
+            boosted = value["cc"][0]
+        activity = classify(value)
+        if activity.object is not None:
+            # publishing year, first 4 characters of publishing date
+            year = value["published"][:4]
+    except (TypeError, IndexError, KeyError):
+        pass
+    if activity is None or activity.object is None:
+        return Counted(typ, boosted, None, None, None, (), None, activity)
+    return Counted(typ,
+                   boosted,
+                   activity.visibility,
+                   None if activity.in_reply_to is None
+                   # only add user name
+                   else activity.in_reply_to.split("/statuses")[0],
+                   year,
+                   activity.tags,
+                   activity.orphan,
+                   activity,
+                   )
+
+
+class TimelineStats:
+
+    """
+        numbers of an outbox, fed one activity at a time by add()
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.posttype = Counter()
+        self.visibility = Counter()
+        self.originals, self.replies = 0, 0
+        # profiles of boosted and replied toots
+        self.boosted, self.replied = Counter(), Counter()
+        self.orphaned = 0
+        self.vanished, self.broken = Counter(), Counter()
+        self.years = Counter()
+        self.hashtags = Counter()
+        # number of hashtags used in all posts
+        self.tagged_posts = 0
+
+    def add(self, value):
+
+        """
+            classify and count an activity, returns the Activity or None
+            for malformed entries
+        """
+
+        c = counted(value)
+        self.total += 1
+        if c.type is not None:
+            self.posttype[c.type] += 1
+        if c.boosted is not None:
+            self.boosted[c.boosted] += 1
+        if c.visibility is None:
+            return c.activity
+
+        self.visibility[c.visibility] += 1
+        # original toots and replies
+        if c.replied is None:
+            self.originals += 1
+        else:
+            self.replies += 1
+            self.replied[c.replied] += 1
+        if c.year is not None:
+            self.years[c.year] += 1
+        for tag in c.tags:
+            self.hashtags[tag] += 1
+        self.tagged_posts += len(c.tags)
+        if c.orphan is not None:
+            self.orphaned += 1
+            kind, who = c.orphan
+            (self.vanished if kind == VANISHED else self.broken)[who] += 1
+        return c.activity
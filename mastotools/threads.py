@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+    threads of replies to own toots
+
+    toots to be imported are collected in a map of status ID -> toot while
+    the outbox is read; afterwards every toot replying to a toot in the map
+    is attached to it, so a chain of replies to oneself ends up as one
+    thread with a single post instead of one post per toot
+"""
+
+from collections import defaultdict
+
+
+class ConversationIndex:
+
+    """
+        imported toots by status ID, fed by add() in outbox order
+    """
+
+    def __init__(self):
+        # dicts keep the insertion (= outbox) order
+        self.toots = {}
+
+    def add(self, toot):
+        self.toots[toot.id] = toot
+
+    def threads(self):
+
+        """
+            yield (first toot, [replies]) for all threads in the order of
+            their first toot, replies are in reading order (every reply
+            directly follows the toot it replies to)
+
+            toots replying to a toot that isn't imported start a thread of
+            their own
+        """
+
+        toots = self.toots
+        replies = defaultdict(list)
+        roots = []
+        for status_id, toot in toots.items():
+            parent = toot.in_reply_to
+            if parent in toots and parent != status_id:
+                replies[parent].append(status_id)
+            else:
+                roots.append(status_id)
+
+        for root in roots:
+            thread = []
+            stack = replies[root][::-1]
+            while stack:
+                status_id = stack.pop()
+                thread.append(toots[status_id])
+                stack.extend(replies[status_id][::-1])
+            yield toots[root], thread
+
+        self.toots = {}
+
+
+def threads(toots):
+
+    """
+        group toots into (first toot, [replies]), all toots are kept in
+        memory until the last one has been read
+    """
+
+    index = ConversationIndex()
+    for toot in toots:
+        index.add(toot)
+    yield from index.threads()
+
+
+def single_toots(toots):
+
+    """
+        every toot is a thread of its own
+    """
+
+    for toot in toots:
+        yield toot, []
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+    compact record of a toot to be imported
+
+    the ActivityPub objects of the outbox carry a lot of fields the import
+    doesn't need (contentMap, replies, atomUri, signatures, ...); toots are
+    kept in memory (read ahead, collected into threads, sent to worker
+    processes), so only the fields used for writing posts are taken over
+    into a slotted object while the outbox is read
+"""
+
+import sys
+from collections import namedtuple
+
+# media type as in the archive ("image/png"), path in the archive,
+# description (None if there is none)
+Attachment = namedtuple("Attachment", "media_type url name")
+
+
+class Toot:
+
+    """
+        the parts of a toot the posts are made of
+    """
+
+    __slots__ = ("id",
+                 "published",
+                 # PUBLIC, FOLLOWERS_ONLY, DIRECT of mastotools.stats
+                 "visibility",
+                 "in_reply_to",
+                 "content",
+                 # hashtag names including the "#"
+                 "tags",
+                 "attachments",
+                 )
+
+    def __init__(self, id, published, visibility, in_reply_to, content,
+                 tags=(), attachments=()):
+        self.id = id
+        self.published = published
+        self.visibility = visibility
+        self.in_reply_to = in_reply_to
+        self.content = content
+        self.tags = tags
+        self.attachments = attachments
+
+    @classmethod
+    def from_activity(cls, activity):
+
+        """
+            toot of a classified outbox activity (see mastotools.stats)
+        """
+
+        obj = activity.object
+        try:
+            # the same few hashtags are used over and over again
+            tags = tuple(sys.intern(tag["name"]) for tag in obj["tag"]
+                         if tag["type"] == "Hashtag")
+        except (TypeError, KeyError):
+            tags = ()
+        try:
+            attachments = tuple(Attachment(sys.intern(media["mediaType"]),
+                                           media["url"],
+                                           media["name"],
+                                           )
+                                for media in obj["attachment"])
+        except (TypeError, KeyError):
+            attachments = ()
+        return cls(obj["id"],
+                   obj["published"],
+                   activity.visibility,
+                   activity.in_reply_to,
+                   obj["content"],
+                   tags,
+                   attachments,
+                   )
+
+    # slotted objects have no __dict__ to pickle (worker processes)
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "Toot({!r})".format(self.id)
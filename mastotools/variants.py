@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+    smaller copies of images for responsive markup
+
+    for every image wider than a configured width a WebP copy of that
+    width is stored next to it ("ab/abcdef…-480w.webp") and offered to
+    browsers with srcset, so index pages don't load full size originals;
+    variants are made from the final (watermarked) image and are kept
+    between imports as long as the image and its watermark don't change
+
+    Pillow is imported when images are actually opened, the plugin (and
+    with it this module) is loaded by every nikola command
+"""
+
+import os
+from functools import partial
+
+FORMAT = "WEBP"
+SUFFIX = ".webp"
+
+
+def configured_widths(config):
+
+    """
+        widths of image variants from the config, empty if disabled or if
+        Pillow can't write WebP
+    """
+
+    widths = config.get("image_widths") or []
+    if not widths:
+        return []
+    from PIL import features
+    if not features.check("webp"):
+        print("Pillow has no WebP support, no image variants are made")
+        return []
+    return sorted(set(int(w) for w in widths))
+
+
+def image_width(path):
+
+    """
+        width of an image, None for files that aren't (still) images, only
+        the header is read
+    """
+
+    from PIL import Image
+    try:
+        with Image.open(path) as img:
+            if getattr(img, "is_animated", False):
+                return None
+            return img.width
+    except OSError:
+        return None
+
+
+def variant_widths(width, widths):
+
+    """
+        widths of the variants of an image, images are never enlarged
+    """
+
+    if not width:
+        return []
+    return [w for w in widths if w < width]
+
+
+def variant_path(rel, width):
+
+    """
+        path of a variant relative to the images folder
+    """
+
+    return "{}-{}w{}".format(os.path.splitext(rel)[0], width, SUFFIX)
+
+
+def srcset(src, width, widths):
+
+    """
+        srcset/sizes attributes for an image tag, empty string if there are
+        no variants
+    """
+
+    smaller = variant_widths(width, widths)
+    if not smaller:
+        return ""
+    candidates = ["{} {}w".format(variant_path(src, w), w) for w in smaller]
+    candidates.append("{} {}w".format(src, width))
+    # the image is shown as wide as the original (at most the width of the
+    # page like without srcset), browsers pick the smallest file for that
+    return """ srcset="{0}" sizes="(max-width: {1}px) 100vw, {1}px\"""".format(
+        ", ".join(candidates),
+        width,
+    )
+
+
+def make_variants(src, variants, quality=80):
+
+    """
+        write variants [(path, width)] of an image, returns the number of
+        variants written
+    """
+
+    from PIL import Image
+    try:
+        with Image.open(src) as img:
+            img.load()
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands()
+                                  or "transparency" in img.info else "RGB")
+            done = 0
+            for dst, width in sorted(variants, key=lambda v: -v[1]):
+                height = max(1, round(img.height * width / img.width))
+                out = img.resize((width, height), Image.LANCZOS,
+                                 reducing_gap=3.0)
+                tmp = "{}.tmp{}".format(dst, os.getpid())
+                try:
+                    out.save(tmp, format=FORMAT, quality=quality, method=4)
+                    os.replace(tmp, dst)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                done += 1
+    except OSError:
+        return 0
+    return done
+
+
+def _make_variants(job, quality):
+    return make_variants(*job, quality=quality)
+
+
+def make_all_variants(jobs, quality=80, workers=None):
+
+    """
+        make variants for [(image path, [(variant path, width)])] in
+        parallel, returns the number of variants written
+    """
+
+    jobs = list(jobs)
+    if not jobs:
+        return 0
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    job = partial(_make_variants, quality=quality)
+    if workers == 1:
+        return sum(map(job, jobs))
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(job,
+                            jobs,
+                            chunksize=max(1, len(jobs) // (workers * 4)),
+                            ))
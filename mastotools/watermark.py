@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+    add a horizontal text banner across the middle of images
+
+    the look imitates the former ImageMagick call
+
+        convert -background "#0008" -fill LightGray -gravity center
+            -size {w}x{h/8} -pointsize {h/20} -family "DejaVu Sans"
+            label:"{text}" {image} +swap -gravity center -composite {image}
+
+    but everything is done in-process with Pillow, spread over a pool of
+    worker processes
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache, partial
+from itertools import islice
+
+from PIL import Image, ImageDraw, ImageFont
+
+BACKGROUND = (0, 0, 0, 0x88)
+FILL = (211, 211, 211, 255)  # LightGray
+FONT = "DejaVuSans.ttf"
+
+
+@lru_cache(maxsize=256)
+def _font(size):
+    try:
+        return ImageFont.truetype(FONT, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=256)
+def banner(width, height, text):
+
+    """
+        render the text label for an image of the given size, labels are
+        cached per worker process so images of the same size share one
+    """
+
+    size = (width, max(1, height // 8))
+    label = Image.new("RGBA", size, BACKGROUND)
+    font = _font(max(1, height // 20))
+    draw = ImageDraw.Draw(label)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    draw.text(((size[0] - (right - left)) / 2 - left,
+               (size[1] - (bottom - top)) / 2 - top),
+              text,
+              fill=FILL,
+              font=font,
+              )
+    return label
+
+
+def watermark_file(path, text, out):
+
+    """
+        composite the banner onto the image and write the result to out,
+        the image itself is left alone (see watermark_each); returns False
+        for files that were skipped (no image, animated), nothing is
+        written for them
+    """
+
+    try:
+        with Image.open(path) as img:
+            # compositing one frame would ruin the animation
+            if getattr(img, "is_animated", False):
+                return False
+            img.load()
+            fmt = img.format
+            keep_alpha = fmt != "JPEG" and ("A" in img.mode
+                                            or "transparency" in img.info)
+            params = {k: img.info[k] for k in ("exif", "icc_profile")
+                      if img.info.get(k)}
+            w, h = img.size
+            out_img = img.convert("RGBA")
+    except OSError:
+        return False
+
+    label = banner(w, h, text)
+    out_img.alpha_composite(label, (0, (h - label.height) // 2))
+    if not keep_alpha:
+        out_img = out_img.convert("RGB")
+    if fmt == "JPEG":
+        params["quality"] = 92
+
+    try:
+        out_img.save(out, format=fmt, **params)
+    except BaseException:
+        # no half written images
+        if os.path.exists(out):
+            os.remove(out)
+        raise
+    return True
+
+
+def watermark_each(jobs, text, workers=None):
+
+    """
+        watermark images [(image path, path of the watermarked copy)] in
+        parallel, yields (number of the job, result of watermark_file) for
+        every job as soon as it's done; the caller replaces the image with
+        its copy
+
+        only a few jobs per worker are handed to the pool at a time, if the
+        caller stops (or fails) no further images are marked and the copies
+        of the images it hasn't been given are removed
+    """
+
+    jobs = list(jobs)
+    if not jobs:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    job = partial(watermark_file, text=text)
+    # jobs started but not handed to the caller
+    unfinished = set()
+    try:
+        if workers == 1:
+            for nr, (path, out) in enumerate(jobs):
+                unfinished.add(nr)
+                marked = job(path, out=out)
+                unfinished.discard(nr)
+                yield nr, marked
+            return
+        todo = iter(enumerate(jobs))
+        pending = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            try:
+                while True:
+                    for nr, (path, out) in islice(todo,
+                                                  2 * workers - len(pending)):
+                        unfinished.add(nr)
+                        pending[pool.submit(job, path, out=out)] = nr
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        nr = pending.pop(future)
+                        marked = future.result()
+                        unfinished.discard(nr)
+                        yield nr, marked
+            finally:
+                # the images already being marked are finished, the
+                # others are never started
+                pool.shutdown(cancel_futures=True)
+    finally:
+        for nr in unfinished:
+            out = jobs[nr][1]
+            if os.path.exists(out):
+                os.remove(out)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+    ProfileChecker against a local HTTP server
+"""
+
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mastotools.cache import ReachabilityCache
+from mastotools.checker import (CONNECTION_ERROR,
+                                TIMEOUT,
+                                ProfileChecker,
+                                )
+
+# seconds a slow profile takes to answer, longer than the checker's timeout
+SLOW = 1.5
+TIMEOUT_SECONDS = 0.5
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    """
+        /ok/..., /gone/..., /deleted/... answer 200, 410, 404,
+        /slow/... answers too late
+    """
+
+    def do_HEAD(self):
+        self.server.requests.append(self.path)
+        kind = self.path.split("/")[1]
+        if kind == "slow":
+            time.sleep(SLOW)
+        self.send_response({"gone": 410, "deleted": 404}.get(kind, 200))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return "http://127.0.0.1:{}{}".format(server.server_address[1], path)
+
+
+@pytest.fixture
+def closed_port():
+    # a port nobody listens on: connections are refused
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def checker(**kwargs):
+    kwargs.setdefault("timeout", TIMEOUT_SECONDS)
+    kwargs.setdefault("retries", 0)
+    return ProfileChecker(**kwargs)
+
+
+def test_statuses(server):
+    urls = [url(server, path) for path in ("/ok/@a", "/gone/@b",
+                                           "/deleted/@c", "/slow/@d")]
+    result = checker().check(urls)
+    assert list(result) == urls
+    assert list(result.values()) == [200, 410, 404, TIMEOUT]
+
+
+def test_duplicates_are_requested_once(server):
+    result = checker().check([url(server, "/ok/@a")] * 3)
+    assert result == {url(server, "/ok/@a"): 200}
+    assert server.requests == ["/ok/@a"]
+
+
+def test_slow_profile_does_not_take_down_host(server):
+    # the slow profile goes first, the others wait for it
+    urls = [url(server, "/slow/@a")] + [url(server, "/ok/@{}".format(i))
+                                        for i in range(5)]
+    c = checker(per_host=1)
+    result = c.check(urls)
+    assert result[urls[0]] == TIMEOUT
+    assert all(result[u] == 200 for u in urls[1:])
+    assert c.skipped == 0
+
+
+def test_unreachable_host_is_requested_once(closed_port):
+    urls = ["http://127.0.0.1:{}/@{}".format(closed_port, i)
+            for i in range(5)]
+    c = checker(per_host=1)
+    result = c.check(urls)
+    assert set(result.values()) == {CONNECTION_ERROR}
+    assert c.skipped == 4
+
+
+def test_cache(server, tmp_path):
+    cache = ReachabilityCache(str(tmp_path / "cache.sqlite"))
+    urls = [url(server, "/ok/@a"), url(server, "/gone/@b")]
+    first = checker(cache=cache).check(urls)
+    assert len(server.requests) == 2
+
+    c = checker(cache=cache)
+    assert c.check(urls) == first
+    assert c.cached == 2
+    assert len(server.requests) == 2
+
+
+def test_cache_slow_profile_does_not_take_down_host(server, tmp_path):
+    cache = ReachabilityCache(str(tmp_path / "cache.sqlite"))
+    checker(cache=cache, per_host=1).check([url(server, "/slow/@a")])
+    assert cache.hosts() == {}
+
+    c = checker(cache=cache)
+    assert c.check([url(server, "/ok/@b")]) == {url(server, "/ok/@b"): 200}
+    assert c.skipped == 0
+
+
+def test_cache_unreachable_host(closed_port, tmp_path):
+    cache = ReachabilityCache(str(tmp_path / "cache.sqlite"))
+    urls = ["http://127.0.0.1:{}/@{}".format(closed_port, i)
+            for i in range(3)]
+    checker(cache=cache, per_host=1).check(urls)
+    assert cache.hosts() == {"127.0.0.1:{}".format(closed_port):
+                             CONNECTION_ERROR}
+    # only the profile that was requested is stored
+    assert len(cache.urls(urls)) == 1
+
+    # the host is known to be down, other profiles aren't requested
+    c = checker(cache=cache)
+    new = "http://127.0.0.1:{}/@new".format(closed_port)
+    assert c.check([new]) == {new: CONNECTION_ERROR}
+    assert c.skipped == 1
+    assert cache.urls([new]) == {}
+
+
+def test_cache_expires(server, tmp_path):
+    cache = ReachabilityCache(str(tmp_path / "cache.sqlite"),
+                              ttl={"available": 0})
+    checker(cache=cache).check([url(server, "/ok/@a")])
+    c = checker(cache=cache)
+    c.check([url(server, "/ok/@a")])
+    assert c.cached == 0
+    assert len(server.requests) == 2